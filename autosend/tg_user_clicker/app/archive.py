@@ -0,0 +1,172 @@
+"""Optional local archive of every walked media item."""
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime, timezone
+import json
+import logging
+import os
+from pathlib import Path
+import re
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+# Telegram serves files in parts of up to 512 KiB; resuming on a part
+# boundary keeps every request inside one 1 MiB window.
+DEFAULT_CHUNK_SIZE = 512 * 1024
+MANIFEST_NAME = "manifest.jsonl"
+
+_UNSAFE_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+def safe_name(text: str) -> str:
+    cleaned = _UNSAFE_RE.sub("_", text).strip(" .")
+    return cleaned or "untitled"
+
+
+def archive_path(root: Path, msg: Any, *, title: str, episode: int | None) -> Path:
+    file = getattr(msg, "file", None)
+    name = getattr(file, "name", None) or f"{msg.id}{getattr(file, 'ext', '') or ''}"
+    prefix = f"{episode:03d} " if episode is not None else ""
+    return root / safe_name(title) / safe_name(f"{prefix}{name}")
+
+
+class Archiver:
+    """Downloads media in the background with a bounded pool of workers.
+
+    ``submit`` only records the item in ``state["archive_pending"]`` and puts
+    it on an in-memory queue, so the walk never waits for a download or a
+    state write; the entry reaches disk with the walk's next save. Finished
+    items are saved once the queue runs dry and on ``close``. Partial files
+    are kept as ``.part`` and resumed from their size; finished files are
+    appended to ``manifest.jsonl`` in the archive root.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        root: str,
+        *,
+        state: dict[str, Any],
+        save: Callable[[], None] | None = None,
+        workers: int = 2,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ) -> None:
+        self.client = client
+        self.root = Path(root)
+        self.state = state
+        self._save = save
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self._queue: asyncio.Queue[tuple[Any, dict[str, Any]]] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        for entry in self.state.get("archive_pending", []):
+            self._queue.put_nowait((None, entry))
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def save(self) -> None:
+        if self._save is not None:
+            self._save()
+
+    def submit(self, msg: Any, title: str, episode: int | None) -> None:
+        pending = self.state.setdefault("archive_pending", [])
+        if any(item["msg_id"] == msg.id and item["peer"] == msg.chat_id for item in pending):
+            return
+        entry = {"peer": msg.chat_id, "msg_id": msg.id, "title": title, "episode": episode}
+        pending.append(entry)
+        self._queue.put_nowait((msg, entry))
+
+    async def close(self, stop_event: asyncio.Event | None = None) -> None:
+        """Finish queued downloads; on stop, keep them pending for the next run."""
+        if not self._tasks:
+            return
+        drained = asyncio.create_task(self._queue.join())
+        waiters: list[asyncio.Future] = [drained]
+        if stop_event is not None:
+            waiters.append(asyncio.create_task(stop_event.wait()))
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        for waiter in waiters:
+            waiter.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.save()
+
+    async def _worker(self) -> None:
+        while True:
+            msg, entry = await self._queue.get()
+            try:
+                if msg is None:
+                    msg = await self.client.get_messages(entry["peer"], ids=entry["msg_id"])
+                if msg is None or not getattr(msg, "media", None):
+                    logger.warning("archive: msg_id=%s is gone, skipping", entry["msg_id"])
+                else:
+                    await self.download(msg, title=entry["title"], episode=entry["episode"])
+                self._done(entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # Left in archive_pending, retried on the next run.
+                logger.exception("archive: failed to download msg_id=%s", entry["msg_id"])
+            finally:
+                self._queue.task_done()
+
+    def _done(self, entry: dict[str, Any]) -> None:
+        pending = self.state.get("archive_pending", [])
+        self.state["archive_pending"] = [item for item in pending if item is not entry]
+        if self._queue.empty():
+            self.save()
+
+    async def download(self, msg: Any, *, title: str, episode: int | None) -> Path:
+        path = archive_path(self.root, msg, title=title, episode=episode)
+        size = getattr(getattr(msg, "file", None), "size", None) or 0
+        if path.exists() and (not size or path.stat().st_size == size):
+            return path
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        part_path = path.with_name(path.name + ".part")
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        offset -= offset % self.chunk_size
+        if offset:
+            logger.info("archive: resuming %s at %s bytes", path.name, offset)
+
+        with part_path.open("ab") as handle:
+            handle.truncate(offset)
+            async for chunk in self.client.iter_download(
+                msg.media, offset=offset, request_size=self.chunk_size
+            ):
+                handle.write(chunk)
+
+        if size and part_path.stat().st_size != size:
+            raise IOError(f"archive: size mismatch for {path.name}")
+        os.replace(part_path, path)
+        self._write_manifest(msg, path, title=title, episode=episode, size=size)
+        logger.info("archive: saved %s", path)
+        return path
+
+    def _write_manifest(
+        self,
+        msg: Any,
+        path: Path,
+        *,
+        title: str,
+        episode: int | None,
+        size: int,
+    ) -> None:
+        document = getattr(msg, "document", None)
+        record = {
+            "title": title,
+            "episode": episode,
+            "peer": msg.chat_id,
+            "msg_id": msg.id,
+            "document_id": getattr(document, "id", None),
+            "size": size,
+            "path": str(path.relative_to(self.root)),
+            "saved_at": datetime.now(timezone.utc).isoformat(),
+        }
+        with (self.root / MANIFEST_NAME).open("a", encoding="utf-8") as handle:
+            handle.write(json.dumps(record, ensure_ascii=False) + "\n")
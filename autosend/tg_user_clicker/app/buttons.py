@@ -2,17 +2,24 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from functools import lru_cache
 import logging
 import re
 from typing import Any, Iterable
 
-from telethon.errors import FloodWaitError
-
 logger = logging.getLogger(__name__)
 
 _SPACE_RE = re.compile(r"\s+")
 _ALLOWED_RE = re.compile(r"[^\w\s.,!?\\-]")
 
+# ``contains``: normalized target is part of the label (the default);
+# ``exact``: normalized label equals the target; ``fuzzy``: ``contains`` or a
+# close spelling; ``emoji``: also matches symbol-only labels such as "▶️".
+MATCH_RULES = ("contains", "exact", "fuzzy", "emoji")
+_FUZZY_MIN_RATIO = 0.8
+# Variation selectors and joiners differ between clients for the same emoji.
+_EMOJI_IGNORED = str.maketrans("", "", "\ufe0e\ufe0f\u200d")
+
 
 @dataclass(frozen=True)
 class ButtonMatch:
@@ -28,26 +35,113 @@ def normalize_text(text: str) -> str:
     return normalized
 
 
-def _iter_buttons(button_rows: Iterable[Iterable[Any]]) -> Iterable[ButtonMatch]:
+def iter_buttons(button_rows: Iterable[Iterable[Any]]) -> Iterable[ButtonMatch]:
     for row_index, row in enumerate(button_rows):
         for col_index, button in enumerate(row):
             yield ButtonMatch(button=button, row=row_index, col=col_index)
 
 
-def find_button(message: Any, contains_text: str) -> ButtonMatch | None:
-    if not message or not getattr(message, "buttons", None):
+@lru_cache(maxsize=4096)
+def _normalized_label(text: str) -> str:
+    # Bots reuse the same few labels on every episode, so this rarely misses.
+    return normalize_text(text)
+
+
+def _symbols(text: str) -> str:
+    return "".join(text.translate(_EMOJI_IGNORED).split())
+
+
+class ButtonMatcher:
+    """Finds the button for one label, prepared once and reused per episode.
+
+    The target is normalized once and labels go through a shared cache.
+    ``positions`` maps the matcher's ``key`` to the ``[row, col]`` where the
+    button was last found; that position is checked first and verified
+    against its label, so a stable keyboard costs one comparison. Pass a
+    dict from the state to keep what was learned between runs.
+    """
+
+    def __init__(
+        self,
+        text: str,
+        *,
+        rule: str = "contains",
+        positions: dict[str, list[int]] | None = None,
+    ) -> None:
+        if rule not in MATCH_RULES:
+            raise ValueError(f"Unknown button match rule: {rule}")
+        self.text = text
+        self.rule = rule
+        self.target = normalize_text(text)
+        self.symbols = _symbols(text) if rule == "emoji" else ""
+        self.positions = positions if positions is not None else {}
+        self.key = f"{rule}:{self.target or self.symbols}"
+
+    def matches(self, label: str) -> bool:
+        if self.symbols and self.symbols in _symbols(label):
+            return True
+        if not self.target:
+            return False
+        normalized = _normalized_label(label)
+        if self.rule == "exact":
+            return normalized.strip() == self.target
+        if self.target in normalized:
+            return True
+        if self.rule == "fuzzy":
+            from difflib import SequenceMatcher
+
+            return SequenceMatcher(None, self.target, normalized.strip()).ratio() >= _FUZZY_MIN_RATIO
+        return False
+
+    def find(self, message: Any) -> ButtonMatch | None:
+        rows = getattr(message, "buttons", None) if message else None
+        if not rows or not (self.target or self.symbols):
+            return None
+
+        learned = self.positions.get(self.key)
+        if learned is not None:
+            row, col = learned
+            if row < len(rows) and col < len(rows[row]):
+                button = rows[row][col]
+                if self.matches(getattr(button, "text", "") or ""):
+                    return ButtonMatch(button=button, row=row, col=col)
+
+        for match in iter_buttons(rows):
+            if self.matches(getattr(match.button, "text", "") or ""):
+                self.positions[self.key] = [match.row, match.col]
+                return match
         return None
 
-    target = normalize_text(contains_text)
-    if not target:
-        return None
 
-    for match in _iter_buttons(message.buttons):
-        button_text = getattr(match.button, "text", "") or ""
-        if target in normalize_text(button_text):
-            return match
+def match_rule(rules: dict[str, str], bot_username: str) -> str:
+    """Rule for ``bot_username`` from ``BUTTON_MATCH_RULE``; ``""`` holds the default."""
+    return rules.get(bot_key(bot_username)) or rules.get("") or "contains"
+
+
+def bot_key(bot_username: str) -> str:
+    return bot_username.strip().lstrip("@").lower()
 
-    return None
+
+def bot_matcher(
+    config: Any,
+    bot_username: str,
+    text: str,
+    state: dict[str, Any] | None = None,
+) -> ButtonMatcher:
+    """Matcher using the bot's rule and, with ``state``, its learned positions."""
+    positions = None
+    if state is not None:
+        layouts = state.setdefault("button_layouts", {})
+        positions = layouts.setdefault(bot_key(bot_username), {})
+    return ButtonMatcher(
+        text,
+        rule=match_rule(config.button_match_rules, bot_username),
+        positions=positions,
+    )
+
+
+def find_button(message: Any, contains_text: str) -> ButtonMatch | None:
+    return ButtonMatcher(contains_text).find(message)
 
 
 def is_callback_button(button: Any) -> bool:
@@ -55,6 +149,8 @@ def is_callback_button(button: Any) -> bool:
 
 
 async def click_button(message: Any, match: ButtonMatch) -> Any:
+    from telethon.errors import FloodWaitError
+
     if not is_callback_button(match.button):
         raise ValueError("button is not callback")
 
@@ -0,0 +1,60 @@
+"""Stop-aware waits and calls shared by the flows."""
+from __future__ import annotations
+
+import asyncio
+from contextlib import suppress
+from typing import Awaitable, TypeVar
+
+T = TypeVar("T")
+
+
+class Stopped(Exception):
+    """Raised when stop is requested while a call is still in flight."""
+
+
+def is_set(*events: asyncio.Event | None) -> bool:
+    return any(event is not None and event.is_set() for event in events)
+
+
+async def sleep(seconds: float, *events: asyncio.Event | None) -> bool:
+    """Sleep up to ``seconds``; returns True as soon as any of ``events`` is set."""
+    watched = [event for event in events if event is not None]
+    if not watched:
+        await asyncio.sleep(seconds)
+        return False
+    if is_set(*watched):
+        return True
+    waiters = [asyncio.ensure_future(event.wait()) for event in watched]
+    try:
+        done, _ = await asyncio.wait(waiters, timeout=max(seconds, 0))
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+    return bool(done)
+
+
+async def cancellable(awaitable: Awaitable[T], stop_event: asyncio.Event | None) -> T:
+    """Await ``awaitable`` but abandon it with ``Stopped`` once ``stop_event`` is set.
+
+    Used around MTProto requests so a stop does not wait for the network.
+    """
+    if stop_event is None:
+        return await awaitable
+    task = asyncio.ensure_future(awaitable)
+    if stop_event.is_set():
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+        raise Stopped
+    stopper = asyncio.ensure_future(stop_event.wait())
+    try:
+        await asyncio.wait({task, stopper}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        stopper.cancel()
+        if not task.done():
+            task.cancel()
+            with suppress(asyncio.CancelledError, Exception):
+                await task
+    if task.cancelled() or not task.done():
+        raise Stopped
+    return task.result()
@@ -0,0 +1,249 @@
+"""Local SQLite catalog of delivered media."""
+from __future__ import annotations
+
+from datetime import datetime, timezone
+import logging
+from pathlib import Path
+import sqlite3
+from typing import Any, Iterable
+
+from app.ranking import parse_title
+from app.titles import title_key
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS delivered (
+    target TEXT NOT NULL,
+    source_peer TEXT NOT NULL,
+    source_msg_id INTEGER NOT NULL,
+    target_msg_id INTEGER,
+    title TEXT NOT NULL,
+    title_key TEXT NOT NULL,
+    season INTEGER,
+    episode INTEGER,
+    document_id INTEGER,
+    size INTEGER,
+    duration REAL,
+    delivered_at TEXT NOT NULL,
+    PRIMARY KEY (target, source_peer, source_msg_id)
+);
+CREATE INDEX IF NOT EXISTS delivered_title ON delivered (title_key, season, episode);
+CREATE INDEX IF NOT EXISTS delivered_document ON delivered (document_id);
+CREATE TABLE IF NOT EXISTS titles (
+    title_key TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    completed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS title_targets (
+    title_key TEXT NOT NULL,
+    target TEXT NOT NULL,
+    PRIMARY KEY (title_key, target)
+);
+"""
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def delivery_row(
+    target: str,
+    msg: Any,
+    sent: Any,
+    *,
+    title: str,
+    episode: int | None,
+) -> dict[str, Any]:
+    file = getattr(msg, "file", None)
+    document = getattr(msg, "document", None)
+    return {
+        "target": target,
+        "source_peer": str(msg.chat_id),
+        "source_msg_id": msg.id,
+        "target_msg_id": getattr(sent, "id", None),
+        "title": title,
+        "title_key": title_key(title),
+        "season": parse_title(title).season,
+        "episode": episode,
+        "document_id": getattr(document, "id", None),
+        "size": getattr(file, "size", None),
+        "duration": getattr(file, "duration", None),
+        "delivered_at": _now_iso(),
+    }
+
+
+class Catalog:
+    """Indexed record of every item delivered to a target chat.
+
+    Rows are keyed by ``(target, source_peer, source_msg_id)``; the
+    ``titles`` table marks titles whose series walk ran to the end, and
+    ``title_targets`` the targets they were delivered to, so a later run
+    can skip them without contacting the bot unless a target was added. Rows warmed from a
+    target's history have an empty ``source_peer`` and title.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._conn: sqlite3.Connection | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def record(self, rows: Iterable[dict[str, Any]]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT OR REPLACE INTO delivered VALUES (
+                    :target, :source_peer, :source_msg_id, :target_msg_id,
+                    :title, :title_key, :season, :episode,
+                    :document_id, :size, :duration, :delivered_at
+                )
+                """,
+                list(rows),
+            )
+
+    def record_delivery(self, target: str, delivered: list[tuple[dict[str, Any], Any, Any]]) -> None:
+        """``FanOut`` hook: ``delivered`` holds ``(outbox item, source msg, sent msg)``."""
+        try:
+            self.record(
+                delivery_row(
+                    target,
+                    msg,
+                    sent,
+                    title=item.get("title", ""),
+                    episode=item.get("episode"),
+                )
+                for item, msg, sent in delivered
+            )
+        except sqlite3.Error:
+            logger.exception("catalog: failed to record delivery to target=%s", target)
+
+    def deliveries(self, target: str) -> list[dict[str, Any]]:
+        rows = self.conn.execute(
+            "SELECT * FROM delivered WHERE target = ? ORDER BY delivered_at", (target,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def forget(self, target: str, keys: Iterable[tuple[str, int]]) -> None:
+        """Drop rows for ``(source_peer, source_msg_id)`` that never reached ``target``."""
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM delivered WHERE target = ? AND source_peer = ? AND source_msg_id = ?",
+                [(target, peer, msg_id) for peer, msg_id in keys],
+            )
+
+    def mark_complete(self, title: str, reason: str, targets: Iterable[str] = ()) -> None:
+        key = title_key(title)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO titles VALUES (?, ?, ?, ?)",
+                (key, title, reason, _now_iso()),
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO title_targets VALUES (?, ?)",
+                [(key, target) for target in targets],
+            )
+
+    def is_complete(self, title: str, targets: Iterable[str] = ()) -> bool:
+        """True when the title's walk ran to the end for every one of ``targets``."""
+        key = title_key(title)
+        row = self.conn.execute("SELECT 1 FROM titles WHERE title_key = ?", (key,)).fetchone()
+        if row is None:
+            return False
+        wanted = set(targets)
+        if not wanted:
+            return True
+        covered = {
+            row[0]
+            for row in self.conn.execute(
+                "SELECT target FROM title_targets WHERE title_key = ?", (key,)
+            )
+        }
+        if not covered:
+            # Completed before targets were recorded: go by what was delivered.
+            covered = {
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT DISTINCT target FROM delivered WHERE title_key = ?", (key,)
+                )
+            }
+        return wanted <= covered
+
+    def has_document(self, document_id: int | None, targets: Iterable[str]) -> bool:
+        """True when the document already reached every one of ``targets``."""
+        wanted = list(targets)
+        if document_id is None or not wanted:
+            return False
+        placeholders = ",".join("?" for _ in wanted)
+        row = self.conn.execute(
+            f"SELECT COUNT(DISTINCT target) FROM delivered "
+            f"WHERE document_id = ? AND target IN ({placeholders})",
+            (document_id, *wanted),
+        ).fetchone()
+        return row[0] >= len(wanted)
+
+    def titles(self, *, limit: int = 50, offset: int = 0) -> tuple[int, list[dict[str, Any]]]:
+        total = self.conn.execute(
+            "SELECT COUNT(*) FROM (SELECT title_key FROM delivered WHERE title_key != '' "
+            "GROUP BY title_key UNION SELECT title_key FROM titles)"
+        ).fetchone()[0]
+        rows = self.conn.execute(
+            """
+            SELECT k.title_key,
+                   COALESCE(t.title, MAX(d.title)) AS title,
+                   COUNT(DISTINCT d.document_id) AS episodes,
+                   COUNT(d.source_msg_id) AS deliveries,
+                   MAX(d.delivered_at) AS last_delivered_at,
+                   t.completed_at,
+                   t.reason
+            FROM (
+                SELECT title_key FROM delivered WHERE title_key != ''
+                UNION SELECT title_key FROM titles
+            ) AS k
+            LEFT JOIN delivered AS d ON d.title_key = k.title_key
+            LEFT JOIN titles AS t ON t.title_key = k.title_key
+            GROUP BY k.title_key
+            ORDER BY last_delivered_at DESC, k.title_key
+            LIMIT ? OFFSET ?
+            """,
+            (limit, offset),
+        ).fetchall()
+        return total, [dict(row) for row in rows]
+
+    def episodes(
+        self,
+        title: str,
+        *,
+        limit: int = 50,
+        offset: int = 0,
+    ) -> tuple[int, list[dict[str, Any]]]:
+        key = title_key(title)
+        total = self.conn.execute(
+            "SELECT COUNT(*) FROM delivered WHERE title_key = ?", (key,)
+        ).fetchone()[0]
+        rows = self.conn.execute(
+            """
+            SELECT * FROM delivered WHERE title_key = ?
+            ORDER BY season, episode, source_msg_id, target
+            LIMIT ? OFFSET ?
+            """,
+            (key, limit, offset),
+        ).fetchall()
+        return total, [dict(row) for row in rows]
+
+
+def open_catalog(config: Any) -> Catalog | None:
+    return Catalog(config.catalog_path) if config.catalog_path else None
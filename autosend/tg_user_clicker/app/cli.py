@@ -2,29 +2,32 @@
 from __future__ import annotations
 
 import argparse
-import asyncio
 import logging
-
 import os
+from typing import Any
 
-from app.buttons import click_button, find_button
-from app.client import check_connection, get_client, login
-from app.config import load_config
 from app.log import setup_logging
-from app import media
-from app.runner import run_titles
-from app.search_flow import (
-    run_inline_search_and_pick_first,
-    run_search_and_pick_first,
-    wait_for_message_by_id,
-)
-from app.series_flow import run_series_until_end, wait_for_media_after
-from app.state import load_state, save_state
-from app.titles import load_titles
+
+# Command handlers import their dependencies on first use: Telethon and the
+# flows cost far more to import than ``status``/``reset``/``--help`` need.
 
 logger = logging.getLogger(__name__)
 
 
+_ASYNC_COMMANDS = {
+    "login",
+    "me",
+    "press",
+    "search",
+    "search-send",
+    "series",
+    "run-one",
+    "run-list",
+    "reconcile",
+    "replay",
+}
+
+
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(description="Telegram MTProto user client")
     subparsers = parser.add_subparsers(dest="command")
@@ -32,10 +35,28 @@ def build_parser() -> argparse.ArgumentParser:
     subparsers.add_parser("login", help="Authorize the user session")
     subparsers.add_parser("me", help="Show current session user info")
 
-    press_parser = subparsers.add_parser("press", help="Find and press an inline button")
-    press_parser.add_argument("--chat", help="Chat username or ID (defaults to BOT_USERNAME)")
-    press_parser.add_argument("--contains", required=True, help="Text contained in button label")
+    press_parser = subparsers.add_parser(
+        "press", help="Find and press an inline button in one or more chats"
+    )
+    press_parser.add_argument(
+        "--chat",
+        action="append",
+        help="Chat username or ID, repeatable (defaults to BOT_USERNAME)",
+    )
+    press_parser.add_argument("--chats-file", help="File with one chat per line")
+    press_parser.add_argument(
+        "--contains",
+        action="append",
+        required=True,
+        help="Text contained in button label, repeatable (earlier ones win)",
+    )
     press_parser.add_argument("--limit", type=int, default=20, help="How many recent messages to scan")
+    press_parser.add_argument(
+        "--concurrency", type=int, default=8, help="Chats whose history is fetched at once"
+    )
+    press_parser.add_argument(
+        "--rate", type=float, default=1.0, help="Clicks per second across all chats"
+    )
 
     search_parser = subparsers.add_parser("search", help="Search by title and pick first result")
     search_parser.add_argument("--chat", required=True, help="Bot username or ID")
@@ -68,9 +89,46 @@ def build_parser() -> argparse.ArgumentParser:
     )
     run_list_parser.add_argument("--chat", help="Bot username or ID (defaults to BOT_USERNAME)")
     run_list_parser.add_argument("--titles-file", help="Path to titles file")
+    run_list_parser.add_argument(
+        "--follow", action="store_true", help="Keep waiting for titles appended to the file"
+    )
+
+    reconcile_parser = subparsers.add_parser(
+        "reconcile", help="Check target chats against the catalog and re-send what is missing"
+    )
+    reconcile_parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="Record media already in the targets so they are not sent again",
+    )
+    reconcile_parser.add_argument(
+        "--no-deliver", action="store_true", help="Only re-queue missing items, do not send them"
+    )
+
+    replay_parser = subparsers.add_parser(
+        "replay", help="Run titles against a recorded cassette instead of Telegram"
+    )
+    replay_parser.add_argument("--cassette", required=True, help="Cassette file (RECORD_CASSETTE)")
+    replay_parser.add_argument("--title", action="append", help="Title to run (repeatable)")
+    replay_parser.add_argument("--titles-file", help="Path to titles file")
+    replay_parser.add_argument("--chat", help="Bot username or ID (defaults to BOT_USERNAME)")
+    replay_parser.add_argument("--inline", action="store_true", help="Use inline query mode")
+    replay_parser.add_argument(
+        "--speed", type=float, default=1.0, help="Delay divisor, 0 drops all recorded delays"
+    )
+
+    snapshot_parser = subparsers.add_parser(
+        "session-snapshot", help="Copy the session file for SESSION_MODE=readonly workers"
+    )
+    snapshot_parser.add_argument("--out", required=True, help="Snapshot file to write")
 
     subparsers.add_parser("status", help="Show current resume state")
 
+    catalog_parser = subparsers.add_parser("catalog", help="Query the delivered media catalog")
+    catalog_parser.add_argument("--title", help="List delivered episodes of this title")
+    catalog_parser.add_argument("--limit", type=int, default=50, help="Page size")
+    catalog_parser.add_argument("--offset", type=int, default=0, help="Rows to skip")
+
     reset_parser = subparsers.add_parser("reset", help="Reset resume state")
     reset_parser.add_argument("--yes", action="store_true", help="Confirm reset")
     run_list_parser.add_argument("--inline", action="store_true", help="Use inline query mode")
@@ -79,28 +137,44 @@ def build_parser() -> argparse.ArgumentParser:
 
 
 def main() -> None:
-    setup_logging()
     parser = build_parser()
     args = parser.parse_args()
+    setup_logging(background=args.command in _ASYNC_COMMANDS)
+    if args.command in _ASYNC_COMMANDS:
+        from app.speedups import enable, run
+
+        enable()
 
     if args.command == "login":
-        asyncio.run(login())
+        from app.client import login
+
+        run(login())
     elif args.command == "me":
-        asyncio.run(check_connection())
+        from app.client import check_connection
+
+        run(check_connection())
     elif args.command == "press":
-        asyncio.run(press_button(args))
+        run(press_button(args))
     elif args.command == "search":
-        asyncio.run(search_and_pick(args))
+        run(search_and_pick(args))
     elif args.command == "search-send":
-        asyncio.run(search_and_send(args))
+        run(search_and_send(args))
     elif args.command == "series":
-        asyncio.run(run_series(args))
+        run(run_series(args))
     elif args.command == "run-one":
-        asyncio.run(run_one(args))
+        run(run_one(args))
     elif args.command == "run-list":
-        asyncio.run(run_list(args))
+        run(run_list(args))
+    elif args.command == "reconcile":
+        run(reconcile_targets(args))
+    elif args.command == "replay":
+        run(replay_cassette(args))
+    elif args.command == "session-snapshot":
+        snapshot_session(args)
     elif args.command == "status":
         show_status()
+    elif args.command == "catalog":
+        show_catalog(args)
     elif args.command == "reset":
         reset_state(args)
     else:
@@ -110,11 +184,42 @@ def main() -> None:
 
 
 
+def _install_stop_signals(stop_event: Any, drain_event: Any) -> None:
+    """First Ctrl+C finishes the current episode, the second one stops right away."""
+    import asyncio
+    import signal
+
+    def on_interrupt() -> None:
+        if drain_event.is_set():
+            logger.info("stopping now")
+            stop_event.set()
+            return
+        logger.info("finishing the current episode, press Ctrl+C again to stop now")
+        drain_event.set()
+
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGINT, on_interrupt)
+        loop.add_signal_handler(signal.SIGTERM, stop_event.set)
+    except NotImplementedError:
+        # Windows event loops do not support signal handlers; Ctrl+C cancels as before.
+        pass
+
+
 async def press_button(args: argparse.Namespace) -> None:
+    from app.client import get_client
+    from app.config import load_config
+    from app.press import press_chats
+    from app.titles import load_titles
+
     config = load_config()
-    chat = args.chat or config.bot_username
-    if not chat:
-        raise ValueError("Chat is required. Provide --chat or set BOT_USERNAME.")
+    chats = list(args.chat or [])
+    if args.chats_file:
+        chats.extend(load_titles(args.chats_file))
+    if not chats and config.bot_username:
+        chats.append(config.bot_username)
+    if not chats:
+        raise ValueError("Chat is required. Provide --chat, --chats-file or set BOT_USERNAME.")
 
     client = get_client()
     await client.connect()
@@ -122,23 +227,28 @@ async def press_button(args: argparse.Namespace) -> None:
         if not await client.is_user_authorized():
             raise RuntimeError("User session is not authorized. Run the login command first.")
 
-        entity = await client.get_entity(chat)
-        messages = await client.get_messages(entity, limit=args.limit)
-        for message in messages:
-            match = find_button(message, args.contains)
-            if not match:
-                continue
-            logger.info("Found button on message id=%s with text=%s", message.id, match.button.text)
-            result = await click_button(message, match)
-            logger.info("Button click finished: %s", result)
-            return
-
-        logger.info("No matching buttons found for %r in last %s messages", args.contains, args.limit)
+        results = await press_chats(
+            client,
+            list(dict.fromkeys(chats)),
+            args.contains,
+            rules=config.button_match_rules,
+            limit=args.limit,
+            concurrency=args.concurrency,
+            rate=args.rate,
+        )
+        for result in results:
+            print(result.line())
+        clicked = sum(result.status == "clicked" for result in results)
+        print(f"clicked {clicked} / {len(results)}")
     finally:
         await client.disconnect()
 
 
 async def search_and_pick(args: argparse.Namespace) -> None:
+    from app.client import get_client
+    from app.config import load_config
+    from app.search_flow import run_inline_search_and_pick_first, run_search_and_pick_first
+
     config = load_config()
     chat = args.chat or config.bot_username
     if not chat:
@@ -168,12 +278,26 @@ async def search_and_pick(args: argparse.Namespace) -> None:
 
 
 async def search_and_send(args: argparse.Namespace) -> None:
+    await _run_single_title(args, walk=False)
+
+
+async def run_series(args: argparse.Namespace) -> None:
+    await _run_single_title(args, walk=True)
+
+
+async def _run_single_title(args: argparse.Namespace, *, walk: bool) -> None:
+    """``search-send`` and ``series``: one title through the engine, nothing persisted."""
+    from app.client import get_client
+    from app.config import load_config
+    from app.engine import Engine
+    from app.search_flow import run_inline_search_and_pick_first
+
     config = load_config()
     chat = args.chat or config.bot_username
     if not chat:
         raise ValueError("Chat is required. Provide --chat or set BOT_USERNAME.")
     if not config.target_chat_id:
-        raise ValueError("TARGET_CHAT_ID is required for search-send.")
+        raise ValueError(f"TARGET_CHAT_ID is required for {args.command}.")
 
     client = get_client()
     await client.connect()
@@ -181,172 +305,278 @@ async def search_and_send(args: argparse.Namespace) -> None:
         if not await client.is_user_authorized():
             raise RuntimeError("User session is not authorized. Run the login command first.")
 
-        if args.inline:
-            result = await run_inline_search_and_pick_first(client, chat, args.title)
-        else:
-            result = await run_search_and_pick_first(client, chat, args.title)
-        if not result.get("ok"):
-            logger.info("reason=%s", result.get("reason"))
-            return
-
-        entity = await client.get_entity(chat)
-        next_message_id = result["next_message_id"]
-        message = await wait_for_message_by_id(
-            client,
-            entity,
-            message_id=next_message_id,
-            timeout_seconds=config.after_pick_timeout_seconds,
-        )
-        if not message:
-            logger.info("reason=timeout_after_pick")
-            return
-
-        if not media.is_media_message(message):
-            logger.info("non_media_message_id=%s", message.id)
-            return
-
-        if media.already_sent(message):
-            logger.info("duplicate_message_id=%s", message.id)
-            return
-
-        sent = await media.send_to_target(
-            client, message, config.target_chat_id, config.forward_mode
-        )
-        if not sent:
-            return
-
-        media.mark_sent(message)
-        media.record_sent(config.batch_size)
-        logger.info(
-            "sent_total=%s sent_in_batch=%s message_id=%s",
-            media.sent_total,
-            media.sent_in_batch,
-            message.id,
-        )
+        search_flow = run_inline_search_and_pick_first if args.inline else None
+        async with Engine(
+            client, chat, config=config, search_flow=search_flow, walk=walk
+        ) as engine:
+            item = await engine.run_title(args.title)
+        logger.info("dispatched=%s", item.dispatched)
+        logger.info("last_message_id=%s", engine.state.get("last_media_message_id"))
     finally:
         await client.disconnect()
 
 
-async def run_series(args: argparse.Namespace) -> None:
+async def run_one(args: argparse.Namespace) -> None:
+    import asyncio
+
+    from app.client import get_client
+    from app.config import load_config
+    from app.runner import run_titles
+    from app.search_flow import run_inline_search_and_pick_first
+    from app.state import load_state, save_state
+    from app.titles import open_state_titles, reset_state_titles, sidecar_titles_path, write_titles
+
     config = load_config()
     chat = args.chat or config.bot_username
     if not chat:
         raise ValueError("Chat is required. Provide --chat or set BOT_USERNAME.")
     if not config.target_chat_id:
-        raise ValueError("TARGET_CHAT_ID is required for series.")
+        raise ValueError("TARGET_CHAT_ID is required for run-one.")
+
+    state = load_state(config.state_path)
+    titles_path = sidecar_titles_path(config.state_path)
+    write_titles(titles_path, [args.title])
+    reset_state_titles(state, titles_path)
+    titles = open_state_titles(state, config.state_path)
+    save_state(config.state_path, state)
 
     client = get_client()
     await client.connect()
     try:
         if not await client.is_user_authorized():
             raise RuntimeError("User session is not authorized. Run the login command first.")
-
-        if args.inline:
-            result = await run_inline_search_and_pick_first(client, chat, args.title)
-        else:
-            result = await run_search_and_pick_first(client, chat, args.title)
-        if not result.get("ok"):
-            logger.info("reason=%s", result.get("reason"))
-            return
-
-        entity = await client.get_entity(chat)
-        next_message_id = result["next_message_id"]
-        message = await wait_for_media_after(
+        search_flow = run_inline_search_and_pick_first if args.inline else None
+        stop_event, drain_event = asyncio.Event(), asyncio.Event()
+        _install_stop_signals(stop_event, drain_event)
+        await run_titles(
             client,
-            entity,
-            after_id=next_message_id - 1,
-            timeout_seconds=config.wait_next_media_timeout_seconds,
+            chat,
+            titles,
+            state,
+            search_flow=search_flow,
+            stop_event=stop_event,
+            drain_event=drain_event,
         )
-        if not message:
-            logger.info("reason=timeout_after_pick_media")
-            return
-
-        series_result = await run_series_until_end(client, chat, message.id)
-        logger.info("reason=%s", series_result.get("reason"))
-        logger.info("sent_total=%s", series_result.get("sent_total"))
-        logger.info("last_message_id=%s", series_result.get("last_message_id"))
     finally:
         await client.disconnect()
 
 
-async def run_one(args: argparse.Namespace) -> None:
+async def run_list(args: argparse.Namespace) -> None:
+    import asyncio
+
+    from app.client import get_client
+    from app.config import load_config
+    from app.runner import run_titles
+    from app.search_flow import run_inline_search_and_pick_first
+    from app.state import load_state, save_state
+    from app.titles import open_state_titles, reset_state_titles
+
     config = load_config()
     chat = args.chat or config.bot_username
     if not chat:
         raise ValueError("Chat is required. Provide --chat or set BOT_USERNAME.")
     if not config.target_chat_id:
-        raise ValueError("TARGET_CHAT_ID is required for run-one.")
+        raise ValueError("TARGET_CHAT_ID is required for run-list.")
 
     state = load_state(config.state_path)
-    state["titles"] = [args.title]
-    state["current_index"] = 0
+    if not state.get("titles") and not state.get("titles_path"):
+        titles_path = args.titles_file or config.titles_path
+        if not os.path.exists(titles_path):
+            raise FileNotFoundError(f"Titles file not found: {titles_path}")
+        reset_state_titles(state, titles_path)
+    titles = open_state_titles(
+        state, config.state_path, follow=getattr(args, "follow", False)
+    )
     save_state(config.state_path, state)
+    logger.info(
+        "using titles from %s (%s items, index %s)",
+        titles.path,
+        len(titles),
+        state.get("current_index", 0),
+    )
+
+    # 🔽 ВАЖНО: выбираем функцию поиска в зависимости от флага --inline (иначе — SEARCH_MODE бота)
+    search_flow = run_inline_search_and_pick_first if getattr(args, "inline", False) else None
 
     client = get_client()
     await client.connect()
     try:
         if not await client.is_user_authorized():
             raise RuntimeError("User session is not authorized. Run the login command first.")
-        search_flow = run_inline_search_and_pick_first if args.inline else run_search_and_pick_first
-        await run_titles(client, chat, [args.title], state, search_flow=search_flow)
+
+        # 🔽 ВАЖНО: прокидываем search_flow в runner
+        stop_event, drain_event = asyncio.Event(), asyncio.Event()
+        _install_stop_signals(stop_event, drain_event)
+        await run_titles(
+            client,
+            chat,
+            titles,
+            state,
+            search_flow=search_flow,
+            stop_event=stop_event,
+            drain_event=drain_event,
+        )
     finally:
         await client.disconnect()
 
 
-async def run_list(args: argparse.Namespace) -> None:
+async def reconcile_targets(args: argparse.Namespace) -> None:
+    from app.client import get_client
+    from app.config import load_config
+    from app.reconcile import run_reconcile
+    from app.state import load_state
+
     config = load_config()
-    chat = args.chat or config.bot_username
-    if not chat:
-        raise ValueError("Chat is required. Provide --chat or set BOT_USERNAME.")
     if not config.target_chat_id:
-        raise ValueError("TARGET_CHAT_ID is required for run-list.")
+        raise ValueError("TARGET_CHAT_ID is required for reconcile.")
 
     state = load_state(config.state_path)
-    titles_path = args.titles_file or config.titles_path
-    if not state.get("titles"):
-        titles = load_titles(titles_path)
-        state["titles"] = titles
-        state["current_index"] = int(state.get("current_index", 0))
-        save_state(config.state_path, state)
-    else:
-        titles = list(state.get("titles", []))
-        logger.info("using titles from state (%s items)", len(titles))
-
-    if not titles:
-        logger.info("No titles to process.")
-        return
-
-    # 🔽 ВАЖНО: выбираем функцию поиска в зависимости от флага --inline
-    search_flow = run_inline_search_and_pick_first if getattr(args, "inline", False) else run_search_and_pick_first
-
     client = get_client()
     await client.connect()
     try:
         if not await client.is_user_authorized():
             raise RuntimeError("User session is not authorized. Run the login command first.")
-
-        # 🔽 ВАЖНО: прокидываем search_flow в runner
-        await run_titles(client, chat, titles, state, search_flow=search_flow)
+        report = await run_reconcile(
+            client,
+            config,
+            state,
+            state_path=config.state_path,
+            warm=args.warm,
+            deliver=not args.no_deliver,
+        )
     finally:
         await client.disconnect()
+    for target, summary in report["targets"].items():
+        print(
+            f"target {target}: documents={summary['documents']} catalog={summary['catalog']} "
+            f"missing={summary['missing']} requeued={summary['requeued']} "
+            f"warmed={summary['warmed']}"
+        )
+    for target, size in report.get("outbox", {}).items():
+        print(f"target {target}: outbox={size}")
+
+
+async def replay_cassette(args: argparse.Namespace) -> None:
+    import tempfile
+    import time
 
+    from app.cassette import ReplayClient
+    from app.search_flow import run_inline_search_and_pick_first, run_search_and_pick_first
+
+    # The replay must not touch the real catalog, archive or cassette.
+    os.environ["CATALOG_PATH"] = ""
+    os.environ["ARCHIVE_DIR"] = ""
+    os.environ["RECORD_CASSETTE"] = ""
+    os.environ["BOT_PROFILES_DIR"] = ""
+    from app.config import load_config
+    from app.runner import run_titles
+    from app.schedule import done_count
+    from app.state import load_state
+    from app.titles import open_state_titles, reset_state_titles, write_titles
+
+    config = load_config()
+    chat = args.chat or config.bot_username
+    if not chat:
+        raise ValueError("Chat is required. Provide --chat or set BOT_USERNAME.")
+    if not config.target_chat_id:
+        raise ValueError("TARGET_CHAT_ID is required for replay.")
+
+    client = ReplayClient(args.cassette, speed=args.speed)
+    search_flow = run_inline_search_and_pick_first if args.inline else run_search_and_pick_first
+    with tempfile.TemporaryDirectory() as workdir:
+        state_path = os.path.join(workdir, "state.json")
+        titles_path = args.titles_file
+        if args.title:
+            titles_path = os.path.join(workdir, "titles.txt")
+            write_titles(titles_path, args.title)
+        if not titles_path:
+            raise ValueError("Provide --title or --titles-file.")
+        state = load_state(state_path)
+        reset_state_titles(state, titles_path)
+        titles = open_state_titles(state, state_path)
+        started = time.monotonic()
+        try:
+            await run_titles(client, chat, titles, state, search_flow=search_flow, state_path=state_path)
+        finally:
+            titles.close()
+    print(f"elapsed: {time.monotonic() - started:.1f}s")
+    print(f"titles: {done_count(state)}")
+    print(f"sent_total: {state.get('sent_total', 0)}")
+    print(f"delivered: {len(client.delivered)}")
+    print(f"divergences: {client.divergences}")
+    for item in state.get("failed", []) + state.get("retry_queue", []):
+        print(f"  {item['title']} reason={item['reason']}")
 
 
 def show_status() -> None:
+    from app.config import load_config
+    from app.schedule import done_count
+    from app.state import load_state, targets_summary
+    from app.titles import count_state_titles
+
     config = load_config()
     state = load_state(config.state_path)
-    total_titles = len(state.get("titles", []))
-    current_index = int(state.get("current_index", 0))
+    total_titles = count_state_titles(state)
+    titles_done = done_count(state)
     last_title = state.get("last_title", "")
     sent_total = state.get("sent_total", 0)
     last_media_message_id = state.get("last_media_message_id", 0)
-    print(f"{current_index} / {total_titles}")
+    print(f"{titles_done} / {total_titles}")
     print(f"last_title: {last_title}")
     print(f"sent_total: {sent_total}")
     print(f"last_media_message_id: {last_media_message_id}")
+    for target, summary in targets_summary(state).items():
+        print(f"target {target}: sent={summary['sent']} outbox={summary['outbox']}")
+    print(f"retry_queue: {len(state.get('retry_queue', []))}")
+    print(f"stalls: {state.get('stalls', 0)}")
+    failed = state.get("failed", [])
+    print(f"failed: {len(failed)}")
+    for item in failed:
+        print(f"  {item['title']} reason={item['reason']} attempts={item['attempts']}")
+
+
+def show_catalog(args: argparse.Namespace) -> None:
+    from app.catalog import Catalog
+    from app.config import load_config
+
+    config = load_config()
+    if not config.catalog_path:
+        raise ValueError("CATALOG_PATH is empty, the catalog is disabled.")
+    catalog = Catalog(config.catalog_path)
+    try:
+        if args.title:
+            total, rows = catalog.episodes(args.title, limit=args.limit, offset=args.offset)
+            for row in rows:
+                print(
+                    f"s{row['season'] or '-'} e{row['episode'] or '-'} "
+                    f"target={row['target']} msg_id={row['source_msg_id']} "
+                    f"target_msg_id={row['target_msg_id']} document_id={row['document_id']} "
+                    f"size={row['size']} duration={row['duration']}"
+                )
+        else:
+            total, rows = catalog.titles(limit=args.limit, offset=args.offset)
+            for row in rows:
+                status = f"complete ({row['reason']})" if row["completed_at"] else "partial"
+                print(f"{row['title']}: episodes={row['episodes']} {status}")
+        print(f"{args.offset + len(rows)} / {total}")
+    finally:
+        catalog.close()
+
+
+def snapshot_session(args: argparse.Namespace) -> None:
+    from app.config import load_config
+    from app.session import snapshot_session as snapshot
+
+    config = load_config()
+    path = snapshot(config.session_name, args.out)
+    print(f"snapshot: {path}")
+    print(f"run workers with SESSION_MODE=readonly SESSION_SNAPSHOT={path}")
 
 
 def reset_state(args: argparse.Namespace) -> None:
+    from app.config import load_config
+    from app.state import load_state, save_state
+
     if not args.yes:
         raise RuntimeError("Reset requires --yes confirmation.")
     config = load_config()
@@ -1,24 +1,108 @@
 """MTProto client helpers."""
 from __future__ import annotations
 
+import asyncio
 import logging
+from typing import Any, Iterable
 
 from telethon import TelegramClient
 from telethon.errors import SessionPasswordNeededError
 
 from app.config import load_config
+from app.delivery import target_peer
+from app.session import FileMemorySession, open_session, persist
 
 logger = logging.getLogger(__name__)
 
 
-def get_client() -> TelegramClient:
+class UserClient(TelegramClient):
+    """``TelegramClient`` that resolves each peer once per process.
+
+    ``get_entity`` with a username or a chat id shares one lookup between
+    all callers; ``preload`` peers are resolved right after ``connect`` so
+    the bot and the targets are ready before the first flow asks for them.
+    A memory session (``SESSION_MODE``) is flushed every
+    ``flush_seconds`` and on disconnect.
+    """
+
+    def __init__(
+        self,
+        session: Any,
+        api_id: int,
+        api_hash: str,
+        *,
+        preload: Iterable[str | int] = (),
+        flush_seconds: int = 0,
+    ) -> None:
+        super().__init__(session, api_id, api_hash)
+        self._preload = [peer for peer in preload if peer]
+        self._flush_seconds = flush_seconds
+        self._resolved: dict[str | int, asyncio.Future] = {}
+        self._flusher: asyncio.Task | None = None
+
+    async def connect(self) -> None:
+        await super().connect()
+        if isinstance(self.session, FileMemorySession) and not self.session.readonly:
+            if self._flush_seconds > 0 and self._flusher is None:
+                self._flusher = asyncio.create_task(persist(self.session, self._flush_seconds))
+        if self.session.auth_key is not None:
+            for peer in self._preload:
+                self._resolve(peer)
+
+    async def disconnect(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        for future in self._resolved.values():
+            future.cancel()
+        self._resolved.clear()
+        await super().disconnect()
+        if isinstance(self.session, FileMemorySession):
+            await asyncio.to_thread(self.session.flush)
+
+    def _resolve(self, peer: str | int) -> asyncio.Future:
+        if isinstance(peer, str):
+            peer = peer.strip()
+        future = self._resolved.get(peer)
+        if future is None:
+            future = asyncio.ensure_future(TelegramClient.get_entity(self, peer))
+            future.add_done_callback(lambda done: self._forget_failed(peer, done))
+            self._resolved[peer] = future
+        return future
+
+    def _forget_failed(self, peer: str | int, future: asyncio.Future) -> None:
+        if future.cancelled() or future.exception() is not None:
+            if self._resolved.get(peer) is future:
+                del self._resolved[peer]
+            if not future.cancelled():
+                logger.info("resolve %s failed: %r", peer, future.exception())
+
+    async def get_entity(self, entity: Any) -> Any:
+        if not isinstance(entity, (str, int)):
+            return await super().get_entity(entity)
+        return await asyncio.shield(self._resolve(entity))
+
+
+def get_client(session_name: str | None = None) -> Any:
+    """A Telethon client, wrapped in a recorder when ``RECORD_CASSETTE`` is set."""
     config = load_config()
-    return TelegramClient(config.session_name, config.api_id, config.api_hash)
+    client = UserClient(
+        open_session(session_name or config.session_name, config),
+        config.api_id,
+        config.api_hash,
+        preload=(config.bot_username, *map(target_peer, config.target_chat_ids)),
+        flush_seconds=config.session_flush_seconds,
+    )
+    if config.record_cassette:
+        from app.cassette import RecordingClient
+
+        return RecordingClient(client, config.record_cassette, bots=(config.bot_username,))
+    return client
 
 
 async def login() -> None:
     config = load_config()
-    client = get_client()
+    client = TelegramClient(config.session_name, config.api_id, config.api_hash)
     await client.connect()
     try:
         if not await client.is_user_authorized():
@@ -6,6 +6,13 @@ import os
 
 from dotenv import load_dotenv
 
+from app.buttons import MATCH_RULES, bot_key
+from app.media import CAPTION_FIELDS, check_caption_template
+from app.quality import parse_policy
+from app.schedule import TITLE_ORDERS
+
+SEARCH_MODES = ("chat", "inline", "auto")
+
 
 @dataclass(frozen=True)
 class Config:
@@ -14,24 +21,44 @@ class Config:
     phone: str
     two_fa_password: str
     session_name: str
+    session_mode: str
+    session_flush_seconds: int
+    session_snapshot: str
     bot_username: str
     button_next_text: str
     button_series_text: str
     button_quality_text: str
     button_back_text: str
+    button_match_rules: dict[str, str]
+    quality_policy: str
     search_results_timeout_seconds: int
     after_pick_timeout_seconds: int
     wait_next_media_timeout_seconds: int
     max_retries_next: int
+    retry_max_attempts: int
     wait_after_click_seconds: int
     search_delay_seconds: int
     search_send_prefix: str
+    search_mode: str
     target_chat_id: str
+    target_chat_ids: tuple[str, ...]
     batch_size: int
     forward_mode: str
+    album_size: int
+    copy_caption_template: str
     state_path: str
     titles_path: str
+    title_order: str
+    schedule_window: int
+    jobs_dir: str
+    archive_dir: str
+    archive_workers: int
+    catalog_path: str
+    bot_profiles_dir: str
+    record_cassette: str
     sent_dedup_limit: int
+    pick_min_score: float
+    stall_min_seconds: int
 
 
 def _require_env(name: str) -> str:
@@ -49,24 +76,46 @@ def load_config() -> Config:
     phone = _require_env("TG_PHONE")
     two_fa_password = os.getenv("TG_2FA_PASSWORD", "")
     session_name = os.getenv("SESSION_NAME", "user")
+    session_mode = os.getenv("SESSION_MODE", "sqlite").strip().lower()
+    session_flush_raw = os.getenv("SESSION_FLUSH_SECONDS", "30")
+    session_snapshot = os.getenv("SESSION_SNAPSHOT", "")
     bot_username = os.getenv("BOT_USERNAME", "")
     button_next_text = os.getenv("BUTTON_NEXT_TEXT", "Вперёд")
     button_series_text = os.getenv("BUTTON_SERIES_TEXT", "Серии")
     button_quality_text = os.getenv("BUTTON_QUALITY_TEXT", "Качество")
     button_back_text = os.getenv("BUTTON_BACK_TEXT", "Назад")
+    button_match_raw = os.getenv("BUTTON_MATCH_RULE", "contains")
+    quality_policy_raw = os.getenv("QUALITY_POLICY", "default")
     search_results_timeout_raw = os.getenv("SEARCH_RESULTS_TIMEOUT_SECONDS", "30")
     after_pick_timeout_raw = os.getenv("AFTER_PICK_TIMEOUT_SECONDS", "30")
     wait_next_media_timeout_raw = os.getenv("WAIT_NEXT_MEDIA_TIMEOUT_SECONDS", "60")
     max_retries_next_raw = os.getenv("MAX_RETRIES_NEXT", "3")
+    retry_max_attempts_raw = os.getenv("RETRY_MAX_ATTEMPTS", "4")
     wait_after_click_raw = os.getenv("WAIT_AFTER_CLICK_SECONDS", "1")
     search_delay_raw = os.getenv("SEARCH_DELAY_SECONDS", "0")
     search_send_prefix = os.getenv("SEARCH_SEND_PREFIX", "")
-    target_chat_id = os.getenv("TARGET_CHAT_ID", "")
+    search_mode = os.getenv("SEARCH_MODE", "chat").strip().lower()
+    target_chat_ids = tuple(
+        item.strip() for item in os.getenv("TARGET_CHAT_ID", "").split(",") if item.strip()
+    )
+    target_chat_id = target_chat_ids[0] if target_chat_ids else ""
     batch_size_raw = os.getenv("BATCH_SIZE", "10")
     forward_mode = os.getenv("FORWARD_MODE", "copy").lower()
+    album_size_raw = os.getenv("ALBUM_SIZE", "10")
+    copy_caption_template = os.getenv("COPY_CAPTION_TEMPLATE", "")
     state_path = os.getenv("STATE_PATH", "./state.json")
     titles_path = os.getenv("TITLES_PATH", "./titles.txt")
+    title_order = os.getenv("TITLE_ORDER", "file").strip().lower()
+    schedule_window_raw = os.getenv("SCHEDULE_WINDOW", "500")
+    jobs_dir = os.getenv("JOBS_DIR", "./jobs")
+    archive_dir = os.getenv("ARCHIVE_DIR", "")
+    archive_workers_raw = os.getenv("ARCHIVE_WORKERS", "2")
+    catalog_path = os.getenv("CATALOG_PATH", "./catalog.sqlite3")
+    bot_profiles_dir = os.getenv("BOT_PROFILES_DIR", "./profiles")
+    record_cassette = os.getenv("RECORD_CASSETTE", "")
     sent_dedup_limit_raw = os.getenv("SENT_DEDUP_LIMIT", "2000")
+    pick_min_score_raw = os.getenv("PICK_MIN_SCORE", "0.6")
+    stall_min_seconds_raw = os.getenv("STALL_MIN_SECONDS", "600")
 
     try:
         api_id = int(api_id_raw)
@@ -93,6 +142,11 @@ def load_config() -> Config:
     except ValueError as exc:
         raise ValueError("MAX_RETRIES_NEXT must be an integer") from exc
 
+    try:
+        retry_max_attempts = int(retry_max_attempts_raw)
+    except ValueError as exc:
+        raise ValueError("RETRY_MAX_ATTEMPTS must be an integer") from exc
+
     try:
         wait_after_click_seconds = int(wait_after_click_raw)
     except ValueError as exc:
@@ -108,36 +162,113 @@ def load_config() -> Config:
     except ValueError as exc:
         raise ValueError("BATCH_SIZE must be an integer") from exc
 
+    button_match_rules: dict[str, str] = {}
+    for item in button_match_raw.split(","):
+        bot, _, rule = item.rpartition("=")
+        rule = rule.strip().lower()
+        if not rule:
+            continue
+        if rule not in MATCH_RULES:
+            raise ValueError(f"BUTTON_MATCH_RULE must use one of: {', '.join(MATCH_RULES)}")
+        button_match_rules[bot_key(bot)] = rule
+
+    quality_policy = str(parse_policy(quality_policy_raw))
+
+    if search_mode not in SEARCH_MODES:
+        raise ValueError(f"SEARCH_MODE must be one of: {', '.join(SEARCH_MODES)}")
+
+    if title_order not in TITLE_ORDERS:
+        raise ValueError(f"TITLE_ORDER must be one of: {', '.join(TITLE_ORDERS)}")
+    try:
+        schedule_window = int(schedule_window_raw)
+    except ValueError as exc:
+        raise ValueError("SCHEDULE_WINDOW must be an integer") from exc
+
+    if session_mode not in {"sqlite", "memory", "readonly"}:
+        raise ValueError("SESSION_MODE must be 'sqlite', 'memory' or 'readonly'")
+    try:
+        session_flush_seconds = int(session_flush_raw)
+    except ValueError as exc:
+        raise ValueError("SESSION_FLUSH_SECONDS must be an integer") from exc
+
     if forward_mode not in {"copy", "forward"}:
         raise ValueError("FORWARD_MODE must be 'copy' or 'forward'")
 
+    try:
+        check_caption_template(copy_caption_template)
+    except ValueError as exc:
+        fields = ", ".join(f"{{{name}}}" for name in CAPTION_FIELDS)
+        raise ValueError(f"COPY_CAPTION_TEMPLATE may only use {fields}: {exc}") from exc
+
+    try:
+        album_size = int(album_size_raw)
+    except ValueError as exc:
+        raise ValueError("ALBUM_SIZE must be an integer") from exc
+    if not 1 <= album_size <= 10:
+        raise ValueError("ALBUM_SIZE must be between 1 and 10")
+
+    try:
+        archive_workers = int(archive_workers_raw)
+    except ValueError as exc:
+        raise ValueError("ARCHIVE_WORKERS must be an integer") from exc
+
     try:
         sent_dedup_limit = int(sent_dedup_limit_raw)
     except ValueError as exc:
         raise ValueError("SENT_DEDUP_LIMIT must be an integer") from exc
 
+    try:
+        pick_min_score = float(pick_min_score_raw)
+    except ValueError as exc:
+        raise ValueError("PICK_MIN_SCORE must be a number") from exc
+
+    try:
+        stall_min_seconds = int(stall_min_seconds_raw)
+    except ValueError as exc:
+        raise ValueError("STALL_MIN_SECONDS must be an integer") from exc
+
     return Config(
         api_id=api_id,
         api_hash=api_hash,
         phone=phone,
         two_fa_password=two_fa_password,
         session_name=session_name,
+        session_mode=session_mode,
+        session_flush_seconds=session_flush_seconds,
+        session_snapshot=session_snapshot,
         bot_username=bot_username,
         button_next_text=button_next_text,
         button_series_text=button_series_text,
         button_quality_text=button_quality_text,
         button_back_text=button_back_text,
+        button_match_rules=button_match_rules,
+        quality_policy=quality_policy,
         search_results_timeout_seconds=search_results_timeout_seconds,
         after_pick_timeout_seconds=after_pick_timeout_seconds,
         wait_next_media_timeout_seconds=wait_next_media_timeout_seconds,
         max_retries_next=max_retries_next,
+        retry_max_attempts=retry_max_attempts,
         wait_after_click_seconds=wait_after_click_seconds,
         search_delay_seconds=search_delay_seconds,
         search_send_prefix=search_send_prefix,
+        search_mode=search_mode,
         target_chat_id=target_chat_id,
+        target_chat_ids=target_chat_ids,
         batch_size=batch_size,
         forward_mode=forward_mode,
+        album_size=album_size,
+        copy_caption_template=copy_caption_template,
         state_path=state_path,
         titles_path=titles_path,
+        title_order=title_order,
+        schedule_window=schedule_window,
+        jobs_dir=jobs_dir,
+        archive_dir=archive_dir,
+        archive_workers=archive_workers,
+        catalog_path=catalog_path,
+        bot_profiles_dir=bot_profiles_dir,
+        record_cassette=record_cassette,
         sent_dedup_limit=sent_dedup_limit,
+        pick_min_score=pick_min_score,
+        stall_min_seconds=stall_min_seconds,
     )
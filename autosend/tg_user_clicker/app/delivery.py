@@ -0,0 +1,254 @@
+"""Fan-out delivery of media to one or more target chats."""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Callable
+
+from app import media
+from app.state import target_state
+from app.watchdog import beat
+
+logger = logging.getLogger(__name__)
+
+_MIN_RETRY_SECONDS = 5
+_MAX_RETRY_SECONDS = 300
+# While closing, a target that keeps failing is left for the next run.
+_CLOSE_MAX_FAILURES = 3
+
+
+def target_peer(target: str) -> Any:
+    """Numeric chat ids come from the env as strings; Telethon wants ints for them."""
+    stripped = target.strip()
+    if stripped.lstrip("-").isdigit():
+        return int(stripped)
+    return stripped
+
+
+class FanOut:
+    """Delivers every dispatched item to all targets, each at its own pace.
+
+    Items are first written to a per-target ``outbox`` in the state, so the
+    walk can continue right away; ``dispatch`` leaves saving the state to the
+    caller, which writes the outbox together with its checkpoint, so an item
+    is either persisted or walked again after a crash. Every delivered chunk
+    is saved at once. One worker per target drains its outbox in
+    album-sized chunks; a failing or flood-limited target backs off on its
+    own without holding up the others, and whatever is left in an outbox is
+    caught up on the next run.
+    ``on_delivered`` gets every chunk sent to a target, ``on_sent`` the
+    messages once no target has them queued any more.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        targets: tuple[str, ...] | list[str],
+        *,
+        mode: str,
+        state: dict[str, Any],
+        save: Callable[[], None] | None = None,
+        album_size: int = media.MAX_ALBUM_SIZE,
+        dedup_limit: int = 0,
+        caption_template: str = "",
+        on_delivered: Callable[[str, list[tuple[dict[str, Any], Any, Any]]], None] | None = None,
+        on_sent: Callable[[list[Any]], None] | None = None,
+    ) -> None:
+        self.client = client
+        self.targets = list(targets)
+        self.mode = mode
+        self.state = state
+        self._save = save
+        self.album_size = max(1, min(album_size, media.MAX_ALBUM_SIZE))
+        self.dedup_limit = dedup_limit
+        self.caption_template = caption_template if mode == "copy" else ""
+        self.on_delivered = on_delivered
+        self.on_sent = on_sent
+        self._messages: dict[tuple[Any, int], Any] = {}
+        self._wake: dict[str, asyncio.Event] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        self._closing = False
+
+    def start(self) -> None:
+        for target in self.targets:
+            target_state(self.state, target)
+            self._wake[target] = asyncio.Event()
+            self._wake[target].set()
+            self._workers[target] = asyncio.create_task(self._run_target(target))
+
+    def save(self) -> None:
+        if self._save is not None:
+            self._save()
+
+    def dispatch(self, items: list[tuple[Any, str, int | None]], title: str = "") -> None:
+        for target in self.targets:
+            entry = target_state(self.state, target)
+            queued = {(item["peer"], item["msg_id"]) for item in entry["outbox"]}
+            for msg, caption, episode in items:
+                key = (msg.chat_id, msg.id)
+                if msg.id in entry["sent_ids"] or key in queued:
+                    continue
+                self._messages[key] = msg
+                entry["outbox"].append(
+                    {
+                        "peer": msg.chat_id,
+                        "msg_id": msg.id,
+                        "caption": caption,
+                        "title": title,
+                        "episode": episode,
+                    }
+                )
+            if target in self._wake:
+                self._wake[target].set()
+
+    def outbox_sizes(self) -> dict[str, int]:
+        return {target: len(target_state(self.state, target)["outbox"]) for target in self.targets}
+
+    async def close(self, stop_event: asyncio.Event | None = None) -> None:
+        """Wait for the outboxes to drain; on stop, leave them for the next run."""
+        self._closing = True
+        for wake in self._wake.values():
+            wake.set()
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        drained = asyncio.gather(*workers, return_exceptions=True)
+        if stop_event is None:
+            await drained
+        else:
+            stopper = asyncio.create_task(stop_event.wait())
+            await asyncio.wait([drained, stopper], return_when=asyncio.FIRST_COMPLETED)
+            stopper.cancel()
+            if not drained.done():
+                logger.info("delivery stopped with outbox=%s", self.outbox_sizes())
+                drained.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        self._workers.clear()
+
+    async def _resolve(
+        self, target: str, chunk: list[dict[str, Any]]
+    ) -> list[tuple[dict[str, Any], Any]]:
+        missing: dict[Any, list[int]] = {}
+        for item in chunk:
+            if (item["peer"], item["msg_id"]) not in self._messages:
+                missing.setdefault(item["peer"], []).append(item["msg_id"])
+        for peer, ids in missing.items():
+            fetched = await self.client.get_messages(peer, ids=ids)
+            for msg in fetched or []:
+                if msg is not None:
+                    self._messages[(peer, msg.id)] = msg
+
+        resolved: list[tuple[dict[str, Any], Any]] = []
+        for item in chunk:
+            msg = self._messages.get((item["peer"], item["msg_id"]))
+            if msg is None or not media.is_media_message(msg):
+                logger.warning(
+                    "target=%s dropping missing msg_id=%s from outbox", target, item["msg_id"]
+                )
+                self._remove(target, [item["msg_id"]])
+                continue
+            if resolved and media.media_kind(resolved[0][1]) != media.media_kind(msg):
+                break
+            resolved.append((item, msg))
+        return resolved
+
+    def _caption(self, item: dict[str, Any], msg: Any) -> str:
+        if item["caption"] is not None:
+            return item["caption"]
+        return media.render_caption(
+            self.caption_template, msg, title=item.get("title", ""), episode=item.get("episode")
+        )
+
+    def _remove(self, target: str, msg_ids: list[int]) -> None:
+        entry = target_state(self.state, target)
+        done = set(msg_ids)
+        entry["outbox"] = [item for item in entry["outbox"] if item["msg_id"] not in done]
+
+    def _record(
+        self, target: str, resolved: list[tuple[dict[str, Any], Any]], sent: Any
+    ) -> None:
+        messages = [msg for _, msg in resolved]
+        entry = target_state(self.state, target)
+        self._remove(target, [msg.id for msg in messages])
+        sent_ids = entry["sent_ids"]
+        sent_ids.extend(msg.id for msg in messages)
+        if self.dedup_limit > 0 and len(sent_ids) > self.dedup_limit:
+            del sent_ids[: len(sent_ids) - self.dedup_limit]
+        entry["sent"] += len(messages)
+        for item, msg in resolved:
+            logger.info(
+                "sent to target=%s msg_id=%s",
+                target,
+                msg.id,
+                extra={"target": target, "msg_id": msg.id, "title": item.get("title") or None},
+            )
+        if self.on_delivered is not None:
+            sent_messages = list(sent) if isinstance(sent, list) else [sent]
+            sent_messages += [None] * (len(resolved) - len(sent_messages))
+            self.on_delivered(
+                target, [(item, msg, out) for (item, msg), out in zip(resolved, sent_messages)]
+            )
+        beat("forward")
+        done = self._forget(messages)
+        if done and self.on_sent is not None:
+            self.on_sent(done)
+        self.save()
+
+    def _forget(self, messages: list[Any]) -> list[Any]:
+        """Drop the ``messages`` no target has queued any more and return them."""
+        still_queued = {
+            (item["peer"], item["msg_id"])
+            for target in self.targets
+            for item in target_state(self.state, target)["outbox"]
+        }
+        done = [msg for msg in messages if (msg.chat_id, msg.id) not in still_queued]
+        for msg in done:
+            self._messages.pop((msg.chat_id, msg.id), None)
+        return done
+
+    async def _run_target(self, target: str) -> None:
+        retry_seconds = 0
+        failures = 0
+        wake = self._wake[target]
+        while True:
+            entry = target_state(self.state, target)
+            if not entry["outbox"]:
+                if self._closing:
+                    return
+                wake.clear()
+                await wake.wait()
+                continue
+
+            resolved: list[tuple[dict[str, Any], Any]] = []
+            sent = None
+            try:
+                resolved = await self._resolve(target, entry["outbox"][: self.album_size])
+                if resolved:
+                    sent = await media.deliver_batch(
+                        self.client,
+                        [(msg, self._caption(item, msg)) for item, msg in resolved],
+                        target_peer(target),
+                        self.mode,
+                    )
+            except Exception as exc:
+                failures += 1
+                retry_seconds = getattr(exc, "seconds", None) or min(
+                    max(retry_seconds * 2, _MIN_RETRY_SECONDS), _MAX_RETRY_SECONDS
+                )
+                logger.warning(
+                    "target=%s delivery failed (%s), %s queued, retry in %ss",
+                    target,
+                    exc.__class__.__name__,
+                    len(entry["outbox"]),
+                    retry_seconds,
+                )
+                if self._closing and failures >= _CLOSE_MAX_FAILURES:
+                    # The outbox is persisted; the next run catches this target up.
+                    return
+                await asyncio.sleep(retry_seconds)
+                continue
+            if not resolved:
+                continue
+            retry_seconds = 0
+            failures = 0
+            self._record(target, resolved, sent)
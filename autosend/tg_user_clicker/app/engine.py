@@ -0,0 +1,679 @@
+"""Staged engine shared by every CLI command and web job.
+
+A title moves through ``search`` → ``first_media`` → ``walk``; each stage
+is a pool of workers reading its own ``asyncio.Queue``. Delivery is the
+``FanOut`` outbox (one worker per target) and archiving the ``Archiver``
+pool, so batching, dedup, the catalog and checkpoints work the same for
+``search-send``, ``series``, ``run-one``/``run-list`` and the API.
+
+Titles of one bot chat take turns there in the order they were queued:
+a title talks to the bot (sends its search, clicks a result, walks NEXT)
+only once the one before it is over, so their messages never mix. What
+does not touch the chat overlaps: the catalog check, the inline query and
+ranking of the next title, other bots' chats, delivery and archiving.
+"""
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass, field
+import logging
+import time
+from typing import Any, Callable, Iterable
+
+from app.buttons import bot_key
+from app.cancel import Stopped, cancellable, is_set, sleep
+from app.catalog import open_catalog
+from app.log import log_context
+from app.profiles import BotProfile, get_profile
+from app.retry import (
+    clear_retry,
+    due_retry,
+    is_retryable,
+    schedule_retry,
+    seconds_until_next_retry,
+)
+from app.schedule import TitleScheduler, episodes_hint, estimate_seconds, parse_title_line
+from app.search_flow import run_inline_search_and_pick_first, run_search_and_pick_first
+from app.series_flow import (
+    make_archiver,
+    make_fanout,
+    make_sender,
+    run_series_until_end,
+    wait_for_media_after,
+)
+from app.state import new_state, save_state
+from app.titles import TitleIndex
+from app.watchdog import beat, idle
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("search", "first_media", "walk")
+# Titles each stage handles at once; only titles of different bot chats, or
+# the chat-free part of a search, actually run side by side.
+DEFAULT_CONCURRENCY = {"search": 2, "first_media": 2, "walk": 2}
+# Reasons that end the whole run rather than just the current title.
+STOP_REASONS = frozenset({"stopped", "drained"})
+
+_FOLLOW_POLL_SECONDS = 1
+
+# Search results that mean the mode itself does not work with the bot.
+SEARCH_MODE_FAILURES = frozenset({"no_inline_results"})
+# Misses that are about the title: the bot answered, just not with it.
+# Timeouts are not counted either way.
+SEARCH_TITLE_MISSES = frozenset({"no_results_buttons", "no_confident_match"})
+
+SEARCH_FLOWS = {
+    "chat": run_search_and_pick_first,
+    "inline": run_inline_search_and_pick_first,
+}
+
+
+@dataclass
+class TitleItem:
+    title: str
+    bot: str
+    retry: dict[str, Any] | None = None
+    resumed: bool = False
+    resume_from: int = 0
+    next_message_id: int = 0
+    dispatched: int = 0
+    reason: str | None = None
+    error: BaseException | None = None
+    done: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    turn: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+    talking: bool = False
+
+    @property
+    def chat(self) -> str:
+        return bot_key(self.bot)
+
+
+@dataclass
+class StageStats:
+    started: int = 0
+    finished: int = 0
+    failed: int = 0
+    active: int = 0
+    seconds: float = 0.0
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "started": self.started,
+            "finished": self.finished,
+            "failed": self.failed,
+            "active": self.active,
+            "seconds": round(self.seconds, 1),
+        }
+
+
+# Called as ``hook(stage, event, item)`` with event ``start``, ``done`` or ``error``.
+StageHook = Callable[[str, str, TitleItem], None]
+
+
+class Turns:
+    """Gives the titles of each bot chat the chat one after another, in queue order."""
+
+    def __init__(self) -> None:
+        self._lines: dict[str, list[TitleItem]] = {}
+        self._freed_at: dict[str, float] = {}
+
+    def join(self, item: TitleItem) -> None:
+        line = self._lines.setdefault(item.chat, [])
+        line.append(item)
+        if len(line) == 1:
+            item.turn.set_result(None)
+
+    def leave(self, item: TitleItem) -> None:
+        line = self._lines.get(item.chat, [])
+        if item not in line:
+            return
+        if line[0] is item:
+            self._freed_at[item.chat] = time.monotonic()
+            if len(line) > 1:
+                line[1].turn.set_result(None)
+        line.remove(item)
+        if not line:
+            del self._lines[item.chat]
+
+    def idle_seconds(self, chat: str) -> float | None:
+        """Seconds since the chat's previous title was over, None for its first."""
+        freed_at = self._freed_at.get(chat)
+        return None if freed_at is None else time.monotonic() - freed_at
+
+
+class Engine:
+    """Runs titles through the stages against a bot chat.
+
+    ``process`` may be awaited concurrently and ``run`` keeps several titles
+    queued; each stage handles at most ``concurrency[stage]`` titles at a
+    time (``DEFAULT_CONCURRENCY``), and titles of one bot chat take turns
+    (``Turns``). ``walk=False`` delivers only the first media of a title
+    (``search-send``).
+
+    ``config`` gets the bot's profile applied. Without ``search_flow`` the
+    search mode comes from it (``auto`` picks the fastest working one), and
+    stage latencies, search outcomes and series lengths are recorded into
+    the profile's learned data. A title may name another bot
+    (``process(..., bot=...)``); it then runs with that bot's profile and
+    its own checkpoint in ``checkpoints``.
+    """
+
+    def __init__(
+        self,
+        client: Any,
+        bot_username: str,
+        *,
+        config: Any,
+        state: dict[str, Any] | None = None,
+        state_path: str | None = None,
+        search_flow: Any = None,
+        walk: bool = True,
+        stop_event: asyncio.Event | None = None,
+        drain_event: asyncio.Event | None = None,
+        concurrency: dict[str, int] | None = None,
+        hooks: Iterable[StageHook] = (),
+    ) -> None:
+        self.client = client
+        self.bot_username = bot_username
+        self.base_config = config
+        self.profile = get_profile(bot_username, config)
+        self.config = self.profile.apply(config)
+        self._profiles = {self.profile.bot: self.profile}
+        self.state = state if state is not None else new_state()
+        self.state_path = state_path
+        self.search_flow = search_flow
+        self.walk = walk
+        self.stop_event = stop_event
+        self.drain_event = drain_event
+        self.concurrency = dict(DEFAULT_CONCURRENCY)
+        self.concurrency.update(concurrency or {})
+        self.turns = Turns()
+        self.hooks = list(hooks)
+        self.stats = {name: StageStats() for name in STAGES}
+        self.catalog = None
+        self.fanout = None
+        self.archiver = None
+        self._queues: dict[str, asyncio.Queue[TitleItem]] = {}
+        self._workers: list[asyncio.Task] = []
+
+    async def __aenter__(self) -> Engine:
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    def save(self) -> None:
+        if self.state_path:
+            save_state(self.state_path, self.state)
+
+    def bot_profile(self, bot: str) -> BotProfile:
+        """Profile of ``bot``, whose learned keyboard layout seeds the state on first use."""
+        profile = get_profile(bot, self.base_config)
+        if profile.bot not in self._profiles:
+            learned_layouts = profile.learned.get("button_layouts")
+            if learned_layouts:
+                # A fresh state starts from the keyboard layout learned earlier.
+                self.state.setdefault("button_layouts", {}).setdefault(
+                    profile.bot, dict(learned_layouts)
+                )
+        self._profiles[profile.bot] = profile
+        return profile
+
+    def save_profile(self) -> None:
+        for profile in self._profiles.values():
+            layouts = self.state.get("button_layouts", {}).get(profile.bot)
+            if layouts:
+                profile.learned["button_layouts"] = layouts
+            try:
+                profile.save()
+            except OSError:
+                logger.exception("could not save bot profile %s", profile.learned_path)
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
+
+    def start(self) -> None:
+        state = self.state
+        if not state.get("checkpoints") and state.get("last_media_message_id"):
+            # A checkpoint from before ``checkpoints``, kept for one bot chat.
+            state["checkpoints"] = {
+                bot_key(state.get("last_bot_chat") or self.bot_username): {
+                    "title": state.get("last_title", ""),
+                    "message_id": state["last_media_message_id"],
+                }
+            }
+        self.state["phase"] = "running"
+        self.state["last_bot_chat"] = self.bot_username
+        learned_layouts = self.profile.learned.get("button_layouts")
+        if learned_layouts:
+            # A fresh state starts from the keyboard layout learned earlier.
+            self.state.setdefault("button_layouts", {}).setdefault(
+                self.profile.bot, dict(learned_layouts)
+            )
+        self.save()
+        self.catalog = open_catalog(self.config)
+        self.fanout = make_fanout(
+            self.client, self.config, self.state, self.state_path, self.catalog
+        )
+        self.fanout.start()
+        self.archiver = make_archiver(self.client, self.config, self.state, self.state_path)
+        if self.archiver is not None:
+            self.archiver.start()
+
+        handlers = {
+            "search": self._search,
+            "first_media": self._first_media,
+            "walk": self._walk,
+        }
+        self._queues = {name: asyncio.Queue() for name in STAGES}
+        for position, name in enumerate(STAGES):
+            following = STAGES[position + 1] if position + 1 < len(STAGES) else None
+            for _ in range(max(1, self.concurrency[name])):
+                self._workers.append(
+                    asyncio.create_task(self._run_stage(name, handlers[name], following))
+                )
+
+    async def close(self) -> None:
+        """Stop the stage workers and let delivery and archiving finish."""
+        if is_set(self.stop_event, self.drain_event):
+            self.state["phase"] = "stopping"
+            self.save()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        with idle():
+            if self.fanout is not None:
+                await self.fanout.close(self.stop_event)
+            if self.archiver is not None:
+                await self.archiver.close(self.stop_event)
+        if self.catalog is not None:
+            self.catalog.close()
+        self.save_profile()
+        self.state["phase"] = "idle"
+        self.save()
+
+    def _emit(self, stage: str, event: str, item: TitleItem) -> None:
+        for hook in self.hooks:
+            try:
+                hook(stage, event, item)
+            except Exception:
+                logger.exception("stage hook failed stage=%s event=%s", stage, event)
+
+    async def process(
+        self,
+        title: str,
+        retry: dict[str, Any] | None = None,
+        *,
+        bot: str = "",
+    ) -> TitleItem:
+        """Run one title through every stage; ``item.reason`` tells how it ended."""
+        item = TitleItem(title=title, bot=bot or self.bot_username, retry=retry)
+        self.turns.join(item)
+        self._queues[STAGES[0]].put_nowait(item)
+        await item.done
+        self.state["stages"] = self.snapshot()
+        self.save_profile()
+        if item.error is not None:
+            raise item.error
+        return item
+
+    async def _run_stage(
+        self,
+        name: str,
+        handler: Callable[[TitleItem], Any],
+        following: str | None,
+    ) -> None:
+        stats = self.stats[name]
+        inbox = self._queues[name]
+        while True:
+            item = await inbox.get()
+            if name == STAGES[0] and is_set(self.stop_event, self.drain_event):
+                # Queued before the stop and not started: left for the next run.
+                item.reason = "stopped" if is_set(self.stop_event) else "drained"
+                self.turns.leave(item)
+                item.done.set_result(item)
+                continue
+            stats.started += 1
+            stats.active += 1
+            self._emit(name, "start", item)
+            started = time.monotonic()
+            try:
+                with log_context(title=item.title, phase=name):
+                    await handler(item)
+            except Stopped:
+                item.reason = "stopped"
+            except Exception as exc:
+                item.error = exc
+            finally:
+                stats.active -= 1
+                stats.seconds += time.monotonic() - started
+            if item.error is not None:
+                stats.failed += 1
+                self._emit(name, "error", item)
+            else:
+                stats.finished += 1
+                self._emit(name, "done", item)
+
+            if item.reason is None and item.error is None and following is not None:
+                self._queues[following].put_nowait(item)
+            elif not item.done.done():
+                self.turns.leave(item)
+                item.done.set_result(item)
+
+    async def _take_turn(self, item: TitleItem) -> None:
+        """Wait until ``item`` may talk in its bot chat; ``Stopped`` on stop or drain.
+
+        The first time, the chat's previous title ended at least
+        ``SEARCH_DELAY_SECONDS`` ago.
+        """
+        if item.talking:
+            return
+        await cancellable(asyncio.shield(item.turn), self.stop_event)
+        if is_set(self.drain_event):
+            raise Stopped
+        idle_seconds = self.turns.idle_seconds(item.chat)
+        delay = self.config.search_delay_seconds - (idle_seconds or 0)
+        if idle_seconds is not None and delay > 0:
+            with idle():
+                if await sleep(delay, self.stop_event, self.drain_event):
+                    raise Stopped
+        item.talking = True
+
+    def checkpoint(self, bot: str) -> dict[str, Any]:
+        """Title in progress in ``bot``'s chat and the media to resume it from."""
+        return self.state.get("checkpoints", {}).get(bot_key(bot)) or {}
+
+    def _save_checkpoint(self, item: TitleItem, message_id: int) -> None:
+        self.state.setdefault("checkpoints", {})[item.chat] = {
+            "title": item.title,
+            "message_id": message_id,
+        }
+        # The latest checkpoint of any chat, for ``status`` and the API.
+        self.state["last_title"] = item.title
+        self.state["last_media_message_id"] = message_id
+
+    def _clear_checkpoint(self, item: TitleItem) -> None:
+        if self.checkpoint(item.bot).get("title") == item.title:
+            del self.state["checkpoints"][item.chat]
+        if self.state.get("last_title") == item.title:
+            self.state["last_media_message_id"] = 0
+
+    def _interrupted(self, item: TitleItem) -> bool:
+        checkpoint = self.checkpoint(item.bot)
+        return checkpoint.get("title") == item.title and bool(checkpoint.get("message_id"))
+
+    async def _search(self, item: TitleItem) -> None:
+        if self.catalog is not None and self.catalog.is_complete(
+            item.title, self.config.target_chat_ids
+        ):
+            logger.info("title=%s already delivered, skipping", item.title)
+            item.reason = "already_delivered"
+            return
+
+        if self._interrupted(item):
+            item.resumed = True
+            item.resume_from = int(self.checkpoint(item.bot)["message_id"])
+            logger.info("resume title=%s from message_id=%s", item.title, item.resume_from)
+            return
+
+        waited = 0.0
+
+        async def take_turn() -> None:
+            nonlocal waited
+            turn_started = time.monotonic()
+            await self._take_turn(item)
+            waited = time.monotonic() - turn_started
+            self._save_checkpoint(item, 0)
+            self.save()
+
+        profile = self.bot_profile(item.bot)
+        if self.search_flow is None:
+            mode = profile.search_mode(profile.apply(self.base_config).search_mode)
+            search_flow = SEARCH_FLOWS[mode]
+        else:
+            search_flow = self.search_flow
+            mode = next((name for name, flow in SEARCH_FLOWS.items() if flow is search_flow), None)
+        started = time.monotonic()
+        try:
+            result = await search_flow(
+                self.client,
+                item.bot,
+                item.title,
+                stop_event=self.stop_event,
+                take_turn=take_turn,
+            )
+        except (OSError, Stopped):
+            raise
+        except Exception:
+            # e.g. a bot without inline mode answers the query with an RPC error.
+            if mode is not None:
+                profile.record_search(mode, False)
+            raise
+        if mode is not None:
+            reason = result.get("reason")
+            if result.get("ok") and reason != "stopped":
+                profile.record_search(mode, True, time.monotonic() - started - waited)
+            elif reason in SEARCH_MODE_FAILURES:
+                profile.record_search(mode, False)
+            elif reason in SEARCH_TITLE_MISSES:
+                profile.record_search(mode, True)
+        if result.get("reason") == "stopped":
+            item.reason = "stopped"
+        elif not result.get("ok"):
+            item.reason = result.get("reason") or "search_failed"
+        else:
+            item.next_message_id = result["next_message_id"]
+            picked = result.get("picked_button_text") or result.get("picked_inline_title") or ""
+            episodes = episodes_hint(picked)
+            if episodes:
+                profile.record_title_hint(item.title, episodes)
+
+    async def _first_media(self, item: TitleItem) -> None:
+        if item.resumed:
+            return
+        await self._take_turn(item)
+        started = time.monotonic()
+        profile = self.bot_profile(item.bot)
+        entity = await cancellable(self.client.get_entity(item.bot), self.stop_event)
+        first_media = await wait_for_media_after(
+            self.client,
+            entity,
+            after_id=item.next_message_id - 1,
+            timeout_seconds=profile.apply(self.base_config).wait_next_media_timeout_seconds,
+            stop_event=self.stop_event,
+        )
+        if not first_media:
+            item.reason = "stopped" if is_set(self.stop_event) else "no_media_after_pick"
+            return
+
+        beat()
+        profile.record_latency("first_media", time.monotonic() - started)
+        self._save_checkpoint(item, first_media.id)
+        self.save()
+        item.resume_from = first_media.id
+
+    async def _walk(self, item: TitleItem) -> None:
+        await self._take_turn(item)
+        started = time.monotonic()
+        profile = self.bot_profile(item.bot)
+        result = await run_series_until_end(
+            self.client,
+            item.bot,
+            item.resume_from,
+            state=self.state,
+            state_path=self.state_path,
+            stop_event=self.stop_event,
+            sender=make_sender(
+                self.fanout, self.config, item.title, self.archiver, resumed=item.resumed
+            ),
+            catalog=self.catalog,
+            drain_event=self.drain_event,
+            catch_up=item.resumed,
+            follow_next=self.walk,
+            on_checkpoint=lambda message_id: self._save_checkpoint(item, message_id),
+        )
+        item.dispatched = int(result.get("dispatched", 0))
+        item.reason = result.get("reason") or "series_done"
+        if self.walk and item.dispatched > 1:
+            profile.record_latency("episode", (time.monotonic() - started) / item.dispatched)
+        if item.reason == "end_no_next_button":
+            if not item.resumed:
+                profile.record_series_length(item.dispatched, item.title)
+            if self.catalog is not None:
+                self.catalog.mark_complete(
+                    item.title, item.reason, self.config.target_chat_ids
+                )
+
+    async def run_title(self, title: str) -> TitleItem:
+        with log_context(title=title):
+            item = await self.process(title)
+            logger.info("reason=%s", item.reason, extra={"reason": item.reason})
+        return item
+
+    def estimate(self, line: Any) -> float:
+        return estimate_seconds(
+            line,
+            self.bot_profile(line.bot or self.bot_username),
+            self.catalog,
+            self.config.target_chat_ids,
+        )
+
+    def _next_retry(self, in_flight: set[str]) -> dict[str, Any] | None:
+        """The retry to start next, if any.
+
+        A retry whose title a previous run left half walked goes first, due
+        or not, so nothing else searches in its bot chat before it resumes;
+        otherwise the earliest due retry. Lines in ``in_flight`` are skipped.
+        """
+        waiting = [
+            entry for entry in self.state.get("retry_queue", []) if entry["title"] not in in_flight
+        ]
+        for entry in waiting:
+            line = parse_title_line(entry["title"])
+            checkpoint = self.checkpoint(line.bot or self.bot_username)
+            if checkpoint.get("message_id") and checkpoint.get("title") == line.title:
+                return entry
+        return due_retry({"retry_queue": waiting})
+
+    def _pick(
+        self, scheduler: TitleScheduler, titles: TitleIndex, in_flight: set[str]
+    ) -> tuple[int | None, str, dict[str, Any] | None] | None:
+        """``(index, line, retry)`` of the title to start next, None when none is ready.
+
+        Interrupted titles go before retries and retries before new titles,
+        so within a bot chat, where titles take turns in this order, the
+        interrupted one resumes before anything else searches there.
+        """
+        index = scheduler.interrupted()
+        if index is None:
+            retry = self._next_retry(in_flight)
+            if retry is not None:
+                return None, retry["title"], retry
+            index = scheduler.next()
+            if index is None:
+                titles.refresh()
+                scheduler.invalidate()
+                self.state["titles_count"] = len(titles)
+                index = scheduler.next()
+            if index is None:
+                return None
+        scheduler.begin(index)
+        return index, titles[index], None
+
+    async def _process_line(self, line: str, retry: dict[str, Any] | None) -> TitleItem:
+        entry = parse_title_line(line)
+        with log_context(title=entry.title):
+            if retry is not None:
+                logger.info(
+                    "retry title=%s attempt=%s reason=%s",
+                    entry.title,
+                    retry["attempts"] + 1,
+                    retry["reason"],
+                )
+            item = await self.process(entry.title, retry, bot=entry.bot)
+            logger.info("reason=%s", item.reason, extra={"reason": item.reason})
+        return item
+
+    async def run(self, titles: TitleIndex) -> dict[str, Any]:
+        """Process ``titles`` in ``TITLE_ORDER``, resuming from and saving to the state.
+
+        Up to ``concurrency["search"] + concurrency["walk"]`` titles are
+        queued at once, so the next title's search is under way while one
+        is walked. Transient failures go to the retry queue and are picked
+        up between new titles; with ``titles.follow`` the run keeps waiting
+        for lines appended to the file. Retries keep the title's line with
+        its tags.
+        """
+        state = self.state
+        scheduler = TitleScheduler(
+            titles,
+            state,
+            order=self.config.title_order,
+            window=self.config.schedule_window,
+            default_bot=self.bot_username,
+            estimate=self.estimate,
+        )
+        queued = max(1, self.concurrency["search"] + self.concurrency["walk"])
+        running: dict[asyncio.Task, tuple[int | None, str, dict[str, Any] | None]] = {}
+        stopping = False
+        try:
+            while True:
+                if not stopping and is_set(self.stop_event, self.drain_event):
+                    logger.info(
+                        "stop requested before title index=%s", state.get("current_index", 0)
+                    )
+                    stopping = True
+                while not stopping and len(running) < queued:
+                    picked = self._pick(scheduler, titles, {line for _, line, _ in running.values()})
+                    if picked is None:
+                        break
+                    index, line, retry = picked
+                    running[asyncio.create_task(self._process_line(line, retry))] = picked
+
+                if not running:
+                    if stopping:
+                        break
+                    wait_seconds = seconds_until_next_retry(state)
+                    if titles.follow:
+                        wait_seconds = min(wait_seconds or _FOLLOW_POLL_SECONDS, _FOLLOW_POLL_SECONDS)
+                    if wait_seconds is None:
+                        break
+                    with idle():
+                        interrupted = await sleep(wait_seconds, self.stop_event, self.drain_event)
+                    if interrupted:
+                        logger.info("stop requested while waiting for titles")
+                        stopping = True
+                    continue
+
+                # With room in the queue, look for new lines and due retries now and then.
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=None if stopping or len(running) >= queued else _FOLLOW_POLL_SECONDS,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    index, line, retry = running.pop(task)
+                    item = task.result()
+                    if item.reason in STOP_REASONS:
+                        stopping = True
+                        if index is not None:
+                            scheduler.release(index, active=self._interrupted(item))
+                        continue
+                    # The title is over; nothing is left to resume.
+                    self._clear_checkpoint(item)
+                    if is_retryable(item.reason):
+                        schedule_retry(
+                            state, line, item.reason, max_attempts=self.config.retry_max_attempts
+                        )
+                    elif retry is not None:
+                        clear_retry(state, line)
+                    if index is not None:
+                        scheduler.finish(index)
+                    self.save()
+        finally:
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+        return state
@@ -0,0 +1,151 @@
+"""Persistent job records for queued runs."""
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, field, fields
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import threading
+from typing import Any
+import uuid
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_PAUSED = "paused"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+UNFINISHED_STATUSES = frozenset({JOB_QUEUED, JOB_RUNNING})
+
+KIND_TITLES = "titles"
+KIND_RECONCILE = "reconcile"
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+@dataclass
+class Job:
+    job_id: str
+    bot_username: str
+    session_name: str
+    state_path: str
+    titles_path: str = ""
+    follow: bool = False
+    inline: bool = False
+    priority: int = 0
+    kind: str = KIND_TITLES
+    options: dict[str, Any] = field(default_factory=dict)
+    status: str = JOB_QUEUED
+    created_at: str = ""
+    updated_at: str = ""
+    last_error: str | None = None
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Job":
+        known = {item.name for item in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+
+class JobStore:
+    """One JSON file per job plus its own state file in ``directory``.
+
+    ``save`` may run on worker threads; writes of one store are serialized so
+    that two saves of a job never share its temporary file.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+
+    def _job_path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+
+    def state_path_for(self, job_id: str) -> str:
+        return str(self.directory / f"{job_id}.state.json")
+
+    def titles_path_for(self, job_id: str) -> str:
+        return str(self.directory / f"{job_id}.titles.txt")
+
+    def new_job_id(self) -> str:
+        return uuid.uuid4().hex[:12]
+
+    def create(
+        self,
+        *,
+        titles_path: str,
+        bot_username: str,
+        session_name: str,
+        job_id: str | None = None,
+        follow: bool = False,
+        inline: bool = False,
+        priority: int = 0,
+        state_path: str | None = None,
+        kind: str = KIND_TITLES,
+        options: dict[str, Any] | None = None,
+    ) -> Job:
+        job_id = job_id or self.new_job_id()
+        now = _now_iso()
+        job = Job(
+            job_id=job_id,
+            bot_username=bot_username,
+            session_name=session_name,
+            state_path=state_path or self.state_path_for(job_id),
+            titles_path=titles_path,
+            follow=follow,
+            inline=inline,
+            priority=priority,
+            kind=kind,
+            options=dict(options or {}),
+            created_at=now,
+        )
+        self.save(job)
+        return job
+
+    def save(self, job: Job) -> None:
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            job.updated_at = _now_iso()
+            path = self._job_path(job.job_id)
+            tmp_path = path.with_suffix(path.suffix + ".tmp")
+            with tmp_path.open("w", encoding="utf-8") as handle:
+                json.dump(job.to_dict(), handle, ensure_ascii=False, indent=2)
+                handle.write("\n")
+            os.replace(tmp_path, path)
+
+    def _load(self, path: Path) -> Job:
+        with path.open("r", encoding="utf-8") as handle:
+            return Job.from_dict(json.load(handle))
+
+    def get(self, job_id: str) -> Job | None:
+        path = self._job_path(job_id)
+        if not path.exists():
+            return None
+        return self._load(path)
+
+    def list(self) -> list[Job]:
+        if not self.directory.exists():
+            return []
+        jobs = []
+        for path in self.directory.glob("*.json"):
+            if path.name.endswith(".state.json"):
+                continue
+            jobs.append(self._load(path))
+        jobs.sort(key=lambda job: (-job.priority, job.created_at))
+        return jobs
+
+    def delete(self, job_id: str) -> None:
+        job = self.get(job_id)
+        self._job_path(job_id).unlink(missing_ok=True)
+        if job is None:
+            return
+        if job.state_path == self.state_path_for(job_id):
+            Path(job.state_path).unlink(missing_ok=True)
+        if job.titles_path == self.titles_path_for(job_id):
+            Path(job.titles_path).unlink(missing_ok=True)
@@ -1,9 +1,184 @@
-"""Logging setup."""
+"""Logging setup.
+
+Records are handed to a queue and written by a ``QueueListener`` thread, so
+formatting and I/O never run on the event loop that does the clicking.
+"""
+from __future__ import annotations
+
+import atexit
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+import json
 import logging
+import os
+import queue
+import threading
+from typing import Any, Iterator
 
 
 LOG_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+
+# Extra record attributes exported as structured fields.
+STRUCTURED_FIELDS = ("title", "msg_id", "phase", "reason", "target", "job_id")
+
+_context: ContextVar[dict[str, Any]] = ContextVar("log_context", default={})
+_listener: Any = None
+_buffer: LogBuffer | None = None
+
+
+@contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """Attach ``fields`` to every record logged inside the block (per task)."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+def record_fields(record: logging.LogRecord) -> dict[str, Any]:
+    data: dict[str, Any] = {
+        "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+        "level": record.levelname,
+        "logger": record.name,
+        "message": record.getMessage(),
+    }
+    for key in STRUCTURED_FIELDS:
+        value = getattr(record, key, None)
+        if value is not None:
+            data[key] = value
+    return data
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record_fields(record), ensure_ascii=False, default=str)
+
+
+class LogBuffer:
+    """Bounded buffer of recent records; formatting happens only when read."""
+
+    def __init__(self, maxlen: int = 2000) -> None:
+        self._records: deque[tuple[int, logging.LogRecord]] = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._seq = 0
+
+    def append(self, record: logging.LogRecord) -> None:
+        with self._lock:
+            self._seq += 1
+            self._records.append((self._seq, record))
+
+    def query(
+        self,
+        *,
+        level: int = logging.NOTSET,
+        title: str | None = None,
+        after: int = 0,
+        limit: int = 200,
+    ) -> tuple[list[tuple[int, logging.LogRecord]], int]:
+        """Newest ``limit`` records after cursor ``after``, plus the next cursor."""
+        with self._lock:
+            records = list(self._records)
+            cursor = self._seq
+        wanted = title.casefold() if title else None
+        matched = [
+            (seq, record)
+            for seq, record in records
+            if seq > after
+            and record.levelno >= level
+            and (wanted is None or str(getattr(record, "title", "")).casefold() == wanted)
+        ]
+        return matched[-limit:], cursor
+
+
+class BufferHandler(logging.Handler):
+    def __init__(self, buffer: LogBuffer) -> None:
+        super().__init__()
+        self.buffer = buffer
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.buffer.append(record)
+
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging(
+    level: int = logging.INFO,
+    *,
+    buffer: LogBuffer | None = None,
+    log_file: str | None = None,
+    background: bool = True,
+) -> None:
+    """Route the root logger to stderr, ``LOG_FILE`` and ``buffer``.
+
+    With ``background`` the handlers run in a ``QueueListener`` thread;
+    short one-shot commands pass ``False`` and skip starting it.
+    ``LOG_FILE`` (JSON lines, rotated) is read from the environment when
+    ``log_file`` is not given. Calling it again rebuilds the pipeline and
+    keeps a previously attached buffer.
+    """
+    global _listener, _buffer
+    if log_file is None:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        log_file = os.getenv("LOG_FILE", "")
+    if buffer is not None:
+        _buffer = buffer
+    _stop_listener()
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+    handlers: list[logging.Handler] = [console]
+    if log_file:
+        from logging.handlers import RotatingFileHandler
+
+        file_handler = RotatingFileHandler(
+            log_file,
+            maxBytes=LOG_FILE_MAX_BYTES,
+            backupCount=LOG_FILE_BACKUPS,
+            encoding="utf-8",
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    if _buffer is not None:
+        handlers.append(BufferHandler(_buffer))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+    if not background:
+        for handler in handlers:
+            handler.addFilter(ContextFilter())
+            root.addHandler(handler)
+        return
+
+    from logging.handlers import QueueHandler, QueueListener
+
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    root.addHandler(queue_handler)
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
 
 
-def setup_logging(level: int = logging.INFO) -> None:
-    logging.basicConfig(level=level, format=LOG_FORMAT)
+atexit.register(_stop_listener)
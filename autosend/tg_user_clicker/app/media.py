@@ -1,50 +1,142 @@
 """Media detection and forwarding helpers."""
 from __future__ import annotations
 
-import logging
-from typing import Any
+import re
+from typing import Any, Callable
 
-logger = logging.getLogger(__name__)
+# Telegram accepts at most 10 items in one album.
+MAX_ALBUM_SIZE = 10
 
-sent_message_ids: set[int] = set()
-sent_total = 0
-sent_in_batch = 0
+_EPISODE_RE = re.compile(r"(?:серия|эпизод|episode|\be)\s*(\d{1,4})", re.IGNORECASE)
+
+CAPTION_FIELDS = ("title", "episode", "caption")
 
 
 def is_media_message(msg: Any) -> bool:
     return bool(getattr(msg, "video", None) or getattr(msg, "document", None))
 
 
-async def send_to_target(client, msg, target_chat_id, mode="copy"):
+def media_kind(msg: Any) -> str:
+    # Albums cannot mix videos with generic documents.
+    return "video" if getattr(msg, "video", None) else "document"
+
+
+def episode_number(msg: Any) -> int | None:
+    file = getattr(msg, "file", None)
+    candidates = [getattr(msg, "message", "") or "", getattr(file, "name", "") or ""]
+    for text in candidates:
+        match = _EPISODE_RE.search(text)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def check_caption_template(template: str) -> None:
+    """Raise ``ValueError`` unless ``template`` renders with ``CAPTION_FIELDS`` alone."""
     try:
-        # Универсальный вариант для всех версий Telethon
-        await client.forward_messages(
-            entity=target_chat_id,
-            messages=msg,
-            from_peer=msg.chat_id,
-        )
-        return True
-    except Exception:
-        logger.exception(
-            f"Failed to send message id={msg.id} to target={target_chat_id}"
+        # An episode without a number renders as "", so probe with that.
+        template.format(**{field: "" for field in CAPTION_FIELDS})
+    except KeyError as exc:
+        raise ValueError(f"unknown placeholder {{{exc.args[0]}}}") from exc
+    except (ValueError, IndexError, AttributeError) as exc:
+        raise ValueError(str(exc)) from exc
+
+
+def render_caption(template: str, msg: Any, *, title: str, episode: int | None) -> str:
+    caption = getattr(msg, "message", "") or ""
+    if not template:
+        return caption
+    return template.format(
+        title=title,
+        episode="" if episode is None else episode,
+        caption=caption,
+    )
+
+
+async def deliver_batch(
+    client: Any,
+    items: list[tuple[Any, str]],
+    target_chat_id: Any,
+    mode: str = "copy",
+) -> Any:
+    """Deliver ``(message, caption)`` pairs in a single request."""
+    messages = [msg for msg, _ in items]
+    if mode == "copy":
+        # Re-sending the media object reuses the file reference, nothing is uploaded.
+        if len(items) == 1:
+            return await client.send_file(
+                target_chat_id, file=messages[0].media, caption=items[0][1]
+            )
+        return await client.send_file(
+            target_chat_id,
+            file=[msg.media for msg in messages],
+            caption=[caption for _, caption in items],
         )
-        return False
+    return await client.forward_messages(
+        entity=target_chat_id,
+        messages=messages if len(messages) > 1 else messages[0],
+        from_peer=messages[0].chat_id,
+    )
+
+
+class MediaSender:
+    """Buffers consecutive media of one title and hands them over as albums.
+
+    ``dispatch`` receives each full batch of ``(message, caption, episode)``
+    items together with the title and takes ownership of delivering it (see ``app.delivery.FanOut``); the
+    optional ``archive`` callback gets every added message right away.
+    Episodes without a number of their own are numbered in order of arrival,
+    except with ``count_episodes=False`` (a walk resumed mid-title, where
+    the count would restart at 1); they then have no number.
+    """
 
+    def __init__(
+        self,
+        dispatch: Callable[[list[tuple[Any, str, int | None]], str], None],
+        *,
+        mode: str = "copy",
+        album_size: int = MAX_ALBUM_SIZE,
+        caption_template: str = "",
+        title: str = "",
+        archive: Callable[[Any, str, int | None], None] | None = None,
+        count_episodes: bool = True,
+    ) -> None:
+        self.dispatch = dispatch
+        self.archive = archive
+        self.album_size = max(1, min(album_size, MAX_ALBUM_SIZE))
+        self.caption_template = caption_template if mode == "copy" else ""
+        self.title = title
+        self.pending: list[tuple[Any, str, int | None]] = []
+        self._sequence: int | None = 0 if count_episodes else None
 
-def already_sent(msg: Any) -> bool:
-    return msg.id in sent_message_ids
+    def is_pending(self, msg_id: int) -> bool:
+        return any(item[0].id == msg_id for item in self.pending)
 
+    def checkpoint_id(self, current_id: int) -> int:
+        """Oldest message that is not handed over yet, so a resume does not skip it."""
+        return self.pending[0][0].id if self.pending else current_id
 
-def mark_sent(msg: Any) -> None:
-    sent_message_ids.add(msg.id)
+    def add(self, msg: Any) -> list[Any]:
+        handed_over: list[Any] = []
+        if self.pending and media_kind(self.pending[0][0]) != media_kind(msg):
+            handed_over.extend(self.flush())
 
+        if self._sequence is not None:
+            self._sequence += 1
+        episode = episode_number(msg) or self._sequence
+        caption = render_caption(self.caption_template, msg, title=self.title, episode=episode)
+        self.pending.append((msg, caption, episode))
+        if self.archive is not None:
+            self.archive(msg, self.title, episode)
 
-def record_sent(batch_size: int) -> None:
-    global sent_total
-    global sent_in_batch
+        if len(self.pending) >= self.album_size:
+            handed_over.extend(self.flush())
+        return handed_over
 
-    sent_total += 1
-    sent_in_batch += 1
-    if sent_in_batch == batch_size:
-        logger.info("batch complete: %s", sent_total)
-        sent_in_batch = 0
+    def flush(self) -> list[Any]:
+        if not self.pending:
+            return []
+        batch = self.pending
+        self.pending = []
+        self.dispatch(batch, self.title)
+        return [item[0] for item in batch]
@@ -0,0 +1,100 @@
+"""Pressing a button across many chats at once (``press`` with several chats)."""
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+import logging
+from typing import Any, Iterable
+
+from app.buttons import ButtonMatch, ButtonMatcher, click_button, match_rule
+from app.ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PressResult:
+    chat: str
+    # ``clicked``, ``no_match`` or ``failed``.
+    status: str
+    msg_id: int | None = None
+    button: str = ""
+    error: str = ""
+
+    def line(self) -> str:
+        if self.status == "clicked":
+            return f"{self.chat}: clicked {self.button!r} on msg_id={self.msg_id}"
+        if self.status == "failed":
+            return f"{self.chat}: failed ({self.error})"
+        return f"{self.chat}: no matching button"
+
+
+def first_match(
+    messages: Iterable[Any], matchers: list[ButtonMatcher]
+) -> tuple[Any, ButtonMatch] | None:
+    """Newest message with a button matching any of ``matchers``, in their order."""
+    for message in messages:
+        for matcher in matchers:
+            match = matcher.find(message)
+            if match:
+                return message, match
+    return None
+
+
+async def _click(message: Any, match: ButtonMatch, limiter: RateLimiter) -> Any:
+    from telethon.errors import FloodWaitError
+
+    await limiter.acquire()
+    try:
+        return await click_button(message, match)
+    except FloodWaitError as exc:
+        logger.info("flood wait %ss before clicking msg_id=%s", exc.seconds, message.id)
+        limiter.pause(exc.seconds)
+        await limiter.acquire()
+        return await click_button(message, match)
+
+
+async def press_chats(
+    client: Any,
+    chats: list[str],
+    patterns: list[str],
+    *,
+    rules: dict[str, str],
+    limit: int = 20,
+    concurrency: int = 8,
+    rate: float = 1.0,
+) -> list[PressResult]:
+    """Click the newest matching button in every chat; one result per chat.
+
+    History is fetched for up to ``concurrency`` chats at a time and every
+    chat clicks as soon as its match is found, while ``rate`` (clicks per
+    second, shared by all chats) keeps the account clear of flood waits.
+    """
+    fetching = asyncio.Semaphore(max(1, concurrency))
+    limiter = RateLimiter(rate)
+    compiled: dict[str, list[ButtonMatcher]] = {}
+
+    def matchers_for(chat: str) -> list[ButtonMatcher]:
+        rule = match_rule(rules, chat)
+        if rule not in compiled:
+            compiled[rule] = [ButtonMatcher(pattern, rule=rule) for pattern in patterns]
+        return compiled[rule]
+
+    async def press(chat: str) -> PressResult:
+        try:
+            async with fetching:
+                entity = await client.get_entity(chat)
+                messages = await client.get_messages(entity, limit=limit)
+            found = first_match(messages, matchers_for(chat))
+            if found is None:
+                return PressResult(chat, "no_match")
+            message, match = found
+            label = getattr(match.button, "text", "") or ""
+            await _click(message, match, limiter)
+            logger.info("chat=%s clicked %r on msg_id=%s", chat, label, message.id)
+            return PressResult(chat, "clicked", msg_id=message.id, button=label)
+        except Exception as exc:
+            logger.info("chat=%s press failed: %r", chat, exc)
+            return PressResult(chat, "failed", error=f"{type(exc).__name__}: {exc}")
+
+    return await asyncio.gather(*(press(chat) for chat in chats))
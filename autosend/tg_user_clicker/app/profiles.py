@@ -0,0 +1,286 @@
+"""Per-bot profiles: overrides of ``Config`` and what was learned about the bot.
+
+A profile lives in ``BOT_PROFILES_DIR/<bot>.json`` (or ``.yaml``/``.yml``
+when PyYAML is installed), named after the bot without ``@``::
+
+    {"config": {"wait_next_media_timeout_seconds": 40, "search_mode": "auto"}}
+
+Any ``Config`` field can be overridden, by field or env name. What the
+runner learns goes to ``<bot>.learned.json`` next to it, so a hand-written
+profile is never rewritten: latency samples per step, search outcomes per
+mode, series lengths (overall and per title) and the keyboard layout.
+Profiles are read on first use and re-read when the file changes.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field, fields, replace
+from datetime import datetime, timezone
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any
+
+from app.buttons import bot_key
+from app.config import SEARCH_MODES, load_config
+from app.media import check_caption_template
+from app.quality import parse_policy
+from app.titles import title_key
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SUFFIXES = (".json", ".yaml", ".yml")
+LEARNED_SUFFIX = ".learned.json"
+# Modes ``search_mode=auto`` chooses between.
+AUTO_SEARCH_MODES = ("chat", "inline")
+
+_LATENCY_SAMPLES = 200
+_RECENT_OUTCOMES = 20
+_SERIES_LENGTHS = 50
+_TITLE_LENGTHS = 5000
+# Below this share of recent successes a search mode counts as not working.
+_WORKING_RATE = 0.5
+
+_profiles: dict[str, BotProfile] = {}
+
+
+def _quantile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _success_rate(outcomes: list[int]) -> float:
+    return sum(outcomes) / len(outcomes) if outcomes else 0.0
+
+
+@dataclass
+class BotProfile:
+    bot: str
+    path: Path | None = None
+    learned_path: Path | None = None
+    overrides: dict[str, Any] = field(default_factory=dict)
+    learned: dict[str, Any] = field(default_factory=dict)
+    mtime: float = 0.0
+
+    def apply(self, config: Any) -> Any:
+        return replace(config, **self.overrides) if self.overrides else config
+
+    def record_latency(self, metric: str, seconds: float) -> None:
+        samples = self.learned.setdefault("latency", {}).setdefault(metric, [])
+        samples.append(round(seconds, 3))
+        del samples[:-_LATENCY_SAMPLES]
+
+    def record_search(self, mode: str, ok: bool, seconds: float | None = None) -> None:
+        """One search outcome of ``mode``; ``seconds`` only for a full search."""
+        stats = self.learned.setdefault("search", {}).setdefault(
+            mode, {"ok": 0, "failed": 0, "recent": []}
+        )
+        stats["ok" if ok else "failed"] += 1
+        stats["recent"].append(1 if ok else 0)
+        del stats["recent"][:-_RECENT_OUTCOMES]
+        if ok and seconds is not None:
+            self.record_latency(f"search.{mode}", seconds)
+
+    def record_series_length(self, episodes: int, title: str = "") -> None:
+        lengths = self.learned.setdefault("series_length", [])
+        lengths.append(episodes)
+        del lengths[:-_SERIES_LENGTHS]
+        if title:
+            self._remember_length(title, episodes, measured=True)
+
+    def record_title_hint(self, title: str, episodes: int) -> None:
+        """Episode count the bot showed for ``title``; a walked length wins."""
+        self._remember_length(title, episodes, measured=False)
+
+    def _remember_length(self, title: str, episodes: int, *, measured: bool) -> None:
+        lengths = self.learned.setdefault("title_lengths", {})
+        key = title_key(title)
+        known = lengths.get(key)
+        if known is not None and known["measured"] and not measured:
+            return
+        lengths.pop(key, None)
+        lengths[key] = {"episodes": episodes, "measured": measured}
+        while len(lengths) > _TITLE_LENGTHS:
+            del lengths[next(iter(lengths))]
+
+    def title_length(self, title: str) -> int | None:
+        known = self.learned.get("title_lengths", {}).get(title_key(title))
+        return int(known["episodes"]) if known else None
+
+    def typical_series_length(self) -> int | None:
+        lengths = self.learned.get("series_length") or []
+        return int(_quantile(lengths, 0.5)) if lengths else None
+
+    def quantiles(self, metric: str) -> dict[str, float] | None:
+        samples = self.learned.get("latency", {}).get(metric) or []
+        if not samples:
+            return None
+        return {
+            "p50": _quantile(samples, 0.5),
+            "p90": _quantile(samples, 0.9),
+            "p99": _quantile(samples, 0.99),
+            "n": len(samples),
+        }
+
+    def search_mode(self, configured: str) -> str:
+        """``configured`` unless it is ``auto``; then the fastest working mode.
+
+        Each mode is tried once before the learned data decides, and a mode
+        that keeps failing (e.g. a bot without inline support) is dropped.
+        """
+        if configured != "auto":
+            return configured
+        stats = self.learned.get("search", {})
+        for mode in AUTO_SEARCH_MODES:
+            if not stats.get(mode, {}).get("recent"):
+                return mode
+        working = [
+            mode
+            for mode in AUTO_SEARCH_MODES
+            if _success_rate(stats[mode]["recent"]) >= _WORKING_RATE
+        ]
+        if not working:
+            return max(AUTO_SEARCH_MODES, key=lambda mode: _success_rate(stats[mode]["recent"]))
+        return min(
+            working,
+            key=lambda mode: (self.quantiles(f"search.{mode}") or {"p50": float("inf")})["p50"],
+        )
+
+    def save(self) -> None:
+        if self.learned_path is None:
+            return
+        self.learned["updated_at"] = datetime.now(timezone.utc).isoformat()
+        self.learned_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.learned_path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as handle:
+            json.dump(self.learned, handle, ensure_ascii=False, indent=2)
+            handle.write("\n")
+        os.replace(tmp_path, self.learned_path)
+
+    def summary(self, config: Any) -> dict[str, Any]:
+        configured = self.apply(config).search_mode
+        search = self.learned.get("search", {})
+        return {
+            "bot": self.bot,
+            "file": str(self.path) if self.path else None,
+            "overrides": self.overrides,
+            "search_mode": configured,
+            "search_mode_used": self.search_mode(configured),
+            "search": {
+                mode: {
+                    "ok": stats["ok"],
+                    "failed": stats["failed"],
+                    "recent_success": round(_success_rate(stats["recent"]), 2),
+                }
+                for mode, stats in search.items()
+            },
+            "latency": {
+                metric: self.quantiles(metric) for metric in self.learned.get("latency", {})
+            },
+            "series_length": self.typical_series_length(),
+            "keyboard": self.learned.get("button_layouts", {}),
+            "updated_at": self.learned.get("updated_at", ""),
+        }
+
+
+def _read_file(path: Path) -> dict[str, Any]:
+    if path.suffix == ".json":
+        with path.open("r", encoding="utf-8") as handle:
+            return json.load(handle) or {}
+    try:
+        import yaml
+    except ImportError as exc:
+        raise RuntimeError(f"PyYAML is required to read {path}") from exc
+    with path.open("r", encoding="utf-8") as handle:
+        return yaml.safe_load(handle) or {}
+
+
+def _parse_overrides(path: Path, raw: dict[str, Any], config: Any) -> dict[str, Any]:
+    types = {item.name: type(getattr(config, item.name)) for item in fields(config)}
+    overrides: dict[str, Any] = {}
+    for key, value in (raw or {}).items():
+        name = str(key).lower()
+        if name not in types:
+            raise ValueError(f"{path}: unknown config field {key}")
+        kind = types[name]
+        if kind is tuple:
+            items = value if isinstance(value, list) else str(value).split(",")
+            value = tuple(str(item).strip() for item in items if str(item).strip())
+        elif kind is dict:
+            value = dict(value)
+        else:
+            try:
+                value = kind(value)
+            except (TypeError, ValueError) as exc:
+                raise ValueError(f"{path}: {key} must be {kind.__name__}") from exc
+        overrides[name] = value
+    if overrides.get("search_mode", "chat") not in SEARCH_MODES:
+        raise ValueError(f"{path}: search_mode must be one of: {', '.join(SEARCH_MODES)}")
+    if "quality_policy" in overrides:
+        overrides["quality_policy"] = str(parse_policy(overrides["quality_policy"]))
+    if "copy_caption_template" in overrides:
+        try:
+            check_caption_template(overrides["copy_caption_template"])
+        except ValueError as exc:
+            raise ValueError(f"{path}: copy_caption_template: {exc}") from exc
+    return overrides
+
+
+def _profile_file(directory: Path, bot: str) -> Path | None:
+    for suffix in PROFILE_SUFFIXES:
+        path = directory / f"{bot}{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+def get_profile(bot_username: str, config: Any | None = None) -> BotProfile:
+    """The bot's profile, loaded on first use and cached until its file changes."""
+    config = config or load_config()
+    bot = bot_key(bot_username)
+    directory = Path(config.bot_profiles_dir) if config.bot_profiles_dir else None
+    path = _profile_file(directory, bot) if directory and bot else None
+    mtime = path.stat().st_mtime if path else 0.0
+
+    cached = _profiles.get(bot)
+    if cached is not None and cached.path == path and cached.mtime == mtime:
+        return cached
+
+    overrides: dict[str, Any] = {}
+    if path is not None:
+        overrides = _parse_overrides(path, _read_file(path).get("config", {}), config)
+        logger.info("bot profile %s loaded overrides=%s", path, sorted(overrides))
+    learned_path = directory / f"{bot}{LEARNED_SUFFIX}" if directory and bot else None
+    learned = cached.learned if cached is not None else {}
+    if cached is None and learned_path is not None and learned_path.exists():
+        learned = _read_file(learned_path)
+    profile = BotProfile(
+        bot=bot,
+        path=path,
+        learned_path=learned_path,
+        overrides=overrides,
+        learned=learned,
+        mtime=mtime,
+    )
+    _profiles[bot] = profile
+    return profile
+
+
+def bot_config(bot_username: str) -> Any:
+    """``load_config()`` with the bot's profile applied."""
+    config = load_config()
+    return get_profile(bot_username, config).apply(config)
+
+
+def list_profiles(config: Any | None = None) -> list[BotProfile]:
+    """Profiles with a file or learned data in ``BOT_PROFILES_DIR``, plus those in use."""
+    config = config or load_config()
+    bots = set(_profiles)
+    if config.bot_profiles_dir and Path(config.bot_profiles_dir).is_dir():
+        for path in Path(config.bot_profiles_dir).iterdir():
+            name = path.name
+            for suffix in (LEARNED_SUFFIX, *PROFILE_SUFFIXES):
+                if name.endswith(suffix):
+                    bots.add(name[: -len(suffix)])
+                    break
+    return [get_profile(bot, config) for bot in sorted(bots) if bot]
@@ -0,0 +1,148 @@
+"""Quality policy for bots that offer several variants of an episode.
+
+Such bots put a quality button (``BUTTON_QUALITY_TEXT``) under the media;
+it opens a keyboard with labels like ``720p · 350 MB``. The policy picks
+one of them:
+
+- ``default``: leave whatever the bot sends (no menu is opened);
+- ``min_size``: the smallest file, by the size in the label, otherwise the
+  lowest resolution;
+- ``max_resolution``: the highest resolution, larger file on a tie;
+- ``label:<text>``: the first variant whose label contains ``<text>``.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+import re
+from typing import Any, Iterable
+
+from app.buttons import ButtonMatch, ButtonMatcher, bot_key, iter_buttons
+
+QUALITY_POLICIES = ("default", "min_size", "max_resolution", "label")
+
+# Latin and Cyrillic "p": bots write both "720p" and "720р".
+_RESOLUTION_RE = re.compile(r"(\d{3,4})\s*[pр]\b", re.IGNORECASE)
+_SIZE_RE = re.compile(
+    r"(\d+(?:[.,]\d+)?)\s*([kmg])i?b\b|(\d+(?:[.,]\d+)?)\s*([кмг])б\b", re.IGNORECASE
+)
+_SIZE_UNITS = {
+    "k": 1 << 10,
+    "m": 1 << 20,
+    "g": 1 << 30,
+    "к": 1 << 10,
+    "м": 1 << 20,
+    "г": 1 << 30,
+}
+# Choices kept per bot in ``state["quality_choices"]``, most recent last.
+_REMEMBERED_CHOICES = 200
+
+
+@dataclass(frozen=True)
+class QualityPolicy:
+    kind: str = "default"
+    label: str = ""
+
+    @property
+    def enabled(self) -> bool:
+        return self.kind != "default"
+
+    def __str__(self) -> str:
+        return f"label:{self.label}" if self.kind == "label" else self.kind
+
+
+@dataclass(frozen=True)
+class Variant:
+    match: ButtonMatch
+    label: str
+    resolution: int | None = None
+    size: int | None = None
+
+
+def parse_policy(value: str) -> QualityPolicy:
+    kind, _, label = (value or "default").strip().partition(":")
+    kind = kind.strip().lower()
+    if kind not in QUALITY_POLICIES:
+        raise ValueError(
+            f"QUALITY_POLICY must be one of: {', '.join(QUALITY_POLICIES[:-1])}, label:<text>"
+        )
+    if kind == "label" and not label.strip():
+        raise ValueError("QUALITY_POLICY label: needs the text of the preferred variant")
+    return QualityPolicy(kind=kind, label=label.strip() if kind == "label" else "")
+
+
+def parse_size(text: str) -> int | None:
+    found = _SIZE_RE.search(text)
+    if not found:
+        return None
+    number = found.group(1) or found.group(3)
+    unit = (found.group(2) or found.group(4)).lower()
+    return int(float(number.replace(",", ".")) * _SIZE_UNITS[unit])
+
+
+def parse_variant(match: ButtonMatch) -> Variant:
+    label = getattr(match.button, "text", "") or ""
+    resolution = _RESOLUTION_RE.search(label)
+    return Variant(
+        match=match,
+        label=label,
+        resolution=int(resolution.group(1)) if resolution else None,
+        size=parse_size(label),
+    )
+
+
+def quality_variants(message: Any, exclude: Iterable[ButtonMatcher] = ()) -> list[Variant]:
+    """Buttons of ``message`` except navigation ones matched by ``exclude``."""
+    exclude = list(exclude)
+    variants = []
+    for match in iter_buttons(getattr(message, "buttons", None) or []):
+        label = getattr(match.button, "text", "") or ""
+        if any(matcher.matches(label) for matcher in exclude):
+            continue
+        variants.append(parse_variant(match))
+    return variants
+
+
+def choose_variant(policy: QualityPolicy, variants: list[Variant]) -> Variant | None:
+    if policy.kind == "label":
+        matcher = ButtonMatcher(policy.label)
+        return next((variant for variant in variants if matcher.matches(variant.label)), None)
+
+    sized = [variant for variant in variants if variant.size is not None]
+    rated = [variant for variant in variants if variant.resolution is not None]
+    if policy.kind == "min_size":
+        if sized:
+            return min(sized, key=lambda variant: variant.size)
+        if rated:
+            return min(rated, key=lambda variant: variant.resolution)
+    elif policy.kind == "max_resolution":
+        if rated:
+            return max(rated, key=lambda variant: (variant.resolution, variant.size or 0))
+        if sized:
+            return max(sized, key=lambda variant: variant.size)
+    return None
+
+
+def cached_choice(state: dict[str, Any], bot_username: str, title: str) -> dict[str, Any] | None:
+    """The variant chosen earlier for ``title`` on this bot, if any."""
+    if not title:
+        return None
+    return state.get("quality_choices", {}).get(bot_key(bot_username), {}).get(title)
+
+
+def remember_choice(
+    state: dict[str, Any],
+    bot_username: str,
+    title: str,
+    policy: QualityPolicy,
+    label: str,
+) -> None:
+    """Store the chosen label; ``""`` records that the bot offered no choice."""
+    if not title:
+        return
+    choices = state.setdefault("quality_choices", {}).setdefault(bot_key(bot_username), {})
+    choices.pop(title, None)
+    choices[title] = {"policy": str(policy), "label": label}
+    # Only recent titles are worth keeping: state.json is rewritten at every
+    # checkpoint, and a choice mostly matters to a title that is resumed.
+    while len(choices) > _REMEMBERED_CHOICES:
+        del choices[next(iter(choices))]
@@ -0,0 +1,137 @@
+"""Ranking of search results against the requested title."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+import logging
+import re
+from typing import Any, Iterable
+
+from app.buttons import normalize_text
+
+logger = logging.getLogger(__name__)
+
+_YEAR_RE = re.compile(r"\b(19\d{2}|20\d{2})\b")
+_SEASON_RE = re.compile(
+    r"\b(?:сезон|season)\s*(\d{1,2})\b"
+    r"|\bs(\d{1,2})(?:e\d{1,3})?\b"
+    r"|\b(\d{1,2})\s*(?:-?й\s*)?(?:сезон(?:а|ов)?|seasons?)\b"
+)
+_TOKEN_RE = re.compile(r"\w+")
+# Label decoration such as "283 серии" or "10 сезонов": left out of a
+# candidate's precision, so it does not count against the match.
+_DECORATION_RE = re.compile(r"\d+|(?:сери|сезон|эпизод|episode|season)\w*|eps?")
+
+_YEAR_MATCH_BONUS = 0.1
+_YEAR_MISMATCH_PENALTY = 0.3
+_SEASON_MATCH_BONUS = 0.1
+_SEASON_MISMATCH_PENALTY = 0.3
+_LOGGED_SCORES = 5
+
+
+@dataclass(frozen=True)
+class ParsedTitle:
+    normalized: str
+    tokens: frozenset[str]
+    year: int | None
+    season: int | None
+
+
+@dataclass(frozen=True)
+class RankedResult:
+    key: Any
+    text: str
+    score: float
+
+
+def _find_season(text: str) -> int | None:
+    match = _SEASON_RE.search(text)
+    if not match:
+        return None
+    return int(match.group(1) or match.group(2) or match.group(3))
+
+
+def parse_title(text: str, hint_text: str = "") -> ParsedTitle:
+    normalized = normalize_text(text)
+    hints = f"{normalized} {normalize_text(hint_text)}" if hint_text else normalized
+
+    year_match = _YEAR_RE.search(hints)
+    year = int(year_match.group(1)) if year_match else None
+    season = _find_season(hints)
+
+    stripped = _SEASON_RE.sub(" ", _YEAR_RE.sub(" ", normalized))
+    # A title that is only a year ("1917", "2012") keeps it as its tokens.
+    tokens = frozenset(_TOKEN_RE.findall(stripped)) or frozenset(_TOKEN_RE.findall(normalized))
+    return ParsedTitle(normalized=normalized, tokens=tokens, year=year, season=season)
+
+
+def score(query: ParsedTitle, candidate: ParsedTitle) -> float:
+    if not query.tokens or not candidate.tokens:
+        return 0.0
+
+    common = len(query.tokens & candidate.tokens)
+    if not common:
+        return 0.0
+    words = frozenset(
+        token for token in candidate.tokens if not _DECORATION_RE.fullmatch(token)
+    ) or candidate.tokens
+    recall = common / len(query.tokens)
+    precision = len(query.tokens & words) / len(words)
+    if not precision:
+        return 0.0
+    value = 2 * recall * precision / (recall + precision)
+
+    if query.year is not None and candidate.year is not None:
+        if query.year == candidate.year:
+            value += _YEAR_MATCH_BONUS
+        else:
+            value -= _YEAR_MISMATCH_PENALTY
+
+    if query.season is not None and candidate.season is not None:
+        if query.season == candidate.season:
+            value += _SEASON_MATCH_BONUS
+        else:
+            value -= _SEASON_MISMATCH_PENALTY
+
+    return max(0.0, min(1.0, value))
+
+
+class ResultIndex:
+    """Normalized view of search results, built once per results message."""
+
+    def __init__(self, entries: Iterable[tuple[Any, str, str]]) -> None:
+        self._entries: list[tuple[Any, str, ParsedTitle]] = [
+            (key, text, parse_title(text, hint_text)) for key, text, hint_text in entries
+        ]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def rank(self, title: str) -> list[RankedResult]:
+        query = parse_title(title)
+        ranked = [
+            RankedResult(key=key, text=text, score=score(query, parsed))
+            for key, text, parsed in self._entries
+        ]
+        # sorted() is stable, so ties keep the bot's own ordering.
+        ranked.sort(key=lambda item: item.score, reverse=True)
+        return ranked
+
+
+def pick_best(
+    index: ResultIndex,
+    title: str,
+    *,
+    min_score: float,
+) -> RankedResult | None:
+    ranked = index.rank(title)
+    for item in ranked[:_LOGGED_SCORES]:
+        logger.info("title=%s score=%.2f candidate=%s", title, item.score, item.text)
+    if not ranked:
+        return None
+    best = ranked[0]
+    if best.score < min_score:
+        logger.info(
+            "title=%s best_score=%.2f below min_score=%.2f", title, best.score, min_score
+        )
+        return None
+    return best
@@ -0,0 +1,253 @@
+"""Check target chats against the catalog and re-queue what never arrived."""
+from __future__ import annotations
+
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import logging
+from typing import Any, Iterable
+
+from app import media
+from app.cancel import Stopped, is_set
+from app.catalog import Catalog, open_catalog
+from app.delivery import target_peer
+from app.series_flow import make_fanout
+from app.state import save_state, target_state
+from app.watchdog import beat
+
+logger = logging.getLogger(__name__)
+
+_PROGRESS_EVERY = 1000
+
+
+@dataclass(frozen=True)
+class TargetDocument:
+    msg_id: int
+    size: int | None
+    duration: float | None
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+async def scan_target(
+    client: Any,
+    target: str,
+    *,
+    stop_event: asyncio.Event | None = None,
+) -> dict[int, TargetDocument]:
+    """Document id of every media message in ``target``, newest message wins.
+
+    Telethon pages the history at the API maximum of 100 messages per
+    request and sleeps ``wait_time`` between pages to stay clear of flood
+    waits.
+    """
+    documents: dict[int, TargetDocument] = {}
+    scanned = 0
+    async for message in client.iter_messages(target_peer(target), limit=None, wait_time=1):
+        if is_set(stop_event):
+            raise Stopped
+        scanned += 1
+        if scanned % _PROGRESS_EVERY == 0:
+            logger.info("target=%s scanned %s messages", target, scanned, extra={"target": target})
+            beat()
+        document = getattr(message, "document", None)
+        if document is None or not media.is_media_message(message):
+            continue
+        if document.id in documents:
+            continue
+        file = getattr(message, "file", None)
+        documents[document.id] = TargetDocument(
+            msg_id=message.id,
+            size=getattr(file, "size", None),
+            duration=getattr(file, "duration", None),
+        )
+    logger.info(
+        "target=%s scanned %s messages, %s documents",
+        target,
+        scanned,
+        len(documents),
+        extra={"target": target},
+    )
+    return documents
+
+
+def reconcile_target(
+    catalog: Catalog,
+    state: dict[str, Any],
+    target: str,
+    documents: dict[int, TargetDocument],
+    *,
+    requeue: bool = True,
+    warm: bool = False,
+) -> dict[str, Any]:
+    """Compare one scanned target with the catalog and its dedup list.
+
+    Catalog rows whose document is not in the chat are dropped from the
+    catalog and the target's ``sent_ids`` and put back into its outbox, so
+    the next ``FanOut`` delivers them in albums. With ``warm`` documents found
+    in the chat but unknown to the catalog are recorded, which lets a fresh
+    machine skip them without walking the bot again.
+    """
+    entry = target_state(state, target)
+    rows = catalog.deliveries(target)
+    known = {row["document_id"] for row in rows if row["document_id"] is not None}
+    missing = [
+        row
+        for row in rows
+        if row["document_id"] is not None
+        and row["source_peer"]
+        and row["document_id"] not in documents
+    ]
+
+    requeued = 0
+    if requeue and missing:
+        queued = {(item["peer"], item["msg_id"]) for item in entry["outbox"]}
+        missing_ids = {row["source_msg_id"] for row in missing}
+        entry["sent_ids"] = [msg_id for msg_id in entry["sent_ids"] if msg_id not in missing_ids]
+        for row in missing:
+            peer = target_peer(row["source_peer"])
+            if (peer, row["source_msg_id"]) in queued:
+                continue
+            entry["outbox"].append(
+                {
+                    "peer": peer,
+                    "msg_id": row["source_msg_id"],
+                    # Rendered again from the source message on delivery.
+                    "caption": None,
+                    "title": row["title"],
+                    "episode": row["episode"],
+                }
+            )
+            requeued += 1
+        entry["sent"] = max(0, int(entry["sent"]) - len(missing))
+        catalog.forget(target, [(row["source_peer"], row["source_msg_id"]) for row in missing])
+        logger.warning(
+            "target=%s: %s delivered items missing, re-queued %s",
+            target,
+            len(missing),
+            requeued,
+            extra={"target": target},
+        )
+
+    warmed = 0
+    if warm:
+        now = _now_iso()
+        fresh = [
+            {
+                "target": target,
+                "source_peer": "",
+                "source_msg_id": found.msg_id,
+                "target_msg_id": found.msg_id,
+                "title": "",
+                "title_key": "",
+                "season": None,
+                "episode": None,
+                "document_id": document_id,
+                "size": found.size,
+                "duration": found.duration,
+                "delivered_at": now,
+            }
+            for document_id, found in documents.items()
+            if document_id not in known
+        ]
+        catalog.record(fresh)
+        warmed = len(fresh)
+        if warmed:
+            logger.info("target=%s: warmed catalog with %s documents", target, warmed)
+
+    return {
+        "documents": len(documents),
+        "catalog": len(rows),
+        "missing": len(missing),
+        "requeued": requeued,
+        "warmed": warmed,
+    }
+
+
+async def reconcile(
+    client: Any,
+    targets: list[str] | tuple[str, ...],
+    state: dict[str, Any],
+    catalog: Catalog,
+    *,
+    requeue: bool = True,
+    warm: bool = False,
+    stop_event: asyncio.Event | None = None,
+    drain_event: asyncio.Event | None = None,
+) -> dict[str, Any]:
+    """Scan every target and reconcile it; the report is also kept in ``state``.
+
+    With ``drain_event`` set the scan stops before the next target and the
+    report has ``drained`` set; its ``targets`` hold the ones finished.
+    """
+    report: dict[str, Any] = {"started_at": _now_iso(), "targets": {}}
+    for target in targets:
+        if is_set(drain_event):
+            logger.info("reconcile drained before target=%s", target)
+            report["drained"] = True
+            break
+        documents = await scan_target(client, target, stop_event=stop_event)
+        report["targets"][target] = reconcile_target(
+            catalog, state, target, documents, requeue=requeue, warm=warm
+        )
+    report["finished_at"] = _now_iso()
+    state["reconcile"] = report
+    return report
+
+
+async def run_reconcile(
+    client: Any,
+    config: Any,
+    state: dict[str, Any],
+    *,
+    state_path: str,
+    warm: bool = False,
+    deliver: bool = True,
+    stop_event: asyncio.Event | None = None,
+    drain_event: asyncio.Event | None = None,
+    skip_targets: Iterable[str] = (),
+) -> dict[str, Any]:
+    """Reconcile all configured targets, then deliver what was re-queued.
+
+    ``skip_targets`` were reconciled by an earlier, drained run; their
+    results are kept from its report. A drained run delivers nothing, the
+    re-queued items wait in the outbox.
+    """
+    catalog = open_catalog(config)
+    if catalog is None:
+        raise ValueError("CATALOG_PATH is empty, reconcile needs the catalog.")
+    previous = state.get("phase", "idle")
+    state["phase"] = "reconciling"
+    save_state(state_path, state)
+    skipped = set(skip_targets)
+    earlier = (state.get("reconcile") or {}).get("targets", {})
+    try:
+        report = await reconcile(
+            client,
+            [target for target in config.target_chat_ids if target not in skipped],
+            state,
+            catalog,
+            warm=warm,
+            stop_event=stop_event,
+            drain_event=drain_event,
+        )
+        report["targets"] = {
+            **{target: earlier[target] for target in skipped if target in earlier},
+            **report["targets"],
+        }
+        save_state(state_path, state)
+        if report.get("drained"):
+            return report
+        if deliver and any(item["requeued"] for item in report["targets"].values()):
+            fanout = make_fanout(client, config, state, state_path, catalog)
+            fanout.start()
+            await fanout.close(stop_event)
+            report["outbox"] = fanout.outbox_sizes()
+            save_state(state_path, state)
+        return report
+    finally:
+        state["phase"] = previous
+        save_state(state_path, state)
+        catalog.close()
@@ -0,0 +1,100 @@
+"""Deferred retry queue for titles that failed for transient reasons."""
+from __future__ import annotations
+
+from datetime import datetime, timezone
+import logging
+import time
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Base backoff per failure reason; doubled on every further attempt.
+RETRY_BASE_SECONDS = {
+    "timeout_results": 60,
+    "timeout_after_pick": 120,
+    "timeout_after_inline_pick": 120,
+    "no_media_after_pick": 300,
+}
+MAX_BACKOFF_SECONDS = 6 * 3600
+
+
+def is_retryable(reason: str | None) -> bool:
+    return reason in RETRY_BASE_SECONDS
+
+
+def backoff_seconds(reason: str, attempts: int) -> int:
+    base = RETRY_BASE_SECONDS.get(reason, 60)
+    return min(base * 2 ** max(attempts - 1, 0), MAX_BACKOFF_SECONDS)
+
+
+def _find(state: dict[str, Any], title: str) -> dict[str, Any] | None:
+    for entry in state.get("retry_queue", []):
+        if entry["title"] == title:
+            return entry
+    return None
+
+
+def schedule_retry(
+    state: dict[str, Any],
+    title: str,
+    reason: str,
+    *,
+    max_attempts: int,
+    now: float | None = None,
+) -> bool:
+    """Queue ``title`` for a later retry; returns False once attempts are used up."""
+    now = time.time() if now is None else now
+    queue = list(state.get("retry_queue", []))
+    entry = _find(state, title)
+    attempts = (entry["attempts"] if entry else 0) + 1
+    queue = [item for item in queue if item["title"] != title]
+
+    if attempts >= max_attempts:
+        failed = [item for item in state.get("failed", []) if item["title"] != title]
+        failed.append(
+            {
+                "title": title,
+                "reason": reason,
+                "attempts": attempts,
+                "failed_at": datetime.now(timezone.utc).isoformat(),
+            }
+        )
+        state["failed"] = failed
+        state["retry_queue"] = queue
+        logger.info("title=%s failed permanently reason=%s attempts=%s", title, reason, attempts)
+        return False
+
+    delay = backoff_seconds(reason, attempts)
+    queue.append(
+        {
+            "title": title,
+            "reason": reason,
+            "attempts": attempts,
+            "next_attempt_at": now + delay,
+        }
+    )
+    state["retry_queue"] = queue
+    logger.info("title=%s queued for retry reason=%s in %ss", title, reason, delay)
+    return True
+
+
+def clear_retry(state: dict[str, Any], title: str) -> None:
+    queue = state.get("retry_queue", [])
+    if any(item["title"] == title for item in queue):
+        state["retry_queue"] = [item for item in queue if item["title"] != title]
+
+
+def due_retry(state: dict[str, Any], now: float | None = None) -> dict[str, Any] | None:
+    now = time.time() if now is None else now
+    due = [item for item in state.get("retry_queue", []) if item["next_attempt_at"] <= now]
+    if not due:
+        return None
+    return min(due, key=lambda item: item["next_attempt_at"])
+
+
+def seconds_until_next_retry(state: dict[str, Any], now: float | None = None) -> float | None:
+    queue = state.get("retry_queue", [])
+    if not queue:
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, min(item["next_attempt_at"] for item in queue) - now)
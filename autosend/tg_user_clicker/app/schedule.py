@@ -0,0 +1,223 @@
+"""Order in which a run takes the titles of its list (``TITLE_ORDER``).
+
+A line of the titles file may end with tags after ``|``::
+
+    Долгий сериал | priority=5 | bot=@otherbot | episodes=900
+
+``priority`` ranks titles for ``TITLE_ORDER=priority``, ``bot`` sends the
+title to another bot than the run's, and ``episodes`` gives its length
+when the bot's learned data does not know it yet. Segments that are not
+such tags stay part of the title.
+
+The checkpoint stays ``current_index``, now meaning "every title before
+it is done"; titles done out of order past it are kept in
+``done_indices`` and the titles in progress in ``active_indices``, so a
+resumed run finishes those first and never repeats a done one.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+import logging
+import re
+from typing import Any, Callable
+
+from app.buttons import bot_key
+
+logger = logging.getLogger(__name__)
+
+TITLE_ORDERS = ("file", "sjf", "priority", "round_robin")
+
+_TAG_RE = re.compile(
+    r"^\s*(?:priority\s*=\s*(?P<priority>-?\d+)"
+    r"|bot\s*=\s*@?(?P<bot>\w+)"
+    r"|episodes\s*=\s*(?P<episodes>\d+))\s*$",
+    re.IGNORECASE,
+)
+_EPISODES_RE = re.compile(
+    r"\b(\d{1,4})\s*(?:серий|серии|серия|эпизод\w*|episodes?|eps?)\b"
+    r"|\b\d{1,4}\s*(?:из|of)\s*(\d{1,4})\b",
+    re.IGNORECASE,
+)
+# Seconds per episode while the bot has no learned latency.
+_DEFAULT_EPISODE_SECONDS = 1.0
+
+
+@dataclass(frozen=True)
+class TitleLine:
+    title: str
+    priority: int = 0
+    bot: str = ""
+    episodes: int | None = None
+
+
+def parse_title_line(line: str) -> TitleLine:
+    parts = line.split("|")
+    tags: dict[str, str] = {}
+    while len(parts) > 1:
+        match = _TAG_RE.match(parts[-1])
+        if not match:
+            break
+        for name, value in match.groupdict().items():
+            if value is not None:
+                tags.setdefault(name, value)
+        parts.pop()
+    return TitleLine(
+        title=" ".join("|".join(parts).split()),
+        priority=int(tags.get("priority", 0)),
+        bot=f"@{tags['bot']}" if "bot" in tags else "",
+        episodes=int(tags["episodes"]) if "episodes" in tags else None,
+    )
+
+
+def episodes_hint(text: str) -> int | None:
+    """Episode count from a search result such as ``Сериал (2019) 24 серии``."""
+    match = _EPISODES_RE.search(text or "")
+    if not match:
+        return None
+    episodes = int(match.group(1) or match.group(2))
+    return episodes or None
+
+
+def estimate_seconds(
+    line: TitleLine,
+    profile: Any,
+    catalog: Any = None,
+    targets: tuple[str, ...] = (),
+) -> float:
+    """Expected run time of ``line`` from the catalog and the bot's learned data."""
+    if catalog is not None and catalog.is_complete(line.title, targets):
+        return 0.0
+    episodes = (
+        line.episodes
+        or profile.title_length(line.title)
+        or profile.typical_series_length()
+        or 1
+    )
+    latency = (profile.quantiles("episode") or {}).get("p50") or _DEFAULT_EPISODE_SECONDS
+    return episodes * latency
+
+
+def done_count(state: dict[str, Any]) -> int:
+    return int(state.get("current_index", 0)) + len(state.get("done_indices", []))
+
+
+class TitleScheduler:
+    """Picks the next title of ``titles`` that is not done yet.
+
+    Only the ``window`` titles from ``current_index`` on are considered, so
+    a huge list is never estimated as a whole and a costly title waits for
+    at most ``window`` cheaper ones. ``order`` is one of ``TITLE_ORDERS``;
+    ``estimate`` gives a ``TitleLine``'s cost for ``sjf``. Several titles
+    may be in flight at once: ``begin`` hands one out, ``finish`` marks it
+    done and ``release`` gives it back unfinished.
+    """
+
+    def __init__(
+        self,
+        titles: Any,
+        state: dict[str, Any],
+        *,
+        order: str = "file",
+        window: int = 500,
+        default_bot: str = "",
+        estimate: Callable[[TitleLine], float] | None = None,
+    ) -> None:
+        self.titles = titles
+        self.state = state
+        self.order = order
+        self.window = max(1, window)
+        self.default_bot = default_bot
+        self.estimate = estimate
+        self._lines: dict[int, TitleLine] = {}
+        self._costs: dict[int, float] = {}
+        self._in_flight: set[int] = set()
+        active = list(state.get("active_indices") or [])
+        legacy = state.pop("active_index", None)
+        if legacy is not None and legacy not in active:
+            active.append(legacy)
+        state["active_indices"] = active
+
+    def invalidate(self) -> None:
+        """Forget parsed lines after ``titles`` was refreshed and may have retagged some."""
+        self._lines.clear()
+        self._costs.clear()
+
+    def line(self, index: int) -> TitleLine:
+        line = self._lines.get(index)
+        if line is None:
+            line = self._lines[index] = parse_title_line(self.titles[index])
+        return line
+
+    def bot(self, index: int) -> str:
+        return bot_key(self.line(index).bot or self.default_bot)
+
+    def cost(self, index: int) -> float:
+        cost = self._costs.get(index)
+        if cost is None:
+            cost = self._costs[index] = self.estimate(self.line(index)) if self.estimate else 0.0
+        return cost
+
+    def pending(self) -> list[int]:
+        start = int(self.state.get("current_index", 0))
+        skip = set(self.state.get("done_indices", [])) | self._in_flight
+        end = min(len(self.titles), start + self.window)
+        return [index for index in range(start, end) if index not in skip]
+
+    def interrupted(self) -> int | None:
+        """A title a previous run left in progress and nobody resumed yet."""
+        pending = self.pending()
+        active = set(self.state.get("active_indices", []))
+        if not active and pending and self.state.get("last_media_message_id"):
+            # A checkpoint from before ``active_indices``: the title in
+            # progress is the one at ``current_index``.
+            if self.line(pending[0]).title == self.state.get("last_title"):
+                active = {pending[0]}
+        return next((index for index in pending if index in active), None)
+
+    def next(self) -> int | None:
+        """The interrupted title if there is one, else the next by ``order``."""
+        interrupted = self.interrupted()
+        if interrupted is not None:
+            return interrupted
+        pending = self.pending()
+        if not pending:
+            return None
+        if self.order == "sjf":
+            return min(pending, key=lambda index: (self.cost(index), index))
+        if self.order == "priority":
+            return min(pending, key=lambda index: (-self.line(index).priority, index))
+        if self.order == "round_robin":
+            bots = sorted({self.bot(index) for index in pending})
+            last = self.state.get("last_scheduled_bot", "")
+            bot = next((name for name in bots if name > last), bots[0])
+            return next(index for index in pending if self.bot(index) == bot)
+        return pending[0]
+
+    def begin(self, index: int) -> TitleLine:
+        self._in_flight.add(index)
+        if index not in self.state["active_indices"]:
+            self.state["active_indices"] = sorted([*self.state["active_indices"], index])
+        self.state["last_scheduled_bot"] = self.bot(index)
+        return self.line(index)
+
+    def release(self, index: int, *, active: bool) -> None:
+        """Give ``index`` back unfinished; ``active`` keeps it first for the next run."""
+        self._in_flight.discard(index)
+        if not active:
+            self.state["active_indices"] = [i for i in self.state["active_indices"] if i != index]
+
+    def finish(self, index: int) -> None:
+        """Mark ``index`` done and move ``current_index`` past every done title."""
+        self._in_flight.discard(index)
+        self.state["active_indices"] = [i for i in self.state["active_indices"] if i != index]
+        current = int(self.state.get("current_index", 0))
+        done = set(self.state.get("done_indices", []))
+        if index >= current:
+            done.add(index)
+        while current in done:
+            done.remove(current)
+            self._lines.pop(current, None)
+            self._costs.pop(current, None)
+            current += 1
+        self.state["current_index"] = current
+        self.state["done_indices"] = sorted(done)
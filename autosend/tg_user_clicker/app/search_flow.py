@@ -1,16 +1,35 @@
-"""Search flow for selecting the first result from a bot."""
+"""Search flow for selecting the best matching result from a bot."""
 from __future__ import annotations
 
 import asyncio
+import functools
 import logging
 import time
-from typing import Any
+from typing import Any, Awaitable, Callable
 
-from app.buttons import ButtonMatch, click_button
-from app.config import load_config
+from app.buttons import ButtonMatch, click_button, is_callback_button
+from app.cancel import Stopped, cancellable, sleep
+from app.profiles import bot_config
+from app.ranking import ResultIndex, pick_best
+from app.watchdog import beat
 
 logger = logging.getLogger(__name__)
 
+_POLL_SECONDS = 1
+
+
+def _stoppable(flow: Any) -> Any:
+    """Turn a ``Stopped`` raised anywhere inside a flow into its stopped result."""
+
+    @functools.wraps(flow)
+    async def wrapper(*args: Any, **kwargs: Any) -> dict:
+        try:
+            return await flow(*args, **kwargs)
+        except Stopped:
+            return {"ok": True, "reason": "stopped"}
+
+    return wrapper
+
 
 async def _wait_for_results_message(
     client: Any,
@@ -22,9 +41,10 @@ async def _wait_for_results_message(
 ) -> Any | None:
     deadline = time.monotonic() + timeout_seconds
     while time.monotonic() < deadline:
-        if stop_event is not None and stop_event.is_set():
+        try:
+            messages = await cancellable(client.get_messages(entity, limit=10), stop_event)
+        except Stopped:
             return None
-        messages = await client.get_messages(entity, limit=10)
         for message in messages:
             if message.id <= after_id:
                 continue
@@ -33,7 +53,8 @@ async def _wait_for_results_message(
             if not getattr(message, "buttons", None):
                 continue
             return message
-        await asyncio.sleep(1)
+        if await sleep(min(_POLL_SECONDS, max(deadline - time.monotonic(), 0)), stop_event):
+            return None
     return None
 
 
@@ -47,16 +68,18 @@ async def _wait_for_next_message(
 ) -> Any | None:
     deadline = time.monotonic() + timeout_seconds
     while time.monotonic() < deadline:
-        if stop_event is not None and stop_event.is_set():
+        try:
+            messages = await cancellable(client.get_messages(entity, limit=10), stop_event)
+        except Stopped:
             return None
-        messages = await client.get_messages(entity, limit=10)
         for message in messages:
             if message.id <= after_id:
                 continue
             if message.sender_id != entity.id:
                 continue
             return message
-        await asyncio.sleep(1)
+        if await sleep(min(_POLL_SECONDS, max(deadline - time.monotonic(), 0)), stop_event):
+            return None
     return None
 
 
@@ -70,28 +93,38 @@ async def wait_for_message_by_id(
 ) -> Any | None:
     deadline = time.monotonic() + timeout_seconds
     while time.monotonic() < deadline:
-        if stop_event is not None and stop_event.is_set():
+        try:
+            message = await cancellable(client.get_messages(entity, ids=message_id), stop_event)
+        except Stopped:
             return None
-        message = await client.get_messages(entity, ids=message_id)
         if isinstance(message, list):
             message = message[0] if message else None
         if message and message.sender_id == entity.id:
             return message
-        await asyncio.sleep(1)
+        if await sleep(min(_POLL_SECONDS, max(deadline - time.monotonic(), 0)), stop_event):
+            return None
     return None
 
 
+@_stoppable
 async def run_search_and_pick_first(
     client: Any,
     bot_username: str,
     title: str,
     *,
     stop_event: asyncio.Event | None = None,
+    take_turn: Callable[[], Awaitable[None]] | None = None,
 ) -> dict:
-    config = load_config()
-    entity = await client.get_entity(bot_username)
+    """Send ``title`` to the bot and click the best matching result button.
+
+    ``take_turn`` is awaited before the first message goes to the chat.
+    """
+    config = bot_config(bot_username)
+    entity = await cancellable(client.get_entity(bot_username), stop_event)
+    if take_turn is not None:
+        await take_turn()
     send_text = f"{config.search_send_prefix}{title}"
-    sent_message = await client.send_message(entity, send_text)
+    sent_message = await cancellable(client.send_message(entity, send_text), stop_event)
 
     results_message = await _wait_for_results_message(
         client,
@@ -104,15 +137,29 @@ async def run_search_and_pick_first(
         if stop_event is not None and stop_event.is_set():
             return {"ok": True, "reason": "stopped"}
         return {"ok": False, "reason": "timeout_results"}
+    beat()
 
     buttons = getattr(results_message, "buttons", None) or []
     if not buttons or not buttons[0]:
         return {"ok": False, "reason": "no_results_buttons"}
 
-    first_button = buttons[0][0]
-    picked_button_text = getattr(first_button, "text", "") or ""
-    match = ButtonMatch(button=first_button, row=0, col=0)
-    await click_button(results_message, match)
+    index = ResultIndex(
+        (
+            ButtonMatch(button=button, row=row_index, col=col_index),
+            getattr(button, "text", "") or "",
+            "",
+        )
+        for row_index, row in enumerate(buttons)
+        for col_index, button in enumerate(row)
+        if is_callback_button(button)
+    )
+    best = pick_best(index, title, min_score=config.pick_min_score)
+    if best is None:
+        return {"ok": False, "reason": "no_confident_match"}
+
+    match = best.key
+    picked_button_text = best.text
+    await cancellable(click_button(results_message, match), stop_event)
 
     next_message = await _wait_for_next_message(
         client,
@@ -125,16 +172,19 @@ async def run_search_and_pick_first(
         if stop_event is not None and stop_event.is_set():
             return {"ok": True, "reason": "stopped"}
         return {"ok": False, "reason": "timeout_after_pick"}
+    beat()
 
     return {
         "ok": True,
         "title": title,
         "results_message_id": results_message.id,
         "picked_button_text": picked_button_text,
+        "picked_score": best.score,
         "next_message_id": next_message.id,
     }
 
 
+@_stoppable
 async def run_inline_search_and_pick_first(
     client: Any,
     bot_username: str,
@@ -142,17 +192,34 @@ async def run_inline_search_and_pick_first(
     timeout: int = 30,
     *,
     stop_event: asyncio.Event | None = None,
+    take_turn: Callable[[], Awaitable[None]] | None = None,
 ) -> dict:
-    bot = await client.get_entity(bot_username)
-    last_message = await client.get_messages(bot, limit=1)
-    last_message_id = last_message[0].id if last_message else 0
-
-    results = await client.inline_query(bot, query)
+    """Query the bot inline and send the best matching result to its chat.
+
+    The query and ranking do not touch the chat; ``take_turn`` is awaited
+    before the picked result is sent there.
+    """
+    config = bot_config(bot_username)
+    bot = await cancellable(client.get_entity(bot_username), stop_event)
+    results = await cancellable(client.inline_query(bot, query), stop_event)
     if not results:
         return {"ok": False, "reason": "no_inline_results"}
+    beat()
 
-    first = results[0]
-    await first.click(bot)
+    index = ResultIndex(
+        (result, result.title or result.description or "", result.description or "")
+        for result in results
+    )
+    best = pick_best(index, query, min_score=config.pick_min_score)
+    if best is None:
+        return {"ok": False, "reason": "no_confident_match"}
+
+    picked = best.key
+    if take_turn is not None:
+        await take_turn()
+    last_message = await cancellable(client.get_messages(bot, limit=1), stop_event)
+    last_message_id = last_message[0].id if last_message else 0
+    await cancellable(picked.click(bot), stop_event)
 
     next_message = await _wait_for_next_message(
         client,
@@ -165,11 +232,12 @@ async def run_inline_search_and_pick_first(
         if stop_event is not None and stop_event.is_set():
             return {"ok": True, "reason": "stopped"}
         return {"ok": False, "reason": "timeout_after_inline_pick"}
+    beat()
 
-    picked_inline_title = first.title or first.description or ""
     return {
         "ok": True,
         "query": query,
-        "picked_inline_title": picked_inline_title,
+        "picked_inline_title": best.text,
+        "picked_score": best.score,
         "next_message_id": next_message.id,
     }
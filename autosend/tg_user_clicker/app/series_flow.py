@@ -4,31 +4,56 @@ from __future__ import annotations
 import asyncio
 import logging
 import time
-from typing import Any
+from typing import Any, Callable
 
 from app import media
-from app.buttons import click_button, find_button
-from app.config import load_config
-from app.state import dedup_add, dedup_has, save_state
+from app.archive import Archiver
+from app.buttons import ButtonMatcher, bot_matcher, click_button, iter_buttons
+from app.cancel import Stopped, cancellable, is_set, sleep
+from app.catalog import Catalog
+from app.delivery import FanOut
+from app.profiles import bot_config
+from app.quality import (
+    cached_choice,
+    choose_variant,
+    parse_policy,
+    quality_variants,
+    remember_choice,
+)
+from app.state import dedup_add, dedup_has, new_state, save_state
+from app.watchdog import beat
 
 logger = logging.getLogger(__name__)
 
 _RECENT_FETCH_LIMIT = 50
+_POLL_SECONDS = 1
 
 
-async def _get_message_by_id(client: Any, entity: Any, message_id: int) -> Any | None:
-    message = await client.get_messages(entity, ids=message_id)
+async def _get_message_by_id(
+    client: Any,
+    entity: Any,
+    message_id: int,
+    stop_event: asyncio.Event | None = None,
+) -> Any | None:
+    message = await cancellable(client.get_messages(entity, ids=message_id), stop_event)
     if isinstance(message, list):
         return message[0] if message else None
     return message
 
 
-async def _find_start_message(client: Any, entity: Any, start_id: int) -> Any | None:
-    message = await _get_message_by_id(client, entity, start_id)
+async def _find_start_message(
+    client: Any,
+    entity: Any,
+    start_id: int,
+    stop_event: asyncio.Event | None = None,
+) -> Any | None:
+    message = await _get_message_by_id(client, entity, start_id, stop_event)
     if message and message.sender_id == entity.id:
         return message
 
-    messages = await client.get_messages(entity, limit=_RECENT_FETCH_LIMIT)
+    messages = await cancellable(
+        client.get_messages(entity, limit=_RECENT_FETCH_LIMIT), stop_event
+    )
     closest = None
     for msg in messages:
         if msg.sender_id != entity.id:
@@ -52,9 +77,10 @@ async def _wait_for_next_media_message(
 ) -> Any | None:
     deadline = time.monotonic() + timeout_seconds
     while time.monotonic() < deadline:
-        if stop_event is not None and stop_event.is_set():
+        try:
+            messages = await cancellable(client.get_messages(entity, limit=10), stop_event)
+        except Stopped:
             return None
-        messages = await client.get_messages(entity, limit=10)
         for message in messages:
             if message.id <= after_id:
                 continue
@@ -63,10 +89,26 @@ async def _wait_for_next_media_message(
             if not media.is_media_message(message):
                 continue
             return message
-        await asyncio.sleep(1)
+        if await sleep(min(_POLL_SECONDS, max(deadline - time.monotonic(), 0)), stop_event):
+            return None
     return None
 
 
+async def _collect_missed_media(client: Any, entity: Any, after_id: int) -> list[Any]:
+    """Media the bot sent after ``after_id`` that the walk never saw, oldest first.
+
+    Stops at the first message we sent ourselves: anything after it belongs
+    to a different request.
+    """
+    missed = []
+    async for message in client.iter_messages(entity, min_id=after_id, reverse=True):
+        if message.sender_id != entity.id:
+            break
+        if media.is_media_message(message):
+            missed.append(message)
+    return missed
+
+
 async def wait_for_media_after(
     client: Any,
     entity: Any,
@@ -84,150 +126,405 @@ async def wait_for_media_after(
     )
 
 
+def _labels(message: Any) -> tuple[str, ...]:
+    rows = getattr(message, "buttons", None) or []
+    return tuple(getattr(match.button, "text", "") or "" for match in iter_buttons(rows))
+
+
+def _document_id(message: Any) -> Any:
+    return getattr(getattr(message, "document", None), "id", None)
+
+
+async def _wait_for_bot_message(
+    client: Any,
+    entity: Any,
+    message: Any,
+    ready: Any,
+    *,
+    timeout_seconds: int,
+    stop_event: asyncio.Event | None = None,
+) -> Any | None:
+    """First bot message from ``message.id`` on (including its edit) that is ``ready``."""
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        recent = await cancellable(client.get_messages(entity, limit=10), stop_event)
+        candidates = sorted(
+            (msg for msg in recent if msg.id >= message.id and msg.sender_id == entity.id),
+            key=lambda msg: msg.id,
+        )
+        if not any(msg.id == message.id for msg in candidates):
+            current = await _get_message_by_id(client, entity, message.id, stop_event)
+            if current is not None:
+                candidates.insert(0, current)
+        for candidate in candidates:
+            if ready(candidate):
+                return candidate
+        if await sleep(min(_POLL_SECONDS, max(deadline - time.monotonic(), 0)), stop_event):
+            return None
+    return None
+
+
+async def _apply_quality(
+    client: Any,
+    entity: Any,
+    message: Any,
+    *,
+    config: Any,
+    state: dict[str, Any],
+    bot_username: str,
+    title: str,
+    resumed: bool,
+    stop_event: asyncio.Event | None = None,
+) -> Any:
+    """Switch ``message`` to the variant the quality policy wants.
+
+    Returns the media message to deliver, ``message`` itself when the bot
+    offers no choice or the switch does not arrive in time. The choice is
+    cached per bot and title: the bot keeps it for NEXT, so only the first
+    media of a title goes through the menu, and a title seen before reuses
+    the cached label instead of weighing the variants again. A resumed walk
+    continues from media already in the chosen quality.
+    """
+    policy = parse_policy(config.quality_policy)
+    cached = cached_choice(state, bot_username, title)
+    if cached is not None and cached.get("policy") != str(policy):
+        cached = None
+    if cached is not None and (resumed or not cached.get("label")):
+        return message
+
+    quality = bot_matcher(config, bot_username, config.button_quality_text, state)
+    match = quality.find(message)
+    if not match:
+        remember_choice(state, bot_username, title, policy, "")
+        return message
+
+    original = _labels(message)
+    await cancellable(click_button(message, match), stop_event)
+    menu = await _wait_for_bot_message(
+        client,
+        entity,
+        message,
+        lambda msg: bool(msg.buttons) and (msg.id != message.id or _labels(msg) != original),
+        timeout_seconds=config.wait_next_media_timeout_seconds,
+        stop_event=stop_event,
+    )
+    if menu is None:
+        logger.info("quality menu did not open on msg_id=%s", message.id)
+        return message
+
+    back = bot_matcher(config, bot_username, config.button_back_text, state)
+    navigation = [back, quality, bot_matcher(config, bot_username, config.button_next_text)]
+    variants = quality_variants(menu, exclude=navigation)
+    if cached is not None:
+        wanted = ButtonMatcher(cached["label"], rule="exact")
+        choice = next((variant for variant in variants if wanted.matches(variant.label)), None)
+    else:
+        choice = choose_variant(policy, variants)
+    if choice is None:
+        logger.info("no variant for quality policy=%s on msg_id=%s", policy, message.id)
+        remember_choice(state, bot_username, title, policy, "")
+        back_match = back.find(menu)
+        if back_match and menu.id == message.id:
+            await cancellable(click_button(menu, back_match), stop_event)
+            await sleep(config.wait_after_click_seconds, stop_event)
+            return await _get_message_by_id(client, entity, message.id, stop_event) or message
+        return message
+
+    await cancellable(click_button(menu, choice.match), stop_event)
+    logger.info("quality %s chosen on msg_id=%s", choice.label, message.id)
+    remember_choice(state, bot_username, title, policy, choice.label)
+    document_id = _document_id(message)
+    variant = await _wait_for_bot_message(
+        client,
+        entity,
+        message,
+        lambda msg: media.is_media_message(msg)
+        and (msg.id != message.id or _document_id(msg) != document_id),
+        timeout_seconds=config.wait_next_media_timeout_seconds,
+        stop_event=stop_event,
+    )
+    if variant is None:
+        logger.info("quality variant did not arrive, keeping msg_id=%s", message.id)
+        return message
+    return variant
+
+
+def make_fanout(
+    client: Any,
+    config: Any,
+    state: dict[str, Any],
+    state_path: str | None = None,
+    catalog: Catalog | None = None,
+) -> FanOut:
+    """``FanOut`` to the configured targets that keeps ``sent_total`` and ``sent_ids``.
+
+    Both count a media only once it reached every target; what is still in
+    an outbox is dispatched, not sent.
+    """
+
+    def save() -> None:
+        if state_path:
+            save_state(state_path, state)
+
+    def record_sent(messages: list[Any]) -> None:
+        for message in messages:
+            dedup_add(state, message.id, config.sent_dedup_limit)
+            state["sent_total"] = int(state.get("sent_total", 0)) + 1
+            state["sent_in_batch"] = int(state.get("sent_in_batch", 0)) + 1
+            if state["sent_in_batch"] >= config.batch_size:
+                logger.info("batch complete: %s", state["sent_total"])
+                state["sent_in_batch"] = 0
+
+    return FanOut(
+        client,
+        config.target_chat_ids,
+        mode=config.forward_mode,
+        state=state,
+        save=save,
+        album_size=config.album_size,
+        dedup_limit=config.sent_dedup_limit,
+        caption_template=config.copy_caption_template,
+        on_delivered=catalog.record_delivery if catalog is not None else None,
+        on_sent=record_sent,
+    )
+
+
+def make_archiver(
+    client: Any,
+    config: Any,
+    state: dict[str, Any],
+    state_path: str | None = None,
+) -> Archiver | None:
+    if not config.archive_dir:
+        return None
+
+    def save() -> None:
+        if state_path:
+            save_state(state_path, state)
+
+    return Archiver(
+        client,
+        config.archive_dir,
+        state=state,
+        save=save,
+        workers=config.archive_workers,
+    )
+
+
+def make_sender(
+    fanout: FanOut,
+    config: Any,
+    title: str = "",
+    archiver: Archiver | None = None,
+    *,
+    resumed: bool = False,
+) -> media.MediaSender:
+    return media.MediaSender(
+        fanout.dispatch,
+        mode=config.forward_mode,
+        album_size=config.album_size,
+        caption_template=config.copy_caption_template,
+        title=title,
+        archive=archiver.submit if archiver is not None else None,
+        count_episodes=not resumed,
+    )
+
+
 async def run_series_until_end(
     client: Any,
     bot_username: str,
     start_from_message_id: int,
     *,
     state: dict[str, Any] | None = None,
-    dedup_limit: int = 0,
     state_path: str | None = None,
     stop_event: asyncio.Event | None = None,
+    sender: media.MediaSender | None = None,
+    catalog: Catalog | None = None,
+    drain_event: asyncio.Event | None = None,
+    catch_up: bool = False,
+    follow_next: bool = True,
+    on_checkpoint: Callable[[int], None] | None = None,
 ) -> dict:
-    config = load_config()
-    entity = await client.get_entity(bot_username)
-    if stop_event is not None and stop_event.is_set():
+    """Walk NEXT from ``start_from_message_id`` until the series ends.
+
+    With ``catch_up`` (used when resuming) media the bot already sent after
+    the start message are collected in bulk first, and clicking continues
+    from the newest of them. The checkpoint (the oldest media not handed
+    over yet) goes to ``on_checkpoint``, by default into
+    ``last_media_message_id``. ``dispatched`` in the result counts the media
+    handed to the sender's outbox; they are counted as sent on delivery.
+    The state is written every ``BATCH_SIZE`` media and when the walk ends;
+    a crash in between only repeats those clicks, since ``sent_ids`` keeps
+    what was delivered from going out twice.
+
+    ``stop_event`` aborts in-flight requests and returns ``reason=stopped``;
+    ``drain_event`` lets the current episode finish and returns
+    ``reason=drained`` before the next click. Either way pending media are
+    handed over and the checkpoint is saved. Without ``follow_next`` only
+    the start message is delivered (``reason=first_media_only``).
+    """
+    config = bot_config(bot_username)
+    if state is None:
+        state = new_state()
+    try:
+        entity = await cancellable(client.get_entity(bot_username), stop_event)
+        current_msg = await _find_start_message(
+            client, entity, start_from_message_id, stop_event
+        )
+    except Stopped:
         return {
             "ok": True,
             "reason": "stopped",
-            "sent_total": 0,
+            "dispatched": 0,
             "last_message_id": start_from_message_id,
         }
-    current_msg = await _find_start_message(client, entity, start_from_message_id)
 
     if not current_msg or not media.is_media_message(current_msg):
         last_id = current_msg.id if current_msg else start_from_message_id
         return {
             "ok": False,
             "reason": "start_message_not_media",
-            "sent_total": 0,
+            "dispatched": 0,
             "last_message_id": last_id,
         }
 
-    sent_total = 0
+    own_fanout = None
+    if sender is None:
+        own_fanout = make_fanout(client, config, state, state_path, catalog)
+        own_fanout.start()
+        sender = make_sender(own_fanout, config)
+    dispatched = 0
+    unsaved = 0
 
     def already_sent(message: Any) -> bool:
-        if state is None:
-            return media.already_sent(message)
+        if sender.is_pending(message.id):
+            return True
+        if catalog is not None:
+            document = getattr(message, "document", None)
+            if catalog.has_document(getattr(document, "id", None), config.target_chat_ids):
+                logger.info("msg_id=%s already in catalog, skipping", message.id)
+                return True
         return dedup_has(state, message.id)
 
-    def record_sent(message: Any) -> None:
-        if state is None:
-            media.mark_sent(message)
-            media.record_sent(config.batch_size)
-            return
-        dedup_add(state, message.id, dedup_limit)
-        state["sent_total"] = int(state.get("sent_total", 0)) + 1
-        state["sent_in_batch"] = int(state.get("sent_in_batch", 0)) + 1
-        if state["sent_in_batch"] >= config.batch_size:
-            logger.info("batch complete: %s", state["sent_total"])
-            state["sent_in_batch"] = 0
-        state["last_media_message_id"] = message.id
-        if state_path:
+    def checkpoint(*, save: bool = False) -> None:
+        nonlocal unsaved
+        message_id = sender.checkpoint_id(current_msg.id)
+        if on_checkpoint is not None:
+            on_checkpoint(message_id)
+        else:
+            state["last_media_message_id"] = message_id
+        unsaved += 1
+        if state_path and (save or unsaved >= config.batch_size):
             save_state(state_path, state)
+            unsaved = 0
 
-    if state is not None:
-        state["last_media_message_id"] = current_msg.id
-        if state_path:
-            save_state(state_path, state)
+    def deliver(delivered: list[Any]) -> None:
+        nonlocal dispatched
+        for message in delivered:
+            dispatched += 1
+            logger.info("queued for delivery msg_id=%s", message.id)
 
-    if not already_sent(current_msg):
-        sent = await media.send_to_target(
-            client, current_msg, config.target_chat_id, config.forward_mode
-        )
-        if sent:
-            record_sent(current_msg)
-            sent_total += 1
-            logger.info("sent to target msg_id=%s", current_msg.id)
-
-    while True:
-        if stop_event is not None and stop_event.is_set():
-            return {
-                "ok": True,
-                "reason": "stopped",
-                "sent_total": sent_total,
-                "last_message_id": current_msg.id,
-            }
-        match = find_button(current_msg, config.button_next_text)
-        if not match:
-            reason = "end_no_next_button"
-            logger.info("end reason=%s", reason)
-            return {
-                "ok": True,
-                "reason": reason,
-                "sent_total": sent_total,
-                "last_message_id": current_msg.id,
-            }
-
-        next_media = None
-        for _ in range(config.max_retries_next):
-            if stop_event is not None and stop_event.is_set():
-                return {
-                    "ok": True,
-                    "reason": "stopped",
-                    "sent_total": sent_total,
-                    "last_message_id": current_msg.id,
-                }
-            await click_button(current_msg, match)
-            logger.info("clicked NEXT on msg_id=%s", current_msg.id)
-            await asyncio.sleep(config.wait_after_click_seconds)
-            next_media = await _wait_for_next_media_message(
+    async def finish(reason: str) -> dict:
+        deliver(sender.flush())
+        checkpoint(save=True)
+        if own_fanout is not None:
+            await own_fanout.close(stop_event)
+        return {
+            "ok": True,
+            "reason": reason,
+            "dispatched": dispatched,
+            "last_message_id": current_msg.id,
+        }
+
+    if config.quality_policy != "default":
+        try:
+            current_msg = await _apply_quality(
                 client,
                 entity,
-                after_id=current_msg.id,
-                timeout_seconds=config.wait_next_media_timeout_seconds,
+                current_msg,
+                config=config,
+                state=state,
+                bot_username=bot_username,
+                title=sender.title,
+                resumed=catch_up,
                 stop_event=stop_event,
             )
-            if next_media:
-                break
-            if stop_event is not None and stop_event.is_set():
-                return {
-                    "ok": True,
-                    "reason": "stopped",
-                    "sent_total": sent_total,
-                    "last_message_id": current_msg.id,
-                }
-
-        if not next_media:
-            reason = "end_timeout_no_new_media"
-            logger.info("end reason=%s", reason)
-            return {
-                "ok": True,
-                "reason": reason,
-                "sent_total": sent_total,
-                "last_message_id": current_msg.id,
-            }
-
-        logger.info("received media msg_id=%s", next_media.id)
-        current_msg = next_media
-        send_task = asyncio.create_task(
-            media.send_to_target(client, current_msg, config.target_chat_id, config.forward_mode)
-        )
+        except Stopped:
+            return await finish("stopped")
 
-        if state is not None:
-            state["last_media_message_id"] = current_msg.id
-            if state_path:
-                save_state(state_path, state)
+    if not already_sent(current_msg):
+        deliver(sender.add(current_msg))
+    checkpoint()
+    if not follow_next:
+        return await finish("first_media_only")
+    next_button = bot_matcher(config, bot_username, config.button_next_text, state)
 
-        if already_sent(current_msg):
-            continue
+    try:
+        if catch_up:
+            missed = await cancellable(
+                _collect_missed_media(client, entity, current_msg.id), stop_event
+            )
+            if missed:
+                logger.info(
+                    "catch-up: %s media after msg_id=%s", len(missed), current_msg.id
+                )
+                beat()
+            for message in missed:
+                current_msg = message
+                if not already_sent(current_msg):
+                    deliver(sender.add(current_msg))
+            checkpoint()
 
-        sent = await media.send_to_target(
-            client, current_msg, config.target_chat_id, config.forward_mode
-        )
-        if not sent:
-            continue
+        while True:
+            if is_set(stop_event):
+                return await finish("stopped")
+            if is_set(drain_event):
+                logger.info("drain requested, stopping after msg_id=%s", current_msg.id)
+                return await finish("drained")
+            match = next_button.find(current_msg)
+            if not match:
+                reason = "end_no_next_button"
+                logger.info("end reason=%s", reason, extra={"reason": reason})
+                return await finish(reason)
+
+            next_media = None
+            for _ in range(config.max_retries_next):
+                await cancellable(click_button(current_msg, match), stop_event)
+                logger.info(
+                    "clicked NEXT on msg_id=%s", current_msg.id, extra={"msg_id": current_msg.id}
+                )
+                if await sleep(config.wait_after_click_seconds, stop_event):
+                    return await finish("stopped")
+                next_media = await _wait_for_next_media_message(
+                    client,
+                    entity,
+                    after_id=current_msg.id,
+                    timeout_seconds=config.wait_next_media_timeout_seconds,
+                    stop_event=stop_event,
+                )
+                if next_media:
+                    break
+                if is_set(stop_event):
+                    return await finish("stopped")
+
+            if not next_media:
+                reason = "end_timeout_no_new_media"
+                logger.info("end reason=%s", reason, extra={"reason": reason})
+                return await finish(reason)
+
+            logger.info(
+                "received media msg_id=%s", next_media.id, extra={"msg_id": next_media.id}
+            )
+            current_msg = next_media
+            beat()
 
-        record_sent(current_msg)
-        sent_total += 1
-        logger.info("sent to target msg_id=%s", current_msg.id)
+            if not already_sent(current_msg):
+                deliver(sender.add(current_msg))
+            checkpoint()
+    except Stopped:
+        return await finish("stopped")
+    except asyncio.CancelledError:
+        # Hand over what was buffered so the outbox and checkpoint stay in step.
+        deliver(sender.flush())
+        checkpoint()
+        raise
@@ -0,0 +1,162 @@
+"""Session storage for the Telethon client.
+
+``SESSION_MODE`` picks where the authorization and the entity cache live:
+
+- ``sqlite``: Telethon's own ``<name>.session`` file, read and written on
+  every change (the default, and what ``login`` always uses);
+- ``memory``: the file is read once into memory and written back in the
+  background every ``SESSION_FLUSH_SECONDS`` and on disconnect, so the
+  SQLite lock is held only for the moment of a flush;
+- ``readonly``: like ``memory`` but never written back. Several worker
+  processes can run from one authorized session, or from a snapshot of it
+  (``SESSION_SNAPSHOT``, made with ``python -m app.cli session-snapshot``).
+"""
+from __future__ import annotations
+
+import asyncio
+from contextlib import closing
+import logging
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from typing import Any
+
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession, SQLiteSession
+
+logger = logging.getLogger(__name__)
+
+SESSION_MODES = ("sqlite", "memory", "readonly")
+SESSION_EXTENSION = ".session"
+
+
+def session_path(name: str) -> Path:
+    return Path(name if name.endswith(SESSION_EXTENSION) else name + SESSION_EXTENSION)
+
+
+class FileMemorySession(MemorySession):
+    """A ``MemorySession`` loaded from a Telethon session file.
+
+    ``flush`` writes the authorization and the entities learned since the
+    last flush back to ``path``; read-only sessions never write.
+    """
+
+    def __init__(self, path: Path, *, source: Path | None = None, readonly: bool = False) -> None:
+        super().__init__()
+        self.path = path
+        self.readonly = readonly
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._flushed: set[tuple[Any, ...]] = set()
+        self._load(source or path)
+
+    def _load(self, source: Path) -> None:
+        if not source.exists():
+            return
+        with closing(sqlite3.connect(f"file:{source}?mode=ro", uri=True)) as conn:
+            row = conn.execute(
+                "select dc_id, server_address, port, auth_key, takeout_id from sessions"
+            ).fetchone()
+            if row:
+                dc_id, server_address, port, key, self._takeout_id = row
+                super().set_dc(dc_id, server_address, port)
+                self._auth_key = AuthKey(data=key) if key else None
+            self._entities = {
+                tuple(entity)
+                for entity in conn.execute("select id, hash, username, phone, name from entities")
+            }
+        self._flushed = set(self._entities)
+        logger.info("session loaded from %s entities=%s", source, len(self._entities))
+
+    @property
+    def dirty(self) -> bool:
+        return self._dirty or len(self._entities) != len(self._flushed)
+
+    def set_dc(self, dc_id: int, server_address: str, port: int) -> None:
+        super().set_dc(dc_id, server_address, port)
+        self._dirty = True
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value: Any) -> None:
+        self._auth_key = value
+        self._dirty = True
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value: Any) -> None:
+        self._takeout_id = value
+        self._dirty = True
+
+    def save(self) -> None:
+        # Telethon calls this without awaiting it after authorization
+        # changes; entities wait for the background flush.
+        if self._dirty:
+            self.flush()
+
+    def flush(self) -> bool:
+        with self._lock:
+            return self._flush()
+
+    def _flush(self) -> bool:
+        if self.readonly or not self.dirty:
+            return False
+        entities = self._entities - self._flushed
+        # Creates the file, or upgrades an old one, with Telethon's schema.
+        SQLiteSession(str(self.path)).close()
+        now = int(time.time())
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute("delete from sessions")
+            conn.execute(
+                "insert into sessions (dc_id, server_address, port, auth_key, takeout_id)"
+                " values (?, ?, ?, ?, ?)",
+                (
+                    self._dc_id,
+                    self._server_address,
+                    self._port,
+                    self._auth_key.key if self._auth_key else b"",
+                    self._takeout_id,
+                ),
+            )
+            conn.executemany(
+                "insert or replace into entities values (?, ?, ?, ?, ?, ?)",
+                [(*entity, now) for entity in entities],
+            )
+        self._flushed |= entities
+        self._dirty = False
+        logger.info("session flushed to %s new_entities=%s", self.path, len(entities))
+        return True
+
+
+def open_session(name: str, config: Any) -> Any:
+    """What to pass to ``TelegramClient`` as the session for ``name``."""
+    if config.session_mode == "sqlite":
+        return name
+    source = Path(config.session_snapshot) if config.session_snapshot else None
+    return FileMemorySession(
+        session_path(name),
+        source=source,
+        readonly=config.session_mode == "readonly",
+    )
+
+
+async def persist(session: FileMemorySession, interval_seconds: int) -> None:
+    """Flush ``session`` every ``interval_seconds`` until cancelled."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(session.flush)
+        except sqlite3.Error:
+            logger.exception("session flush failed, retrying in %ss", interval_seconds)
+
+
+def snapshot_session(name: str, out: str) -> Path:
+    """Consistent copy of the session file, safe while another process writes it."""
+    source = session_path(name)
+    if not source.exists():
+        raise FileNotFoundError(f"Session file not found: {source}")
+    target = Path(out)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with closing(sqlite3.connect(f"file:{source}?mode=ro", uri=True)) as src:
+        with closing(sqlite3.connect(target)) as dst:
+            src.backup(dst)
+    return target
@@ -0,0 +1,119 @@
+"""Optional fast paths, enabled with ``PERF_PROFILE=fast``.
+
+- ``uvloop`` runs the event loop of the CLI and the web server;
+- ``orjson`` serializes the state file and API responses;
+- ``cryptg`` does MTProto AES in C. Telethon picks it up by itself
+  whenever it is installed, so it is only reported here.
+
+Every one of them is optional: a missing package leaves the standard
+library path in place. ``enable`` logs which fast paths are active.
+"""
+from __future__ import annotations
+
+import importlib.util
+import json
+import logging
+import os
+from typing import Any, Coroutine
+
+logger = logging.getLogger(__name__)
+
+PERF_PROFILES = ("default", "fast")
+FAST_PATHS = ("uvloop", "orjson", "cryptg")
+
+_orjson: Any = None
+_uvloop: Any = None
+_active: dict[str, bool] = {}
+
+
+def installed(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+
+def active() -> dict[str, bool]:
+    """Which fast paths are in use, by package name."""
+    return dict(_active) or {name: False for name in FAST_PATHS}
+
+
+def enable(profile: str | None = None) -> dict[str, bool]:
+    """Switch to the fast paths when ``profile`` (``PERF_PROFILE``) is ``fast``."""
+    global _orjson, _uvloop
+    if profile is None:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        profile = os.getenv("PERF_PROFILE", "default")
+    profile = profile.strip().lower() or "default"
+    if profile not in PERF_PROFILES:
+        raise ValueError(f"PERF_PROFILE must be one of: {', '.join(PERF_PROFILES)}")
+
+    fast = profile == "fast"
+    _orjson = _import("orjson") if fast else None
+    _uvloop = _import("uvloop") if fast else None
+    _active.update(
+        uvloop=_uvloop is not None,
+        orjson=_orjson is not None,
+        cryptg=installed("cryptg"),
+    )
+    logger.info(
+        "perf profile=%s fast paths: %s",
+        profile,
+        ", ".join(f"{name}={'on' if on else 'off'}" for name, on in _active.items()),
+    )
+    return active()
+
+
+def _import(name: str) -> Any:
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        logger.info("%s is not installed, using the standard library", name)
+        return None
+
+
+def run(main: Coroutine[Any, Any, Any]) -> Any:
+    """``asyncio.run`` on uvloop when it is enabled."""
+    if _uvloop is not None:
+        return _uvloop.run(main)
+    # Imported here so that ``status``/``reset`` (through ``app.state``) stay cheap.
+    import asyncio
+
+    return asyncio.run(main)
+
+
+def uvicorn_loop() -> str:
+    # uvicorn's "auto" would pick uvloop whenever installed; keep it opt-in.
+    return "uvloop" if _uvloop is not None else "asyncio"
+
+
+def dumps(obj: Any, *, indent: bool = False) -> bytes:
+    """UTF-8 JSON; the same text with and without orjson."""
+    if _orjson is not None:
+        option = _orjson.OPT_NON_STR_KEYS | (_orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return _orjson.dumps(obj, option=option)
+        except TypeError:
+            # Integers beyond 64 bits and other types orjson refuses.
+            pass
+    if indent:
+        text = json.dumps(obj, ensure_ascii=False, indent=2)
+    else:
+        text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+    return text.encode("utf-8")
+
+
+def loads(data: bytes | str) -> Any:
+    if _orjson is not None:
+        return _orjson.loads(data)
+    return json.loads(data)
+
+
+def json_response_class() -> Any:
+    """Response class for FastAPI: ``ORJSONResponse`` when orjson is enabled."""
+    from fastapi.responses import JSONResponse
+
+    if _orjson is None:
+        return JSONResponse
+    from fastapi.responses import ORJSONResponse
+
+    return ORJSONResponse
@@ -2,28 +2,42 @@
 from __future__ import annotations
 
 from datetime import datetime, timezone
-import json
 import os
 from pathlib import Path
 from typing import Any
 
+from app import speedups
+
 
 def _default_state() -> dict[str, Any]:
     return {
         "version": 1,
-        "titles": [],
+        "titles_path": "",
+        "titles_size": 0,
+        "titles_hash": "",
+        "titles_count": 0,
         "current_index": 0,
+        "done_indices": [],
+        "active_indices": [],
         "phase": "idle",
         "sent_total": 0,
         "sent_in_batch": 0,
         "sent_ids": [],
+        "retry_queue": [],
+        "failed": [],
         "last_bot_chat": "",
         "last_title": "",
         "last_media_message_id": 0,
+        "checkpoints": {},
         "updated_at": "",
     }
 
 
+def new_state() -> dict[str, Any]:
+    """Fresh in-memory state for runs that do not persist one."""
+    return _default_state()
+
+
 def _merge_state(state: dict[str, Any]) -> dict[str, Any]:
     merged = _default_state()
     merged.update(state or {})
@@ -38,8 +52,7 @@ def load_state(path: str) -> dict[str, Any]:
     state_path = Path(path)
     if not state_path.exists():
         return _default_state()
-    with state_path.open("r", encoding="utf-8") as handle:
-        data = json.load(handle)
+    data = speedups.loads(state_path.read_bytes())
     return _merge_state(data)
 
 
@@ -48,9 +61,7 @@ def save_state(path: str, state: dict[str, Any]) -> None:
     state_path.parent.mkdir(parents=True, exist_ok=True)
     state["updated_at"] = _now_iso()
     tmp_path = state_path.with_suffix(state_path.suffix + ".tmp")
-    with tmp_path.open("w", encoding="utf-8") as handle:
-        json.dump(state, handle, ensure_ascii=False, indent=2)
-        handle.write("\n")
+    tmp_path.write_bytes(speedups.dumps(state, indent=True) + b"\n")
     os.replace(tmp_path, state_path)
 
 
@@ -66,3 +77,19 @@ def dedup_add(state: dict[str, Any], msg_id: int, limit: int) -> None:
     if limit > 0 and len(sent_ids) > limit:
         sent_ids = sent_ids[-limit:]
     state["sent_ids"] = sent_ids
+
+
+def target_state(state: dict[str, Any], target: str) -> dict[str, Any]:
+    targets = state.setdefault("targets", {})
+    entry = targets.setdefault(target, {})
+    entry.setdefault("sent", 0)
+    entry.setdefault("sent_ids", [])
+    entry.setdefault("outbox", [])
+    return entry
+
+
+def targets_summary(state: dict[str, Any]) -> dict[str, dict[str, int]]:
+    return {
+        target: {"sent": entry.get("sent", 0), "outbox": len(entry.get("outbox", []))}
+        for target, entry in state.get("targets", {}).items()
+    }
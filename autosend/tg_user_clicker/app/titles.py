@@ -1,7 +1,42 @@
 """Title list loader for batch runs."""
 from __future__ import annotations
 
+from array import array
+import hashlib
+import json
+import logging
+import mmap
+import os
 from pathlib import Path
+import struct
+from typing import Any, Iterable
+
+from app.buttons import normalize_text
+from app.schedule import parse_title_line
+
+logger = logging.getLogger(__name__)
+
+_INDEX_SUFFIX = ".idx"
+_INDEX_MAGIC = b"TIDX1"
+_INDEX_HEADER = struct.Struct("<5sQQ32s")
+
+
+def clean_title(raw_line: str) -> str | None:
+    line = " ".join(raw_line.split())
+    if not line:
+        return None
+    if line.startswith("#"):
+        return None
+    return line
+
+
+def title_key(title: str) -> str:
+    return normalize_text(title)
+
+
+def _line_key(line: str) -> str:
+    """Key of a titles file line: its title without the ``|`` tags."""
+    return title_key(parse_title_line(line).title)
 
 
 def load_titles(path: str) -> list[str]:
@@ -19,3 +54,329 @@ def load_titles(path: str) -> list[str]:
                 continue
             titles.append(line)
     return titles
+
+
+def sidecar_titles_path(state_path: str) -> str:
+    """Titles file used for lists that arrive inline (run-one, API payloads)."""
+    path = Path(state_path)
+    return str(path.with_name(f"{path.stem}.titles.txt"))
+
+
+def _index_path(path: Path) -> Path:
+    return path.with_name(path.name + _INDEX_SUFFIX)
+
+
+def _file_lines(path: Path) -> dict[str, str]:
+    """Normalized last line of every title in the file, by ``_line_key``."""
+    lines: dict[str, str] = {}
+    if not path.exists():
+        return lines
+    with path.open("rb") as handle:
+        for raw_line in handle:
+            title = clean_title(raw_line.decode("utf-8", errors="replace"))
+            if title is not None:
+                lines[_line_key(title)] = title_key(title)
+    return lines
+
+
+def write_titles(path: str, titles: Iterable[str]) -> int:
+    titles_path = Path(path)
+    titles_path.parent.mkdir(parents=True, exist_ok=True)
+    titles_path.write_text("", encoding="utf-8")
+    return append_titles(path, titles)
+
+
+def append_titles(path: str, titles: Iterable[str]) -> int:
+    """Append normalized titles that are not in the file yet; returns the count.
+
+    A title already in the file is appended again only with other tags, which
+    then replace the old ones in the ``TitleIndex``.
+    """
+    titles_path = Path(path)
+    latest = _file_lines(titles_path)
+    lines: list[str] = []
+    for raw in titles:
+        title = clean_title(raw)
+        if title is None:
+            continue
+        key = _line_key(title)
+        if latest.get(key) == title_key(title):
+            continue
+        latest[key] = title_key(title)
+        lines.append(title)
+    if not lines:
+        return 0
+
+    titles_path.parent.mkdir(parents=True, exist_ok=True)
+    needs_newline = False
+    if titles_path.exists() and titles_path.stat().st_size:
+        with titles_path.open("rb") as handle:
+            handle.seek(-1, 2)
+            needs_newline = handle.read(1) != b"\n"
+    payload = "".join(f"{line}\n" for line in lines)
+    if needs_newline:
+        payload = "\n" + payload
+    with titles_path.open("a", encoding="utf-8") as handle:
+        handle.write(payload)
+    return len(lines)
+
+
+def parse_ndjson_titles(body: str) -> list[str]:
+    """Parse NDJSON where each line is a string or an object with ``title``."""
+    titles: list[str] = []
+    for line_number, raw_line in enumerate(body.splitlines(), start=1):
+        if not raw_line.strip():
+            continue
+        try:
+            item: Any = json.loads(raw_line)
+        except json.JSONDecodeError as exc:
+            raise ValueError(f"Invalid JSON on line {line_number}") from exc
+        if isinstance(item, dict):
+            item = item.get("title")
+        if not isinstance(item, str):
+            raise ValueError(f"Line {line_number} has no title")
+        titles.append(item)
+    return titles
+
+
+class TitleIndex:
+    """Unique titles of a file, addressed by position through an offset array.
+
+    The start offset of every unique title line is kept in an ``array('Q')``
+    and persisted next to the file (``<path>.idx``), so reopening a large list
+    only rereads the index. Titles are sliced out of a read-only mmap on
+    access. ``refresh`` indexes lines appended since the last call; with
+    ``follow`` an unterminated last line is left until it is completed.
+
+    Titles are unique by name without the ``|`` tags: a later line of the same
+    title keeps the first one's position and replaces its tags.
+    """
+
+    def __init__(self, path: str, *, follow: bool = False) -> None:
+        self.path = Path(path)
+        self.follow = follow
+        self.offsets = array("Q")
+        self._indexed_end = 0
+        self._hasher: Any = hashlib.sha256()
+        self._digest = self._hasher.digest()
+        self._seen: dict[str, int] | None = None
+        self._map: mmap.mmap | None = None
+        self._map_size = 0
+        self._load_index()
+        self.refresh()
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, index: int) -> str:
+        start = self.offsets[index]
+        newline = self._map.find(b"\n", start, self._indexed_end)
+        end = self._indexed_end if newline < 0 else newline
+        return clean_title(self._map[start:end].decode("utf-8", errors="replace")) or ""
+
+    @property
+    def size(self) -> int:
+        return self._indexed_end
+
+    @property
+    def content_hash(self) -> str:
+        return self._digest.hex()
+
+    def prefix_hash(self, size: int) -> str:
+        if size == self._indexed_end:
+            return self.content_hash
+        if self._map is None or size > self._map_size:
+            return ""
+        return hashlib.sha256(self._map[:size]).hexdigest()
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            self._map_size = 0
+
+    def refresh(self) -> int:
+        size = self.path.stat().st_size if self.path.exists() else 0
+        if size < self._indexed_end:
+            logger.warning("titles file %s shrank, rebuilding index", self.path)
+            self._reset()
+        if size == self._indexed_end:
+            return 0
+        self._remap(size)
+
+        start = self._indexed_end
+        end = size
+        if self.follow:
+            last_newline = self._map.rfind(b"\n", start, end)
+            if last_newline < 0:
+                return 0
+            end = last_newline + 1
+
+        if self._hasher is None:
+            self._hasher = hashlib.sha256(self._map[:start])
+        seen = self._ensure_seen()
+        added = 0
+        position = start
+        while position < end:
+            newline = self._map.find(b"\n", position, end)
+            line_end = end if newline < 0 else newline + 1
+            title = clean_title(self._map[position:line_end].decode("utf-8", errors="replace"))
+            if title is not None:
+                key = _line_key(title)
+                index = seen.get(key)
+                if index is not None:
+                    self.offsets[index] = position
+                else:
+                    seen[key] = len(self.offsets)
+                    self.offsets.append(position)
+                    added += 1
+            position = line_end
+
+        self._hasher.update(self._map[start:end])
+        self._digest = self._hasher.digest()
+        self._indexed_end = end
+        self._save_index()
+        return added
+
+    def _reset(self) -> None:
+        self.offsets = array("Q")
+        self._indexed_end = 0
+        self._hasher = hashlib.sha256()
+        self._digest = self._hasher.digest()
+        self._seen = None
+
+    def _ensure_seen(self) -> dict[str, int]:
+        if self._seen is None:
+            self._seen = {_line_key(self[index]): index for index in range(len(self))}
+        return self._seen
+
+    def _remap(self, size: int) -> None:
+        if self._map is not None and self._map_size == size:
+            return
+        self.close()
+        if not size:
+            return
+        with self.path.open("rb") as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self._map_size = len(self._map)
+
+    def _load_index(self) -> None:
+        index_path = _index_path(self.path)
+        if not index_path.exists() or not self.path.exists():
+            return
+        data = index_path.read_bytes()
+        if len(data) < _INDEX_HEADER.size:
+            return
+        magic, indexed_end, mtime_ns, digest = _INDEX_HEADER.unpack_from(data)
+        if magic != _INDEX_MAGIC:
+            return
+        stat = self.path.stat()
+        if stat.st_size < indexed_end:
+            return
+
+        hasher = None
+        if stat.st_size != indexed_end or stat.st_mtime_ns != mtime_ns:
+            # The file changed since it was indexed; the index is only reusable
+            # when the change was a pure append.
+            self._remap(stat.st_size)
+            hasher = hashlib.sha256(self._map[:indexed_end]) if indexed_end else hashlib.sha256()
+            if hasher.digest() != digest:
+                logger.info("titles file %s was modified, rebuilding index", self.path)
+                return
+
+        self.offsets.frombytes(data[_INDEX_HEADER.size:])
+        self._indexed_end = indexed_end
+        self._hasher = hasher
+        self._digest = digest
+        self._remap(stat.st_size)
+
+    def _save_index(self) -> None:
+        index_path = _index_path(self.path)
+        tmp_path = index_path.with_name(index_path.name + ".tmp")
+        header = _INDEX_HEADER.pack(
+            _INDEX_MAGIC, self._indexed_end, self.path.stat().st_mtime_ns, self._digest
+        )
+        try:
+            with tmp_path.open("wb") as handle:
+                handle.write(header)
+                self.offsets.tofile(handle)
+            os.replace(tmp_path, index_path)
+        except OSError:
+            logger.warning("failed to write title index %s", index_path, exc_info=True)
+
+
+def migrate_state_titles(state: dict[str, Any], state_path: str) -> None:
+    """Move a legacy inline ``titles`` list out of the state into a titles file."""
+    titles = state.pop("titles", None)
+    if not titles or state.get("titles_path"):
+        return
+    path = sidecar_titles_path(state_path)
+    write_titles(path, titles)
+    state["titles_path"] = path
+
+
+def reset_state_titles(state: dict[str, Any], titles_path: str) -> None:
+    state.pop("titles", None)
+    state["titles_path"] = titles_path
+    state["titles_size"] = 0
+    state["titles_hash"] = ""
+    state["titles_count"] = 0
+    state["current_index"] = 0
+    state["done_indices"] = []
+    state["active_indices"] = []
+
+
+def open_state_titles(
+    state: dict[str, Any],
+    state_path: str,
+    *,
+    follow: bool = False,
+) -> TitleIndex:
+    """Open the titles referenced by ``state`` and check them against its hash."""
+    migrate_state_titles(state, state_path)
+    titles = TitleIndex(state["titles_path"], follow=follow)
+
+    expected_hash = state.get("titles_hash", "")
+    if expected_hash and titles.prefix_hash(int(state.get("titles_size", 0))) != expected_hash:
+        logger.warning(
+            "titles file %s changed since the last checkpoint; current_index=%s may "
+            "point to a different title",
+            titles.path,
+            state.get("current_index", 0),
+        )
+
+    legacy_offset = state.pop("titles_offset", None)
+    if legacy_offset:
+        # Retagged titles point past their first line, so the offsets are
+        # not sorted; count the titles that start before the old checkpoint.
+        state["current_index"] = sum(offset < int(legacy_offset) for offset in titles.offsets)
+        state["done_indices"] = []
+        state["active_indices"] = []
+
+    state["titles_size"] = titles.size
+    state["titles_hash"] = titles.content_hash
+    state["titles_count"] = len(titles)
+    return titles
+
+
+def count_state_titles(state: dict[str, Any]) -> int:
+    """Number of titles in the state's list, for ``status`` and the API.
+
+    Read from the header and size of the ``.idx`` sidecar the runner keeps
+    up to date, so it costs the same for any list and never writes the
+    index; without one, the count the runner saved last.
+    """
+    if state.get("titles"):
+        return len(state["titles"])
+    titles_path = state.get("titles_path", "")
+    if not titles_path:
+        return 0
+    try:
+        with _index_path(Path(titles_path)).open("rb") as handle:
+            header = handle.read(_INDEX_HEADER.size)
+            size = os.fstat(handle.fileno()).st_size
+    except OSError:
+        header = b""
+    if len(header) == _INDEX_HEADER.size and _INDEX_HEADER.unpack(header)[0] == _INDEX_MAGIC:
+        return (size - _INDEX_HEADER.size) // array("Q").itemsize
+    return int(state.get("titles_count", 0))
@@ -0,0 +1,151 @@
+"""Progress heartbeats and stall detection for running jobs."""
+from __future__ import annotations
+
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+import logging
+import time
+from typing import Any, Callable, Iterator
+
+logger = logging.getLogger(__name__)
+
+_CHECK_SECONDS = 5
+# A stall is declared after this many expected gaps without progress.
+_STALL_FACTOR = 4
+
+_current: ContextVar[Heartbeat | None] = ContextVar("heartbeat", default=None)
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class Heartbeat:
+    """Tracks progress of one run and how long progress usually takes.
+
+    Gaps between beats feed a smoothed mean and deviation (the same estimator
+    TCP uses for its retransmission timeout); a run is stalled once no beat
+    arrived for ``_STALL_FACTOR`` expected gaps, but never before
+    ``min_stall_seconds``. Time spent in ``idle()`` blocks (planned waits)
+    does not count.
+    """
+
+    def __init__(
+        self,
+        *,
+        min_stall_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.min_stall_seconds = min_stall_seconds
+        self._clock = clock
+        self._last_progress = clock()
+        self._idle = 0
+        self._mean: float | None = None
+        self._deviation = 0.0
+        self.last_message_at: str | None = None
+        self.last_forward_at: str | None = None
+        self.stalls = 0
+        self.last_stall_at: str | None = None
+
+    def beat(self, kind: str) -> None:
+        now = self._clock()
+        if self._idle == 0:
+            self._observe(now - self._last_progress)
+        self._last_progress = now
+        if kind == "forward":
+            self.last_forward_at = _now_iso()
+        else:
+            self.last_message_at = _now_iso()
+
+    def _observe(self, gap: float) -> None:
+        if self._mean is None:
+            self._mean = gap
+            self._deviation = gap / 2
+            return
+        self._deviation = 0.75 * self._deviation + 0.25 * abs(self._mean - gap)
+        self._mean = 0.875 * self._mean + 0.125 * gap
+
+    def expected_latency(self) -> float | None:
+        if self._mean is None:
+            return None
+        return self._mean + 4 * self._deviation
+
+    def stall_threshold(self) -> float:
+        expected = self.expected_latency()
+        if expected is None:
+            return self.min_stall_seconds
+        return max(self.min_stall_seconds, _STALL_FACTOR * expected)
+
+    def silent_for(self) -> float:
+        if self._idle:
+            return 0.0
+        return self._clock() - self._last_progress
+
+    def is_stalled(self) -> bool:
+        return self.silent_for() > self.stall_threshold()
+
+    @contextmanager
+    def idle(self) -> Iterator[None]:
+        self._idle += 1
+        try:
+            yield
+        finally:
+            self._idle -= 1
+            if self._idle == 0:
+                self._last_progress = self._clock()
+
+    async def watch(self, stop_event: asyncio.Event, interval: float = _CHECK_SECONDS) -> bool:
+        """Set ``stop_event`` and return True once the run stalls."""
+        while not stop_event.is_set():
+            await asyncio.sleep(interval)
+            if self.is_stalled():
+                self.stalls += 1
+                self.last_stall_at = _now_iso()
+                logger.warning(
+                    "stall detected: no progress for %.0fs (threshold %.0fs)",
+                    self.silent_for(),
+                    self.stall_threshold(),
+                )
+                stop_event.set()
+                return True
+        return False
+
+    def snapshot(self) -> dict[str, Any]:
+        expected = self.expected_latency()
+        return {
+            "last_message_at": self.last_message_at,
+            "last_forward_at": self.last_forward_at,
+            "silent_seconds": round(self.silent_for(), 1),
+            "expected_latency_seconds": None if expected is None else round(expected, 1),
+            "stall_threshold_seconds": round(self.stall_threshold(), 1),
+            "stalls": self.stalls,
+            "last_stall_at": self.last_stall_at,
+        }
+
+
+@contextmanager
+def watching(heartbeat: Heartbeat) -> Iterator[None]:
+    """Make ``heartbeat`` receive ``beat``/``idle`` calls from this task and its children."""
+    token = _current.set(heartbeat)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def beat(kind: str = "message") -> None:
+    heartbeat = _current.get()
+    if heartbeat is not None:
+        heartbeat.beat(kind)
+
+
+@contextmanager
+def idle() -> Iterator[None]:
+    heartbeat = _current.get()
+    if heartbeat is None:
+        yield
+        return
+    with heartbeat.idle():
+        yield
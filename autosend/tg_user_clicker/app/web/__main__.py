@@ -3,9 +3,16 @@ from __future__ import annotations
 
 import uvicorn
 
+from app.log import setup_logging
+from app.speedups import enable, uvicorn_loop
+
 
 def main() -> None:
-    uvicorn.run("app.web.server:app", host="127.0.0.1", port=8080, reload=False)
+    setup_logging()
+    enable()
+    uvicorn.run(
+        "app.web.server:app", host="127.0.0.1", port=8080, reload=False, loop=uvicorn_loop()
+    )
 
 
 if __name__ == "__main__":
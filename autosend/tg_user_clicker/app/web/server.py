@@ -2,45 +2,59 @@
 from __future__ import annotations
 
 import asyncio
-from collections import deque
 from dataclasses import dataclass
 from datetime import datetime, timezone
 import logging
 from pathlib import Path
 from typing import Any
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
 
+from app import speedups
+from app.cancel import Stopped
+from app.catalog import Catalog
 from app.client import get_client
 from app.config import load_config
-from app.log import LOG_FORMAT, setup_logging
+from app.log import LOG_FORMAT, LogBuffer, log_context, record_fields, setup_logging
+from app.jobs import (
+    JOB_CANCELLED,
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_PAUSED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    KIND_RECONCILE,
+    UNFINISHED_STATUSES,
+    Job,
+    JobStore,
+)
+from app.profiles import list_profiles
+from app.reconcile import run_reconcile
 from app.runner import run_titles
-from app.search_flow import run_inline_search_and_pick_first, run_search_and_pick_first
-from app.state import load_state, save_state
-from app.titles import load_titles
+from app.schedule import done_count
+from app.search_flow import run_inline_search_and_pick_first
+from app.state import load_state, save_state, targets_summary
+from app.titles import (
+    TitleIndex,
+    append_titles,
+    count_state_titles,
+    open_state_titles,
+    parse_ndjson_titles,
+    reset_state_titles,
+    sidecar_titles_path,
+    write_titles,
+)
+from app.watchdog import Heartbeat, watching
 
-logger = logging.getLogger(__name__)
-
-
-LOG_BUFFER: deque[str] = deque(maxlen=2000)
 
-
-class RingBufferHandler(logging.Handler):
-    def __init__(self, buffer: deque[str]) -> None:
-        super().__init__()
-        self.buffer = buffer
-
-    def emit(self, record: logging.LogRecord) -> None:
-        message = self.format(record)
-        self.buffer.append(message)
+logger = logging.getLogger(__name__)
 
 
-setup_logging()
-ring_handler = RingBufferHandler(LOG_BUFFER)
-ring_handler.setFormatter(logging.Formatter(LOG_FORMAT))
-logging.getLogger().addHandler(ring_handler)
+LOG_BUFFER = LogBuffer(maxlen=2000)
+setup_logging(buffer=LOG_BUFFER)
+_log_formatter = logging.Formatter(LOG_FORMAT)
 
 
 class RunOneRequest(BaseModel):
@@ -54,6 +68,22 @@ class RunListRequest(BaseModel):
     titles_file: str | None = None
     bot_username: str | None = None
     inline: bool = False
+    follow: bool = False
+
+
+class JobCreateRequest(RunListRequest):
+    priority: int = 0
+    session_name: str | None = None
+
+
+class JobUpdateRequest(BaseModel):
+    priority: int
+
+
+class ReconcileRequest(BaseModel):
+    warm: bool = False
+    deliver: bool = True
+    session_name: str | None = None
 
 
 @dataclass
@@ -64,87 +94,329 @@ class RunStatus:
 
 
 class RunManager:
-    def __init__(self) -> None:
+    """Schedules persisted jobs, one at a time per session and state file."""
+
+    def __init__(self, store: JobStore | None = None) -> None:
+        self._store = store
         self._lock = asyncio.Lock()
-        self.current_task: asyncio.Task | None = None
-        self.stop_event: asyncio.Event | None = None
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._stop_events: dict[str, asyncio.Event] = {}
+        self._drain_events: dict[str, asyncio.Event] = {}
+        self._heartbeats: dict[str, Heartbeat] = {}
+        self._stop_statuses: dict[str, str] = {}
         self.started_at: str | None = None
         self.last_error: str | None = None
 
-    def status(self) -> RunStatus:
-        running = self.current_task is not None and not self.current_task.done()
-        return RunStatus(running=running, started_at=self.started_at, last_error=self.last_error)
+    @property
+    def store(self) -> JobStore:
+        if self._store is None:
+            self._store = JobStore(load_config().jobs_dir)
+        return self._store
 
-    async def start(self, titles: list[str], bot_username: str, inline: bool) -> bool:
+    async def _save(self, job: Job) -> None:
+        # Job and state files are written on a thread so that a slow disk
+        # never stalls the runs sharing this event loop.
+        await asyncio.to_thread(self.store.save, job)
+
+    def status(self) -> RunStatus:
+        return RunStatus(
+            running=bool(self.running_job_ids()),
+            started_at=self.started_at,
+            last_error=self.last_error,
+        )
+
+    def running_job_ids(self) -> list[str]:
+        return [job_id for job_id, task in self._tasks.items() if not task.done()]
+
+    def has_active_job(self, state_path: str) -> bool:
+        return any(
+            job.state_path == state_path and job.status in UNFINISHED_STATUSES
+            for job in self.store.list()
+        )
+
+    async def recover(self) -> None:
+        for job in self.store.list():
+            if job.status == JOB_RUNNING:
+                logger.info("job=%s resuming after restart", job.job_id)
+                job.status = JOB_QUEUED
+                await self._save(job)
+        await self.schedule()
+
+    async def submit(self, job: Job) -> None:
+        job.status = JOB_QUEUED
+        await self._save(job)
+        await self.schedule()
+
+    async def schedule(self) -> None:
         async with self._lock:
-            if self.current_task is not None and not self.current_task.done():
-                return False
-            self.stop_event = asyncio.Event()
-            self.started_at = datetime.now(timezone.utc).isoformat()
-            self.last_error = None
-            self.current_task = asyncio.create_task(
-                self._run_titles(titles, bot_username, inline)
+            # A memory session holds no SQLite lock, so jobs may share it, but
+            # never the same bot chat: a second job would take the first
+            # one's search results and episodes as its own.
+            shared_sessions = load_config().session_mode != "sqlite"
+
+            def conversation(job: Job) -> tuple[str, str]:
+                return (job.session_name, job.bot_username if shared_sessions else "")
+
+            busy_conversations: set[tuple[str, str]] = set()
+            busy_states: set[str] = set()
+            queued: list[Job] = []
+            for job in self.store.list():
+                if job.job_id in self.running_job_ids():
+                    busy_conversations.add(conversation(job))
+                    busy_states.add(job.state_path)
+                elif job.status == JOB_QUEUED:
+                    queued.append(job)
+
+            for job in queued:
+                if job.state_path in busy_states or conversation(job) in busy_conversations:
+                    continue
+                busy_conversations.add(conversation(job))
+                busy_states.add(job.state_path)
+                await self._start(job)
+
+    async def _start(self, job: Job) -> None:
+        stop_event = asyncio.Event()
+        drain_event = asyncio.Event()
+        self._stop_events[job.job_id] = stop_event
+        self._drain_events[job.job_id] = drain_event
+        self.started_at = datetime.now(timezone.utc).isoformat()
+        self.last_error = None
+        job.status = JOB_RUNNING
+        job.last_error = None
+        await self._save(job)
+        logger.info("job=%s started priority=%s", job.job_id, job.priority)
+        with log_context(job_id=job.job_id):
+            self._tasks[job.job_id] = asyncio.create_task(
+                self._run_job(job, stop_event, drain_event)
             )
-            return True
-
-    async def stop(self) -> None:
-        if self.stop_event is not None:
-            self.stop_event.set()
-        if self.current_task is not None and not self.current_task.done():
-            config = load_config()
-            state = load_state(config.state_path)
-            state["phase"] = "stopping"
-            save_state(config.state_path, state)
-
-    async def _run_titles(self, titles: list[str], bot_username: str, inline: bool) -> None:
+
+    async def _request_stop(self, job_id: str, final_status: str, *, drain: bool = False) -> bool:
+        """Ask a running job to stop now, or with ``drain`` after the current episode."""
+        task = self._tasks.get(job_id)
+        if task is None or task.done():
+            return False
+        self._stop_statuses[job_id] = final_status
+        if drain:
+            self._drain_events[job_id].set()
+        else:
+            self._stop_events[job_id].set()
+        return True
+
+    async def stop(self, *, drain: bool = False) -> None:
+        for job_id in self.running_job_ids():
+            await self._request_stop(job_id, JOB_PAUSED, drain=drain)
+
+    async def pause(self, job_id: str, *, drain: bool = False) -> Job | None:
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        task = self._tasks.get(job_id)
+        if await self._request_stop(job_id, JOB_PAUSED, drain=drain):
+            if not drain and task is not None:
+                await asyncio.wait({task})
+                return self.store.get(job_id) or job
+            # A drained job finishes its episode first; report where it is headed.
+            job.status = JOB_PAUSED
+        elif job.status == JOB_QUEUED:
+            job.status = JOB_PAUSED
+            await self._save(job)
+        return job
+
+    async def resume(self, job_id: str) -> Job | None:
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        if job.status in {JOB_PAUSED, JOB_FAILED}:
+            await self.submit(job)
+        return job
+
+    async def cancel(self, job_id: str) -> bool:
+        job = self.store.get(job_id)
+        if job is None:
+            return False
+        task = self._tasks.get(job_id)
+        if await self._request_stop(job_id, JOB_CANCELLED) and task is not None:
+            await asyncio.wait({task})
+        self.store.delete(job_id)
+        return True
+
+    async def _run_job(
+        self, job: Job, stop_event: asyncio.Event, drain_event: asyncio.Event
+    ) -> None:
+        final_status = JOB_DONE
+        try:
+            if job.kind == KIND_RECONCILE:
+                await self._run_reconcile(job, stop_event, drain_event)
+            else:
+                await self._run_titles(job, stop_event, drain_event)
+            if job.last_error:
+                final_status = JOB_FAILED
+        except Exception as exc:  # pragma: no cover - defensive
+            logger.exception("Runner failed job=%s", job.job_id)
+            job.last_error = f"error:{exc.__class__.__name__}"
+            final_status = JOB_FAILED
+            state = load_state(job.state_path)
+            state["phase"] = "idle"
+            await asyncio.to_thread(save_state, job.state_path, state)
+        finally:
+            if job.job_id in self._stop_statuses:
+                final_status = self._stop_statuses.pop(job.job_id)
+            self.last_error = job.last_error
+            self._tasks.pop(job.job_id, None)
+            self._stop_events.pop(job.job_id, None)
+            self._drain_events.pop(job.job_id, None)
+            stored = self.store.get(job.job_id)
+            if final_status != JOB_CANCELLED and stored is not None:
+                stored.status = final_status
+                stored.last_error = job.last_error
+                await self._save(stored)
+            logger.info("job=%s finished status=%s", job.job_id, final_status)
+        await self.schedule()
+
+    async def _run_titles(
+        self, job: Job, stop_event: asyncio.Event, drain_event: asyncio.Event
+    ) -> None:
         config = load_config()
         if not config.target_chat_id:
-            self.last_error = "missing_target_chat_id"
+            job.last_error = "missing_target_chat_id"
             logger.error("TARGET_CHAT_ID is required to run titles")
-            state = load_state(config.state_path)
+            state = load_state(job.state_path)
             state["phase"] = "idle"
-            save_state(config.state_path, state)
+            await asyncio.to_thread(save_state, job.state_path, state)
             return
 
-        client = get_client()
+        client = get_client(job.session_name)
         await client.connect()
         try:
             if not await client.is_user_authorized():
-                self.last_error = "not_authorized"
+                job.last_error = "not_authorized"
                 logger.error("User session is not authorized. Run login first.")
-                state = load_state(config.state_path)
+                state = load_state(job.state_path)
                 state["phase"] = "idle"
-                save_state(config.state_path, state)
+                await asyncio.to_thread(save_state, job.state_path, state)
                 return
 
-            search_flow = (
-                run_inline_search_and_pick_first if inline else run_search_and_pick_first
-            )
-            state = load_state(config.state_path)
-            state["phase"] = "running"
-            save_state(config.state_path, state)
-            await run_titles(
-                client,
-                bot_username,
-                titles,
-                state,
-                search_flow=search_flow,
-                stop_event=self.stop_event,
-            )
-        except Exception as exc:  # pragma: no cover - defensive
-            logger.exception("Runner failed")
-            self.last_error = f"error:{exc.__class__.__name__}"
-            state = load_state(config.state_path)
-            state["phase"] = "idle"
-            save_state(config.state_path, state)
+            search_flow = run_inline_search_and_pick_first if job.inline else None
+            heartbeat = Heartbeat(min_stall_seconds=config.stall_min_seconds)
+            self._heartbeats[job.job_id] = heartbeat
+            while True:
+                state = load_state(job.state_path)
+                state["phase"] = "running"
+                if state.get("titles_path") != job.titles_path:
+                    reset_state_titles(state, job.titles_path)
+                titles = open_state_titles(state, job.state_path, follow=job.follow)
+                await asyncio.to_thread(save_state, job.state_path, state)
+                stalls = heartbeat.stalls
+                watch = None
+                if config.stall_min_seconds > 0:
+                    watch = asyncio.create_task(heartbeat.watch(stop_event))
+                try:
+                    with watching(heartbeat):
+                        await run_titles(
+                            client,
+                            job.bot_username,
+                            titles,
+                            state,
+                            search_flow=search_flow,
+                            stop_event=stop_event,
+                            state_path=job.state_path,
+                            drain_event=drain_event,
+                        )
+                finally:
+                    titles.close()
+                    if watch is not None:
+                        watch.cancel()
+                if heartbeat.stalls == stalls or job.job_id in self._stop_statuses:
+                    break
+                # The checkpoint is saved; reconnect and resume the current title from it.
+                state = load_state(job.state_path)
+                state["stalls"] = int(state.get("stalls", 0)) + 1
+                await asyncio.to_thread(save_state, job.state_path, state)
+                logger.warning("job=%s reconnecting after stall", job.job_id)
+                await client.disconnect()
+                await client.connect()
+                stop_event = asyncio.Event()
+                self._stop_events[job.job_id] = stop_event
         finally:
+            self._heartbeats.pop(job.job_id, None)
             await client.disconnect()
 
+    async def _run_reconcile(
+        self, job: Job, stop_event: asyncio.Event, drain_event: asyncio.Event
+    ) -> None:
+        config = load_config()
+        if not config.target_chat_id or not config.catalog_path:
+            job.last_error = "missing_target_or_catalog"
+            logger.error("TARGET_CHAT_ID and CATALOG_PATH are required to reconcile")
+            return
 
-app = FastAPI()
+        client = get_client(job.session_name)
+        await client.connect()
+        try:
+            if not await client.is_user_authorized():
+                job.last_error = "not_authorized"
+                logger.error("User session is not authorized. Run login first.")
+                return
+            state = load_state(job.state_path)
+            try:
+                report = await run_reconcile(
+                    client,
+                    config,
+                    state,
+                    state_path=job.state_path,
+                    warm=bool(job.options.get("warm")),
+                    deliver=bool(job.options.get("deliver", True)),
+                    stop_event=stop_event,
+                    drain_event=drain_event,
+                    skip_targets=job.options.get("done_targets", []),
+                )
+            except Stopped:
+                logger.info("job=%s reconcile stopped", job.job_id)
+                return
+            if report.get("drained"):
+                # Resuming the paused job skips the targets reconciled so far.
+                job.options["done_targets"] = list(report["targets"])
+                await self._save(job)
+                return
+            job.options.pop("done_targets", None)
+            await self._save(job)
+            if self._stop_statuses.get(job.job_id) == JOB_PAUSED:
+                # A drain that came after the last target: the job is done.
+                del self._stop_statuses[job.job_id]
+        finally:
+            await client.disconnect()
+
+    def health(self) -> dict[str, dict[str, Any]]:
+        return {job_id: heartbeat.snapshot() for job_id, heartbeat in self._heartbeats.items()}
+
+
+def _job_payload(job: Job) -> dict[str, Any]:
+    state = load_state(job.state_path)
+    payload = job.to_dict()
+    payload["total_titles"] = count_state_titles(state)
+    payload["current_index"] = int(state.get("current_index", 0))
+    payload["titles_done"] = done_count(state)
+    payload["phase"] = state.get("phase")
+    payload["last_title"] = state.get("last_title", "")
+    payload["sent_total"] = state.get("sent_total", 0)
+    payload["retry_queue"] = len(state.get("retry_queue", []))
+    payload["failed"] = len(state.get("failed", []))
+    payload["stalls"] = state.get("stalls", 0)
+    payload["reconcile"] = state.get("reconcile")
+    payload["stages"] = state.get("stages")
+    payload["watchdog"] = run_manager.health().get(job.job_id)
+    return payload
+
+
+app = FastAPI(default_response_class=speedups.json_response_class())
 run_manager = RunManager()
 
 
+@app.on_event("startup")
+async def resume_jobs() -> None:
+    await run_manager.recover()
+
+
 @app.get("/")
 async def index() -> FileResponse:
     static_path = Path(__file__).parent / "static" / "index.html"
@@ -156,21 +428,30 @@ async def api_status() -> dict[str, Any]:
     config = load_config()
     state = load_state(config.state_path)
     status = run_manager.status()
-    total_titles = len(state.get("titles", []))
+    total_titles = count_state_titles(state)
     return {
         "state": state,
         "summary": {
             "phase": state.get("phase"),
             "current_index": int(state.get("current_index", 0)),
+            "titles_done": done_count(state),
             "total_titles": total_titles,
             "last_title": state.get("last_title", ""),
             "sent_total": state.get("sent_total", 0),
             "last_media_message_id": state.get("last_media_message_id", 0),
+            "retry_queue": len(state.get("retry_queue", [])),
+            "failed": state.get("failed", []),
+            "targets": targets_summary(state),
+            "stalls": state.get("stalls", 0),
+            "reconcile": state.get("reconcile"),
+            "stages": state.get("stages"),
         },
         "run_manager": {
             "running": status.running,
             "started_at": status.started_at,
             "last_error": status.last_error,
+            "running_jobs": run_manager.running_job_ids(),
+            "watchdog": run_manager.health(),
         },
     }
 
@@ -182,15 +463,23 @@ async def api_run_one(payload: RunOneRequest) -> dict[str, Any]:
     if not bot_username:
         raise HTTPException(status_code=400, detail="bot_username is required")
 
-    state = load_state(config.state_path)
-    state["titles"] = [payload.title]
-    state["current_index"] = 0
-    save_state(config.state_path, state)
-
-    started = await run_manager.start([payload.title], bot_username, payload.inline)
-    if not started:
+    if run_manager.has_active_job(config.state_path):
         raise HTTPException(status_code=409, detail="already_running")
-    return {"ok": True}
+
+    titles_path = sidecar_titles_path(config.state_path)
+    write_titles(titles_path, [payload.title])
+    await asyncio.to_thread(_reset_titles_cursor, config.state_path, titles_path)
+
+    job = await asyncio.to_thread(
+        run_manager.store.create,
+        titles_path=titles_path,
+        bot_username=bot_username,
+        session_name=config.session_name,
+        inline=payload.inline,
+        state_path=config.state_path,
+    )
+    await run_manager.submit(job)
+    return {"ok": True, "job_id": job.job_id}
 
 
 @app.post("/api/run/list")
@@ -200,35 +489,151 @@ async def api_run_list(payload: RunListRequest) -> dict[str, Any]:
     if not bot_username:
         raise HTTPException(status_code=400, detail="bot_username is required")
 
-    state = load_state(config.state_path)
+    if run_manager.has_active_job(config.state_path):
+        raise HTTPException(status_code=409, detail="already_running")
+
+    titles_path, count = _prepare_titles(payload, sidecar_titles_path(config.state_path))
+    await asyncio.to_thread(_reset_titles_cursor, config.state_path, titles_path)
+
+    job = await asyncio.to_thread(
+        run_manager.store.create,
+        titles_path=titles_path,
+        bot_username=bot_username,
+        session_name=config.session_name,
+        follow=payload.follow,
+        inline=payload.inline,
+        state_path=config.state_path,
+    )
+    await run_manager.submit(job)
+    return {"ok": True, "count": count, "job_id": job.job_id}
+
+
+def _prepare_titles(payload: RunListRequest, inline_path: str) -> tuple[str, int]:
     if payload.titles is not None:
-        titles = payload.titles
-    else:
-        titles_path = payload.titles_file or config.titles_path
-        titles = load_titles(titles_path)
+        return inline_path, write_titles(inline_path, payload.titles)
+    config = load_config()
+    titles_path = payload.titles_file or config.titles_path
+    if not Path(titles_path).exists():
+        raise HTTPException(status_code=400, detail="titles_file_not_found")
+    titles = TitleIndex(titles_path)
+    try:
+        return titles_path, len(titles)
+    finally:
+        titles.close()
 
-    state["titles"] = titles
-    state["current_index"] = 0
-    save_state(config.state_path, state)
 
-    started = await run_manager.start(titles, bot_username, payload.inline)
-    if not started:
-        raise HTTPException(status_code=409, detail="already_running")
-    return {"ok": True, "count": len(titles)}
+def _reset_titles_cursor(state_path: str, titles_path: str) -> None:
+    state = load_state(state_path)
+    reset_state_titles(state, titles_path)
+    save_state(state_path, state)
+
+
+@app.get("/api/jobs")
+async def api_jobs() -> dict[str, Any]:
+    return {"jobs": [_job_payload(job) for job in run_manager.store.list()]}
+
+
+@app.post("/api/jobs")
+async def api_create_job(payload: JobCreateRequest) -> dict[str, Any]:
+    config = load_config()
+    bot_username = payload.bot_username or config.bot_username
+    if not bot_username:
+        raise HTTPException(status_code=400, detail="bot_username is required")
+
+    job_id = run_manager.store.new_job_id()
+    titles_path, _ = _prepare_titles(payload, run_manager.store.titles_path_for(job_id))
+    job = await asyncio.to_thread(
+        run_manager.store.create,
+        job_id=job_id,
+        titles_path=titles_path,
+        bot_username=bot_username,
+        session_name=payload.session_name or config.session_name,
+        follow=payload.follow,
+        inline=payload.inline,
+        priority=payload.priority,
+    )
+    await asyncio.to_thread(_reset_titles_cursor, job.state_path, titles_path)
+    await run_manager.submit(job)
+    return {"ok": True, "job": _job_payload(job)}
+
+
+def _get_job_or_404(job_id: str) -> Job:
+    job = run_manager.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job_not_found")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+async def api_get_job(job_id: str) -> dict[str, Any]:
+    return {"job": _job_payload(_get_job_or_404(job_id))}
+
+
+@app.patch("/api/jobs/{job_id}")
+async def api_update_job(job_id: str, payload: JobUpdateRequest) -> dict[str, Any]:
+    job = _get_job_or_404(job_id)
+    job.priority = payload.priority
+    await asyncio.to_thread(run_manager.store.save, job)
+    await run_manager.schedule()
+    return {"ok": True, "job": _job_payload(job)}
+
+
+@app.delete("/api/jobs/{job_id}")
+async def api_delete_job(job_id: str) -> dict[str, Any]:
+    _get_job_or_404(job_id)
+    await run_manager.cancel(job_id)
+    return {"ok": True}
+
+
+@app.post("/api/jobs/{job_id}/pause")
+async def api_pause_job(job_id: str, drain: bool = False) -> dict[str, Any]:
+    _get_job_or_404(job_id)
+    job = await run_manager.pause(job_id, drain=drain)
+    return {"ok": True, "job": _job_payload(job)}
+
+
+@app.post("/api/jobs/{job_id}/resume")
+async def api_resume_job(job_id: str) -> dict[str, Any]:
+    job = _get_job_or_404(job_id)
+    if job.status in {JOB_DONE, JOB_RUNNING}:
+        raise HTTPException(status_code=409, detail=f"job_{job.status}")
+    job = await run_manager.resume(job_id)
+    return {"ok": True, "job": _job_payload(job)}
+
+
+@app.post("/api/titles/append")
+async def api_titles_append(
+    request: Request,
+    job_id: str | None = Query(default=None),
+) -> dict[str, Any]:
+    try:
+        titles = parse_ndjson_titles((await request.body()).decode("utf-8"))
+    except (UnicodeDecodeError, ValueError) as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    if job_id is not None:
+        titles_path = _get_job_or_404(job_id).titles_path
+    else:
+        config = load_config()
+        state = load_state(config.state_path)
+        titles_path = state.get("titles_path") or config.titles_path
+
+    appended = append_titles(titles_path, titles)
+    logger.info("appended %s/%s titles to %s", appended, len(titles), titles_path)
+    return {"ok": True, "received": len(titles), "appended": appended}
 
 
 @app.post("/api/stop")
-async def api_stop() -> dict[str, Any]:
-    await run_manager.stop()
+async def api_stop(drain: bool = False) -> dict[str, Any]:
+    await run_manager.stop(drain=drain)
     return {"ok": True}
 
 
 @app.post("/api/reset")
 async def api_reset() -> dict[str, Any]:
-    status = run_manager.status()
-    if status.running:
-        raise HTTPException(status_code=409, detail="already_running")
     config = load_config()
+    if run_manager.has_active_job(config.state_path):
+        raise HTTPException(status_code=409, detail="already_running")
     state_path = Path(config.state_path)
     if state_path.exists():
         state_path.unlink()
@@ -238,7 +643,70 @@ async def api_reset() -> dict[str, Any]:
     return {"ok": True}
 
 
+@app.post("/api/reconcile")
+async def api_reconcile(payload: ReconcileRequest) -> dict[str, Any]:
+    config = load_config()
+    if not config.catalog_path:
+        raise HTTPException(status_code=400, detail="Catalog is disabled")
+    if not config.target_chat_id:
+        raise HTTPException(status_code=400, detail="TARGET_CHAT_ID is required")
+
+    job = await asyncio.to_thread(
+        run_manager.store.create,
+        titles_path="",
+        bot_username="",
+        session_name=payload.session_name or config.session_name,
+        state_path=config.state_path,
+        kind=KIND_RECONCILE,
+        options={"warm": payload.warm, "deliver": payload.deliver},
+    )
+    await run_manager.submit(job)
+    return {"ok": True, "job_id": job.job_id}
+
+
+@app.get("/api/catalog")
+async def api_catalog(
+    title: str | None = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    offset: int = Query(default=0, ge=0),
+) -> dict[str, Any]:
+    config = load_config()
+    if not config.catalog_path:
+        raise HTTPException(status_code=404, detail="Catalog is disabled")
+    catalog = Catalog(config.catalog_path)
+    try:
+        if title:
+            total, items = catalog.episodes(title, limit=limit, offset=offset)
+        else:
+            total, items = catalog.titles(limit=limit, offset=offset)
+    finally:
+        catalog.close()
+    return {"total": total, "limit": limit, "offset": offset, "items": items}
+
+
+@app.get("/api/profiles")
+async def api_profiles() -> dict[str, Any]:
+    config = load_config()
+    return {"profiles": [profile.summary(config) for profile in list_profiles(config)]}
+
+
 @app.get("/api/logs")
-async def api_logs(tail: int = Query(default=200, ge=1, le=2000)) -> dict[str, Any]:
-    lines = list(LOG_BUFFER)[-tail:]
-    return {"lines": lines}
+async def api_logs(
+    tail: int = Query(default=200, ge=1, le=2000),
+    level: str | None = None,
+    title: str | None = None,
+    cursor: int = Query(default=0, ge=0),
+) -> dict[str, Any]:
+    levelno = logging.NOTSET
+    if level:
+        levelno = logging.getLevelName(level.upper())
+        if not isinstance(levelno, int):
+            raise HTTPException(status_code=400, detail=f"Unknown log level: {level}")
+    records, next_cursor = LOG_BUFFER.query(
+        level=levelno, title=title, after=cursor, limit=tail
+    )
+    return {
+        "lines": [_log_formatter.format(record) for _, record in records],
+        "records": [{"seq": seq, **record_fields(record)} for seq, record in records],
+        "cursor": next_cursor,
+    }
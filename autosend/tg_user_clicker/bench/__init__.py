@@ -0,0 +1 @@
+"""Micro-benchmarks for the hot helpers and the state layer."""
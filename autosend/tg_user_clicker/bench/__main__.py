@@ -0,0 +1,91 @@
+"""Run the micro-benchmarks and compare them with the stored baselines.
+
+    python -m bench                      # everything
+    python -m bench dedup titles         # names containing any of the words
+    python -m bench --update             # store the results as new baselines
+    python -m bench --fail-on-regression 1.5
+    python -m bench cli                  # imports and import time of quick commands
+
+Timings are the best of several rounds, in seconds per call. A case that
+fails its check always exits with 1. Baselines in
+``bench/baselines.json`` are machine specific; refresh them with
+``--update`` on the machine that compares against them.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+import sys
+
+from bench.cases import CASES, Failed, Skip, measure
+
+BASELINES_PATH = Path(__file__).with_name("baselines.json")
+
+
+def _format_seconds(seconds: float) -> str:
+    for unit, scale in (("s", 1.0), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1e-9:8.2f} ns"
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks")
+    parser.add_argument("filters", nargs="*", help="Only run benchmarks whose name contains one")
+    parser.add_argument("--update", action="store_true", help="Write results to baselines.json")
+    parser.add_argument(
+        "--fail-on-regression",
+        type=float,
+        metavar="RATIO",
+        help="Exit with 1 when a benchmark is RATIO times slower than its baseline",
+    )
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds per benchmark")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    baselines = {}
+    if BASELINES_PATH.exists():
+        baselines = json.loads(BASELINES_PATH.read_text(encoding="utf-8"))
+
+    results: dict[str, float] = {}
+    regressions = []
+    for name, case in CASES.items():
+        if args.filters and not any(word in name for word in args.filters):
+            continue
+        try:
+            seconds = measure(case, rounds=args.rounds)
+        except Skip as exc:
+            print(f"{name:<46} skipped: {exc}")
+            continue
+        except Failed as exc:
+            print(f"{name:<46} FAILED: {exc}", flush=True)
+            regressions.append(name)
+            continue
+        results[name] = seconds
+        baseline = baselines.get(name)
+        line = f"{name:<46} {_format_seconds(seconds)}"
+        if baseline:
+            ratio = seconds / baseline
+            line += f"   baseline {_format_seconds(baseline)}   x{ratio:.2f}"
+            if args.fail_on_regression and ratio > args.fail_on_regression:
+                regressions.append(name)
+                line += "   REGRESSION"
+        print(line, flush=True)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+    if args.update:
+        baselines.update({name: round(seconds, 9) for name, seconds in results.items()})
+        BASELINES_PATH.write_text(
+            json.dumps(dict(sorted(baselines.items())), indent=2) + "\n", encoding="utf-8"
+        )
+        print(f"baselines updated: {BASELINES_PATH}")
+    if regressions:
+        print(f"regressed: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
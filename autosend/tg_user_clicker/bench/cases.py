@@ -0,0 +1,241 @@
+"""Benchmark cases.
+
+Each case is a setup function returning the zero-argument callable to time;
+setup cost (building keyboards, writing fixture files) is not measured. A
+setup raises ``Failed`` when a hard requirement does not hold, which fails
+the run whatever the baselines.
+"""
+from __future__ import annotations
+
+import asyncio
+import atexit
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+from typing import Any, Callable
+
+from app.buttons import ButtonMatcher, find_button, normalize_text
+from app.state import dedup_add, dedup_has, load_state, save_state
+from app.titles import load_titles
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+
+Setup = Callable[[], Callable[[], Any]]
+CASES: dict[str, Setup] = {}
+
+# Quick commands (``status``, ``reset``, ``--help``) must not import these,
+# and their own imports (``-X importtime``, interpreter startup excluded)
+# must stay within the budget.
+CLI_FORBIDDEN_IMPORTS = ("telethon", "asyncio")
+CLI_IMPORT_BUDGET_SECONDS = 0.1
+
+_workdir: Path | None = None
+
+
+class Skip(Exception):
+    """Raised by a setup when the benchmark cannot run here."""
+
+
+class Failed(Exception):
+    """Raised by a setup when what it measures is broken, not just slow."""
+
+
+def case(name: str) -> Callable[[Setup], Setup]:
+    def register(setup: Setup) -> Setup:
+        CASES[name] = setup
+        return setup
+
+    return register
+
+
+def workdir() -> Path:
+    global _workdir
+    if _workdir is None:
+        _workdir = Path(tempfile.mkdtemp(prefix="bench-"))
+        atexit.register(shutil.rmtree, _workdir, True)
+    return _workdir
+
+
+def measure(setup: Setup, *, rounds: int = 5) -> float:
+    """Best seconds per call over ``rounds``, each long enough to be timed."""
+    timer = timeit.Timer(setup())
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=max(1, rounds), number=number)) / number
+
+
+class _Button:
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.data = b"x"
+
+
+class _Message:
+    def __init__(self, buttons: list[list[_Button]]) -> None:
+        self.buttons = buttons
+
+
+@case("buttons.normalize_text")
+def bench_normalize_text() -> Callable[[], Any]:
+    text = "  Декстер: Новая Кровь (2021) — Сезон 1, серия 10 ёлка!!  "
+    return lambda: normalize_text(text)
+
+
+@case("buttons.find_button 100x8 keyboard")
+def bench_find_button() -> Callable[[], Any]:
+    rows = [[_Button(f"Серия {row * 8 + col} — ещё текст") for col in range(8)] for row in range(100)]
+    rows[-1][-1] = _Button("Вперёд ▶")
+    message = _Message(rows)
+    return lambda: find_button(message, "Вперёд")
+
+
+@case("buttons.ButtonMatcher learned 100x8 keyboard")
+def bench_button_matcher() -> Callable[[], Any]:
+    rows = [[_Button(f"Серия {row * 8 + col} — ещё текст") for col in range(8)] for row in range(100)]
+    rows[-1][-1] = _Button("Вперёд ▶")
+    message = _Message(rows)
+    matcher = ButtonMatcher("Вперёд")
+    matcher.find(message)
+    return lambda: matcher.find(message)
+
+
+def _dedup_cases(size: int) -> None:
+    label = f"{size // 1000}k" if size < 1_000_000 else f"{size // 1_000_000}M"
+
+    @case(f"state.dedup_has miss {label}")
+    def bench_has() -> Callable[[], Any]:
+        state = {"sent_ids": list(range(size))}
+        return lambda: dedup_has(state, -1)
+
+    @case(f"state.dedup_add {label}")
+    def bench_add() -> Callable[[], Any]:
+        state = {"sent_ids": list(range(size))}
+        counter = iter(range(size, size * 1000))
+        return lambda: dedup_add(state, next(counter), size)
+
+
+for _size in (2_000, 100_000, 1_000_000):
+    _dedup_cases(_size)
+
+
+def _large_state(titles: int) -> dict[str, Any]:
+    state = load_state(str(workdir() / "missing.json"))
+    state["titles"] = [f"Title number {index} (2024)" for index in range(titles)]
+    state["sent_ids"] = list(range(2_000))
+    return state
+
+
+@case("state.save_state 100k titles")
+def bench_save_state() -> Callable[[], Any]:
+    path = str(workdir() / "save.json")
+    state = _large_state(100_000)
+    return lambda: save_state(path, state)
+
+
+@case("state.load_state 100k titles")
+def bench_load_state() -> Callable[[], Any]:
+    path = str(workdir() / "load.json")
+    save_state(path, _large_state(100_000))
+    return lambda: load_state(path)
+
+
+@case("titles.load_titles 1M lines")
+def bench_load_titles() -> Callable[[], Any]:
+    path = workdir() / "titles-1m.txt"
+    with path.open("w", encoding="utf-8") as handle:
+        for index in range(1_000_000):
+            handle.write(f"Title number {index} (2024)\n" if index % 50 else "# comment\n")
+    return lambda: load_titles(str(path))
+
+
+@case("web./api/status 50 concurrent clients")
+def bench_api_status() -> Callable[[], Any]:
+    for name in ("TG_API_ID", "TG_API_HASH", "TG_PHONE"):
+        os.environ.setdefault(name, "1")
+    state_path = str(workdir() / "status.json")
+    save_state(state_path, _large_state(1_000))
+    os.environ["STATE_PATH"] = state_path
+    os.environ["JOBS_DIR"] = str(workdir() / "jobs")
+    try:
+        from app.web.server import api_status
+    except ImportError as exc:
+        raise Skip(f"{exc.name} is not installed") from exc
+
+    async def clients() -> None:
+        await asyncio.gather(*(api_status() for _ in range(50)))
+
+    return lambda: asyncio.run(clients())
+
+
+def _import_trace(module: str, *args: str, env: dict[str, str]) -> list[tuple[str, int, int]]:
+    """``(name, cumulative microseconds, depth)`` of each import of ``python -m module``."""
+    try:
+        traced = subprocess.run(
+            [sys.executable, "-X", "importtime", "-m", module, *args],
+            cwd=PROJECT_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+        )
+    except subprocess.CalledProcessError as exc:
+        last = exc.stderr.strip().splitlines()[-1:] or [f"exit code {exc.returncode}"]
+        raise Failed(f"python -m {module} {' '.join(args)} failed: {last[0]}") from exc
+    trace = []
+    for line in traced.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            trace.append((name.strip(), int(cumulative), depth))
+    return trace
+
+
+def _cli_command(*args: str) -> Callable[[], Any]:
+    env = dict(os.environ)
+    for name in ("TG_API_ID", "TG_API_HASH", "TG_PHONE"):
+        env.setdefault(name, "1")
+    env["STATE_PATH"] = str(workdir() / "cli-state.json")
+
+    startup = {name for name, _, _ in _import_trace("site", env=env)}
+    traces = [_import_trace("app.cli", *args, env=env) for _ in range(3)]
+    imported = {name.split(".")[0] for name, _, _ in traces[0]}
+    forbidden = sorted(imported & set(CLI_FORBIDDEN_IMPORTS))
+    if forbidden:
+        raise Failed(f"imports {', '.join(forbidden)}")
+    # Nested imports are already counted in their top-level parent.
+    own = min(
+        sum(us for name, us, depth in trace if depth == 0 and name not in startup)
+        for trace in traces
+    ) / 1e6
+    if own > CLI_IMPORT_BUDGET_SECONDS:
+        raise Failed(
+            f"imports take {own * 1e3:.0f} ms, budget {CLI_IMPORT_BUDGET_SECONDS * 1e3:.0f} ms"
+        )
+
+    command = [sys.executable, "-m", "app.cli", *args]
+
+    def run() -> None:
+        subprocess.run(command, cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL, check=True)
+
+    return run
+
+
+@case("cli --help startup")
+def bench_cli_startup() -> Callable[[], Any]:
+    return _cli_command("--help")
+
+
+@case("cli status startup")
+def bench_cli_status() -> Callable[[], Any]:
+    return _cli_command("status")
+
+
+@case("cli reset startup")
+def bench_cli_reset() -> Callable[[], Any]:
+    return _cli_command("reset", "--yes")
@@ -0,0 +1,64 @@
+import asyncio
+import json
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, AsyncIterator
+
+from app.archive import MANIFEST_NAME, Archiver
+
+CHUNK = 4
+BLOB = b"0123456789abcdef"
+
+
+class BlobClient:
+    """In-memory client whose media are byte strings served in chunks."""
+
+    def __init__(self) -> None:
+        self.requested_offsets: list[int] = []
+
+    async def iter_download(
+        self, media: bytes, *, offset: int = 0, request_size: int = CHUNK
+    ) -> AsyncIterator[bytes]:
+        self.requested_offsets.append(offset)
+        for start in range(offset, len(media), request_size):
+            await asyncio.sleep(0)
+            yield media[start:start + request_size]
+
+
+def _message(msg_id: int, blob: bytes = BLOB) -> Any:
+    return SimpleNamespace(
+        id=msg_id,
+        chat_id=1,
+        media=blob,
+        file=SimpleNamespace(name=f"ep{msg_id}.mp4", ext=".mp4", size=len(blob)),
+        document=SimpleNamespace(id=msg_id * 10),
+    )
+
+
+def test_downloads_resume_from_part_file(tmp_path: Path) -> None:
+    client = BlobClient()
+    state: dict[str, Any] = {}
+    saves: list[int] = []
+    archiver = Archiver(
+        client, str(tmp_path), state=state, save=lambda: saves.append(1), chunk_size=CHUNK
+    )
+    part = tmp_path / "Show" / "001 ep1.mp4.part"
+    part.parent.mkdir()
+    part.write_bytes(BLOB[:6])
+
+    async def scenario() -> None:
+        archiver.start()
+        archiver.submit(_message(1), "Show", 1)
+        archiver.submit(_message(2), "Show", 2)
+        assert not saves
+        await archiver.close()
+
+    asyncio.run(scenario())
+
+    assert (tmp_path / "Show" / "001 ep1.mp4").read_bytes() == BLOB
+    assert (tmp_path / "Show" / "002 ep2.mp4").read_bytes() == BLOB
+    assert sorted(client.requested_offsets) == [0, CHUNK]
+    assert state["archive_pending"] == []
+    assert saves
+    manifest = (tmp_path / MANIFEST_NAME).read_text(encoding="utf-8").splitlines()
+    assert sorted(json.loads(line)["msg_id"] for line in manifest) == [1, 2]
@@ -0,0 +1,119 @@
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("telethon")
+
+from app.jobs import JOB_DONE, JOB_PAUSED, JobStore  # noqa: E402
+from app.state import save_state  # noqa: E402
+from app.titles import write_titles  # noqa: E402
+from app.web import server  # noqa: E402
+
+TITLES = [f"Title {number}" for number in range(20)]
+
+
+class FakeClient:
+    """In-memory client: every title the runner sends lands in ``sent``."""
+
+    def __init__(self) -> None:
+        self.sent: list[str] = []
+
+    async def connect(self) -> None:
+        return None
+
+    async def disconnect(self) -> None:
+        return None
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def send_message(self, entity: Any, message: str) -> None:
+        self.sent.append(message)
+        await asyncio.sleep(0.01)
+
+
+async def fake_run_titles(
+    client: FakeClient,
+    bot_username: str,
+    titles: Any,
+    state: dict[str, Any],
+    *,
+    stop_event: asyncio.Event,
+    state_path: str,
+    **_: Any,
+) -> dict[str, Any]:
+    while state["current_index"] < len(titles) and not stop_event.is_set():
+        await client.send_message(bot_username, titles[state["current_index"]])
+        state["current_index"] += 1
+        save_state(state_path, state)
+    return {}
+
+
+@pytest.fixture
+def client() -> FakeClient:
+    return FakeClient()
+
+
+@pytest.fixture
+def manager(
+    client: FakeClient, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> server.RunManager:
+    config = SimpleNamespace(session_mode="memory", target_chat_id="-100", stall_min_seconds=0)
+    monkeypatch.setattr(server, "load_config", lambda: config)
+    monkeypatch.setattr(server, "get_client", lambda session_name: client)
+    monkeypatch.setattr(server, "run_titles", fake_run_titles)
+    return server.RunManager(JobStore(str(tmp_path / "jobs")))
+
+
+def _create(manager: server.RunManager, tmp_path: Path) -> Any:
+    titles_path = str(tmp_path / "titles.txt")
+    write_titles(titles_path, TITLES)
+    return manager.store.create(titles_path=titles_path, bot_username="@bot", session_name="s")
+
+
+async def _finished(manager: server.RunManager) -> None:
+    while manager.running_job_ids():
+        await asyncio.sleep(0.01)
+
+
+def test_submit_pause_resume(
+    manager: server.RunManager, client: FakeClient, tmp_path: Path
+) -> None:
+    async def scenario() -> None:
+        job = _create(manager, tmp_path)
+        await manager.submit(job)
+        await asyncio.sleep(0.05)
+
+        paused = await manager.pause(job.job_id)
+        assert paused.status == JOB_PAUSED
+        sent = len(client.sent)
+        assert 0 < sent < len(TITLES)
+        await asyncio.sleep(0.05)
+        assert len(client.sent) == sent
+
+        await manager.resume(job.job_id)
+        await asyncio.wait_for(_finished(manager), timeout=5)
+        assert manager.store.get(job.job_id).status == JOB_DONE
+        assert client.sent == TITLES
+
+    asyncio.run(scenario())
+
+
+def test_cancel_stops_and_deletes_job(
+    manager: server.RunManager, client: FakeClient, tmp_path: Path
+) -> None:
+    async def scenario() -> None:
+        job = _create(manager, tmp_path)
+        await manager.submit(job)
+        await asyncio.sleep(0.05)
+
+        assert await manager.cancel(job.job_id)
+        assert not manager.running_job_ids()
+        assert manager.store.get(job.job_id) is None
+        assert len(client.sent) < len(TITLES)
+
+    asyncio.run(scenario())
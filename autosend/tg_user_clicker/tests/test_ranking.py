@@ -0,0 +1,38 @@
+from app.ranking import ResultIndex, parse_title, pick_best, score
+
+PICK_MIN_SCORE = 0.6
+
+
+def _index(*labels: str) -> ResultIndex:
+    return ResultIndex((label, label, "") for label in labels)
+
+
+def test_decorated_label_scores_as_exact_match() -> None:
+    label = "X (2010) 10 сезонов, 283 серии"
+    assert score(parse_title("X"), parse_title(label)) == 1.0
+
+
+def test_single_decorated_result_is_picked() -> None:
+    label = "Декстер (2006) 8 сезонов, 96 серий"
+    best = pick_best(_index(label), "Декстер", min_score=PICK_MIN_SCORE)
+    assert best is not None
+    assert best.key == label
+
+
+def test_single_unrelated_result_is_rejected() -> None:
+    assert pick_best(_index("Y (2010) 283 серии"), "X", min_score=PICK_MIN_SCORE) is None
+
+
+def test_plural_season_forms_are_parsed() -> None:
+    assert parse_title("X 10 сезонов").season == 10
+    assert parse_title("X 2 сезона").season == 2
+    assert parse_title("X 3 seasons").season == 3
+
+
+def test_season_mismatch_is_penalized() -> None:
+    index = _index("X 3 сезона", "X 2 сезона")
+    assert pick_best(index, "X 2 сезон", min_score=PICK_MIN_SCORE).key == "X 2 сезона"
+
+
+def test_extra_title_words_still_lower_the_score() -> None:
+    assert score(parse_title("Dexter"), parse_title("Dexter New Blood")) < PICK_MIN_SCORE
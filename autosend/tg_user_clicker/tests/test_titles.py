@@ -0,0 +1,30 @@
+from pathlib import Path
+
+from app.titles import TitleIndex, append_titles, write_titles
+
+
+def _titles(index: TitleIndex) -> list[str]:
+    return [index[position] for position in range(len(index))]
+
+
+def test_retagged_title_updates_existing_entry(tmp_path: Path) -> None:
+    path = str(tmp_path / "titles.txt")
+    write_titles(path, ["A | priority=1", "B", "a | priority=5"])
+    index = TitleIndex(path)
+    try:
+        assert _titles(index) == ["a | priority=5", "B"]
+    finally:
+        index.close()
+
+
+def test_append_retags_instead_of_queueing_twice(tmp_path: Path) -> None:
+    path = str(tmp_path / "titles.txt")
+    write_titles(path, ["A", "B | bot=@x"])
+    index = TitleIndex(path, follow=True)
+    try:
+        assert append_titles(path, ["B | bot=@x"]) == 0
+        assert append_titles(path, ["B | bot=@y", "C"]) == 2
+        assert index.refresh() == 1
+        assert _titles(index) == ["A", "B | bot=@y", "C"]
+    finally:
+        index.close()